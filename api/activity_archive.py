@@ -0,0 +1,242 @@
+from datetime import date, datetime, time, timedelta
+
+import click
+from sqlalchemy import Column, Index, MetaData, Table, func, literal, select, text, union_all, update
+from sqlalchemy.orm import aliased
+from sqlalchemy.types import Date
+
+# Kept as raw rows for good when their month is rolled up; both apps' names for each event
+SECURITY_ACTIONS = (
+    'login', 'logout', 'failed_login',
+    'password_change', 'changed_password', 'password_reset', 'reset_password', 'password_reset_by_admin',
+    'user_created', 'created_user', 'user_updated', 'updated_user', 'user_deleted', 'deleted_user',
+    'permissions_updated', 'exported_activity_log',
+)
+
+PARTITION_PREFIX = 'activity_logs_'
+
+# Parent of the monthly partitions on PostgreSQL
+ARCHIVE_TABLE = 'activity_logs_archive'
+
+# Same indexes as the hot table, named per partition since SQLite index names are database-wide
+PARTITION_INDEXES = (
+    ('timestamp', ('timestamp',)),
+    ('user_id_timestamp', ('user_id', 'timestamp')),
+    ('action_timestamp', ('action', 'timestamp')),
+)
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+class ActivityArchive:
+    """Keeps activity_logs to a hot window, with older rows in monthly partitions and daily counts
+
+    archive() moves rows older than ACTIVITY_LOG_HOT_DAYS out of the hot table
+    into a table per month (activity_logs_YYYY_MM): plain tables on SQLite,
+    partitions of activity_logs_archive on PostgreSQL. roll_up() folds months
+    older than ACTIVITY_LOG_RETENTION_DAYS into per-day, per-user, per-action
+    counts in the daily model, then deletes their raw rows except
+    ACTIVITY_LOG_RETAINED_ACTIONS. Both work in small transactions and record
+    their progress, so they can run while the app is serving and be
+    interrupted at any point.
+
+    source() gives the entity to query the log with: the model itself until
+    anything has been archived, then an alias of it over a UNION ALL of the
+    hot table and the partitions a date range touches.
+    """
+
+    def __init__(self, db, model, partition_model, daily_model):
+        self.db = db
+        self.model = model
+        self.partition_model = partition_model
+        self.daily_model = daily_model
+        self.hot_days = 90
+        self.retention_days = 365
+        self.retained_actions = SECURITY_ACTIONS
+        self.batch_size = 2000
+        self._metadata = MetaData()
+
+    def init_app(self, app):
+        app.config.setdefault('ACTIVITY_LOG_HOT_DAYS', 90)
+        app.config.setdefault('ACTIVITY_LOG_RETENTION_DAYS', 365)
+        app.config.setdefault('ACTIVITY_LOG_RETAINED_ACTIONS', SECURITY_ACTIONS)
+        app.config.setdefault('ACTIVITY_LOG_COMPACT_BATCH_SIZE', 2000)
+
+        self.hot_days = app.config['ACTIVITY_LOG_HOT_DAYS']
+        self.retention_days = app.config['ACTIVITY_LOG_RETENTION_DAYS']
+        self.retained_actions = tuple(app.config['ACTIVITY_LOG_RETAINED_ACTIONS'])
+        self.batch_size = app.config['ACTIVITY_LOG_COMPACT_BATCH_SIZE']
+
+        app.extensions['activity_archive'] = self
+
+    def _table(self, name, primary_key=True, **kwargs):
+        if name in self._metadata.tables:
+            return self._metadata.tables[name]
+        columns = [
+            Column(column.name, column.type, primary_key=primary_key and column.primary_key, nullable=column.nullable)
+            for column in self.model.__table__.columns
+        ]
+        indexes = [Index(f'ix_{name}_{suffix}', *names) for suffix, names in PARTITION_INDEXES]
+        return Table(name, self._metadata, *columns, *indexes, **kwargs)
+
+    def _archive_table(self):
+        # Primary keys on a partitioned table must include the partition key, so it has none
+        return self._table(ARCHIVE_TABLE, primary_key=False, postgresql_partition_by='RANGE (timestamp)')
+
+    def _partition(self, connection, month):
+        """Create the partition for month if needed and return the table to insert its rows into"""
+        name = f'{PARTITION_PREFIX}{month:%Y_%m}'
+        if connection.dialect.name == 'postgresql':
+            target = self._archive_table()
+            target.create(connection, checkfirst=True)
+            connection.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {ARCHIVE_TABLE} "
+                f"FOR VALUES FROM ('{month}') TO ('{next_month(month)}')"
+            ))
+        else:
+            target = self._table(name)
+            target.create(connection, checkfirst=True)
+
+        registry = self.partition_model.__table__
+        if connection.execute(select(registry.c.name).where(registry.c.name == name)).first() is None:
+            connection.execute(registry.insert().values(name=name, month=month))
+        return target
+
+    def partitions(self, start=None, end=None):
+        """Registry rows of the partitions holding activity between start and end, oldest first"""
+        partition = self.partition_model
+        query = select(partition).order_by(partition.month)
+        if end is not None:
+            query = query.where(partition.month <= end)
+        partitions = self.db.session.execute(query).scalars().all()
+        if start is not None:
+            partitions = [p for p in partitions if next_month(p.month) > start.date()]
+        return partitions
+
+    def source(self, start=None, end=None):
+        """The entity to query activity between start and end with; filter its timestamp for the range itself"""
+        partitions = self.partitions(start, end)
+        if not partitions:
+            return self.model
+
+        hot = self.model.__table__
+        if self.db.session.get_bind().dialect.name == 'postgresql':
+            tables = [hot, self._archive_table()]
+        else:
+            tables = [hot] + [self._table(partition.name) for partition in partitions]
+        union = union_all(*[
+            select(*[table.c[column.name] for column in hot.columns]) for table in tables
+        ]).subquery('activity_logs_all')
+        return aliased(self.model, union, adapt_on_names=True)
+
+    def archive(self, now=None, batch_size=None):
+        """Move rows older than the hot window into their monthly partitions; returns the number moved"""
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self.hot_days)
+        batch_size = batch_size or self.batch_size
+        hot = self.model.__table__
+        columns = [column.name for column in hot.columns]
+        moved = 0
+        touched = set()
+
+        while True:
+            with self.db.engine.begin() as connection:
+                # The newest row always stays: SQLite would hand an emptied table's ids out again
+                newest = connection.execute(select(func.max(hot.c.id))).scalar()
+                rows = connection.execute(
+                    select(hot.c.id, hot.c.timestamp)
+                    .where(hot.c.timestamp < cutoff, hot.c.id < newest)
+                    .order_by(hot.c.timestamp)
+                    .limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+
+                months = {}
+                for row in rows:
+                    months.setdefault(month_start(row.timestamp), []).append(row.id)
+                for month, ids in months.items():
+                    target = self._partition(connection, month)
+                    connection.execute(target.insert().from_select(columns, select(*hot.columns).where(hot.c.id.in_(ids))))
+                    touched.add(target.name)
+                connection.execute(hot.delete().where(hot.c.id.in_([row.id for row in rows])))
+            moved += len(rows)
+
+        # Fresh partitions have no statistics, and without them SQLite sorts instead of merging their indexes
+        if touched and self.db.engine.dialect.name == 'sqlite':
+            with self.db.engine.begin() as connection:
+                for name in sorted(touched):
+                    connection.execute(text(f'ANALYZE {name}'))
+        return moved
+
+    def roll_up(self, now=None, batch_size=None):
+        """Fold partitions past the retention window into daily counts; returns (days rolled up, rows deleted)"""
+        cutoff = ((now or datetime.utcnow()) - timedelta(days=self.retention_days)).date()
+        batch_size = batch_size or self.batch_size
+        registry = self.partition_model.__table__
+        daily = self.daily_model.__table__
+        days = deleted = 0
+
+        with self.db.engine.connect() as connection:
+            partitions = connection.execute(
+                select(registry).where(registry.c.compacted_at.is_(None)).order_by(registry.c.month)
+            ).all()
+
+        for partition in partitions:
+            end = next_month(partition.month)
+            if end > cutoff:
+                break
+            table = self._table(partition.name)
+
+            # One day per transaction; rolled_up_through moves with the counts so no day is counted twice.
+            # Rows sum their event_count, since coalesced and sampled rows each stand for several events
+            day = partition.rolled_up_through + timedelta(days=1) if partition.rolled_up_through else partition.month
+            while day < end:
+                day_start = datetime.combine(day, time())
+                with self.db.engine.begin() as connection:
+                    connection.execute(daily.insert().from_select(
+                        ['day', 'user_id', 'action', 'event_count'],
+                        select(literal(day, Date), table.c.user_id, table.c.action, func.sum(table.c.event_count))
+                        .where(table.c.timestamp >= day_start, table.c.timestamp < day_start + timedelta(days=1))
+                        .group_by(table.c.user_id, table.c.action)
+                    ))
+                    connection.execute(
+                        update(registry).where(registry.c.name == partition.name).values(rolled_up_through=day)
+                    )
+                days += 1
+                day += timedelta(days=1)
+
+            while True:
+                with self.db.engine.begin() as connection:
+                    ids = select(table.c.id).where(table.c.action.not_in(self.retained_actions)).limit(batch_size)
+                    count = connection.execute(table.delete().where(table.c.id.in_(ids))).rowcount
+                deleted += count
+                if count < batch_size:
+                    break
+
+            with self.db.engine.begin() as connection:
+                connection.execute(
+                    update(registry).where(registry.c.name == partition.name).values(compacted_at=datetime.utcnow())
+                )
+
+        return days, deleted
+
+
+def register_compact_command(app, archive, after_compact):
+    """Add a 'flask compact-activity-log' command; after_compact() runs when anything changed"""
+
+    @app.cli.command('compact-activity-log')
+    @click.option('--batch-size', type=int, default=None, help='Rows per transaction.')
+    def compact_activity_log(batch_size):
+        """Archive activity older than the hot window and roll up months past retention"""
+        moved = archive.archive(batch_size=batch_size)
+        click.echo(f'Archived {moved:,} rows older than {archive.hot_days} days')
+        days, deleted = archive.roll_up(batch_size=batch_size)
+        click.echo(f'Rolled up {days:,} days older than {archive.retention_days} days, deleting {deleted:,} raw rows')
+        if moved or deleted:
+            after_compact()
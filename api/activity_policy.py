@@ -0,0 +1,101 @@
+import math
+import random
+import threading
+from fnmatch import fnmatchcase
+
+RECORD = 'record'
+SAMPLE = 'sample'
+COALESCE = 'coalesce'
+DROP = 'drop'
+
+# Page views are most of the log by volume and only matter as counts
+DEFAULT_POLICY = {'viewed_*': COALESCE}
+
+STAT_KEYS = {RECORD: 'recorded', COALESCE: 'coalesced', DROP: 'dropped'}
+
+
+class ActivityPolicy:
+    """Decides per action whether activity log entries are recorded, sampled, coalesced or dropped
+
+    ACTIVITY_LOG_POLICY maps action names or glob patterns ('viewed_*') to a
+    mode; an exact name wins over patterns, and actions matching nothing are
+    recorded. 'sample' keeps ACTIVITY_LOG_SAMPLE_RATE of the entries, each
+    with an integer event_count averaging 1/rate (rounded up or down at
+    random in proportion) so sums stay unbiased. 'coalesce' counts
+    the entries into one row per user, action and details in the background
+    writer. 'drop' logs nothing. Serverless instances can be frozen or
+    discarded before an open window is written, so with serverless=True
+    nothing is coalesced by default.
+
+    Actions in always_record are recorded whatever the configuration says,
+    so security events can never be sampled or dropped by a broad pattern.
+    """
+
+    def __init__(self, app=None, always_record=()):
+        self.policy = dict(DEFAULT_POLICY)
+        self.sample_rate = 0.1
+        self.always_record = frozenset(always_record)
+        self._modes = {}
+        self._lock = threading.Lock()
+        self.stats = {'recorded': 0, 'sampled_in': 0, 'sampled_out': 0, 'coalesced': 0, 'dropped': 0}
+
+        if app is not None:
+            self.init_app(app, always_record)
+
+    def init_app(self, app, always_record=(), serverless=False):
+        app.config.setdefault('ACTIVITY_LOG_POLICY', {} if serverless else DEFAULT_POLICY)
+        app.config.setdefault('ACTIVITY_LOG_SAMPLE_RATE', 0.1)
+
+        for action, mode in app.config['ACTIVITY_LOG_POLICY'].items():
+            if mode not in (RECORD, SAMPLE, COALESCE, DROP):
+                raise ValueError(f"Invalid ACTIVITY_LOG_POLICY mode for '{action}': {mode}")
+        if not 0 < app.config['ACTIVITY_LOG_SAMPLE_RATE'] <= 1:
+            raise ValueError(f"Invalid ACTIVITY_LOG_SAMPLE_RATE: {app.config['ACTIVITY_LOG_SAMPLE_RATE']}")
+
+        self.policy = dict(app.config['ACTIVITY_LOG_POLICY'])
+        self.sample_rate = app.config['ACTIVITY_LOG_SAMPLE_RATE']
+        self.always_record = frozenset(always_record)
+        self._modes = {}
+
+        app.extensions['activity_policy'] = self
+
+    def mode(self, action):
+        """The configured mode for action"""
+        mode = self._modes.get(action)
+        if mode is None:
+            if action in self.always_record:
+                mode = RECORD
+            elif action in self.policy:
+                mode = self.policy[action]
+            else:
+                mode = next(
+                    (mode for pattern, mode in self.policy.items() if fnmatchcase(action, pattern)), RECORD
+                )
+            self._modes[action] = mode
+        return mode
+
+    def decide(self, action):
+        """Return (mode, event_count) for one entry: mode is 'record', 'coalesce' or 'drop'"""
+        mode = self.mode(action)
+        if mode == SAMPLE:
+            if random.random() < self.sample_rate:
+                self._count('sampled_in')
+                return RECORD, self._sample_weight()
+            self._count('sampled_out')
+            return DROP, 0
+        self._count(STAT_KEYS[mode])
+        return mode, 1
+
+    def _count(self, key):
+        # Called from every request thread; += on a dict item is not atomic
+        with self._lock:
+            self.stats[key] += 1
+
+    def _sample_weight(self):
+        # event_count is an integer: carry the fraction of 1/rate over stochastically so its mean is exactly 1/rate
+        weight = 1 / self.sample_rate
+        whole = math.floor(weight)
+        return whole + (random.random() < weight - whole)
+
+
+activity_policy = ActivityPolicy()
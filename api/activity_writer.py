@@ -0,0 +1,255 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityLogWriter:
+    """Background writer that batches activity log rows into bulk inserts
+
+    Request handlers call enqueue(), which only appends to a bounded in-process
+    queue. A daemon thread drains the queue and inserts rows in batches of
+    ACTIVITY_LOG_BATCH_SIZE, at least every ACTIVITY_LOG_FLUSH_INTERVAL seconds.
+
+    When the queue is full, ACTIVITY_LOG_OVERFLOW decides what happens:
+    'block' waits up to ACTIVITY_LOG_ENQUEUE_TIMEOUT seconds for space and then
+    drops the entry, 'drop' discards it immediately, and 'sync' writes it
+    inline on the request thread. Pending rows are flushed on shutdown.
+    Serverless instances can be frozen or discarded without shutting down,
+    so init_app() with serverless=True defaults to writing every row inline.
+
+    Entries enqueued with coalesce=True are counted in memory instead, one row
+    per user, action and details, written with its event_count
+    ACTIVITY_LOG_COALESCE_SECONDS after its first event (or on flush). Its
+    ip_address is kept only when every event in the window shared it.
+
+    Callables in write_hooks run as hook(connection, rows) inside each insert
+    transaction, for bookkeeping that must commit together with the rows.
+    """
+
+    def __init__(self, app=None, db=None, model=None):
+        self.app = None
+        self.db = None
+        self.model = None
+        self.enabled = False
+        self.batch_size = 200
+        self.flush_interval = 1.0
+        self.overflow = 'block'
+        self.enqueue_timeout = 0.05
+        self.coalesce_seconds = 10
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._windows = {}
+        self._windows_lock = threading.Lock()
+        self.write_hooks = []
+        self.stats = {'enqueued': 0, 'coalesced': 0, 'written': 0, 'dropped': 0, 'failed': 0, 'batches': 0}
+
+        if app is not None:
+            self.init_app(app, db, model)
+
+    def init_app(self, app, db, model, serverless=False):
+        app.config.setdefault('ACTIVITY_LOG_ASYNC', not serverless)
+        app.config.setdefault('ACTIVITY_LOG_QUEUE_SIZE', 10000)
+        app.config.setdefault('ACTIVITY_LOG_BATCH_SIZE', 200)
+        app.config.setdefault('ACTIVITY_LOG_FLUSH_INTERVAL', 1.0)
+        app.config.setdefault('ACTIVITY_LOG_OVERFLOW', 'block')
+        app.config.setdefault('ACTIVITY_LOG_ENQUEUE_TIMEOUT', 0.05)
+        app.config.setdefault('ACTIVITY_LOG_COALESCE_SECONDS', 10)
+
+        if app.config['ACTIVITY_LOG_OVERFLOW'] not in ('block', 'drop', 'sync'):
+            raise ValueError(f"Invalid ACTIVITY_LOG_OVERFLOW: {app.config['ACTIVITY_LOG_OVERFLOW']}")
+
+        self.app = app
+        self.db = db
+        self.model = model
+        self.enabled = app.config['ACTIVITY_LOG_ASYNC']
+        self.batch_size = app.config['ACTIVITY_LOG_BATCH_SIZE']
+        self.flush_interval = app.config['ACTIVITY_LOG_FLUSH_INTERVAL']
+        self.overflow = app.config['ACTIVITY_LOG_OVERFLOW']
+        self.enqueue_timeout = app.config['ACTIVITY_LOG_ENQUEUE_TIMEOUT']
+        self.coalesce_seconds = app.config['ACTIVITY_LOG_COALESCE_SECONDS']
+        self._queue = queue.Queue(maxsize=app.config['ACTIVITY_LOG_QUEUE_SIZE'])
+
+        app.extensions['activity_log_writer'] = self
+        atexit.register(self.shutdown)
+
+    @property
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def enqueue(self, user_id, action, details=None, ip_address=None, event_count=1, coalesce=False):
+        """Queue an activity log row for the background writer, or count it into its open window with coalesce"""
+        row = {
+            'user_id': user_id,
+            'action': action,
+            'details': details,
+            'ip_address': ip_address,
+            'timestamp': datetime.utcnow(),
+            'event_count': event_count
+        }
+
+        if not self.enabled:
+            self._write([row])
+            return
+
+        self._ensure_worker()
+
+        if coalesce:
+            self._coalesce(row)
+            return
+
+        self._count('enqueued')
+
+        try:
+            self._queue.put_nowait(row)
+            return
+        except queue.Full:
+            pass
+
+        if self.overflow == 'block':
+            try:
+                self._queue.put(row, timeout=self.enqueue_timeout)
+                return
+            except queue.Full:
+                pass
+        elif self.overflow == 'sync':
+            self._write([row])
+            return
+
+        self._count('dropped')
+        logger.warning(f"Activity log queue full, dropped '{action}' for user {user_id}")
+
+    def _coalesce(self, row):
+        # Details stay in the key so coalescing never loses what each event was about
+        key = (row['user_id'], row['action'], row['details'])
+        with self._windows_lock:
+            window = self._windows.get(key)
+            if window is None:
+                self._windows[key] = (time.monotonic() + self.coalesce_seconds, row)
+            else:
+                window[1]['event_count'] += row['event_count']
+                if window[1]['ip_address'] != row['ip_address']:
+                    window[1]['ip_address'] = None
+        self._count('coalesced')
+
+    def _close_windows(self, everything=False):
+        """Take the rows of windows that are over, or of every window with everything"""
+        now = time.monotonic()
+        with self._windows_lock:
+            keys = [key for key, (closes, _) in self._windows.items() if everything or closes <= now]
+            return [self._windows.pop(key)[1] for key in keys]
+
+    def flush(self, timeout=10.0):
+        """Block until every row queued so far has been written"""
+        if self._worker_alive():
+            # The worker sets the marker once everything queued ahead of it is written
+            marker = threading.Event()
+            try:
+                self._queue.put(marker, timeout=timeout)
+                marker.wait(timeout)
+                return
+            except queue.Full:
+                pass
+
+        pending = self._close_windows(everything=True)
+        if pending:
+            self._write(pending)
+        while True:
+            batch = self._drain(self.batch_size)
+            if not batch:
+                break
+            self._write(batch)
+
+    def shutdown(self, timeout=5.0):
+        """Stop the worker thread and flush anything still queued"""
+        if self._queue is None:
+            return
+
+        self._stopping.set()
+        if self._worker_alive():
+            self._thread.join(timeout)
+        self.flush()
+
+    def _count(self, key, amount=1):
+        # Request threads and the worker both update stats; += on a dict item is not atomic
+        with self._lock:
+            self.stats[key] += amount
+
+    def _worker_alive(self):
+        # Threads do not survive fork(), so pre-forking servers get one worker per process
+        return self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+
+    def _ensure_worker(self):
+        if self._worker_alive():
+            return
+
+        with self._lock:
+            if self._worker_alive():
+                return
+            self._stopping.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+            self._thread.start()
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, threading.Event):
+                item.set()
+            else:
+                batch.append(item)
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = []
+            markers = []
+            deadline = time.monotonic() + self.flush_interval
+
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if isinstance(item, threading.Event):
+                    markers.append(item)
+                    break
+                batch.append(item)
+
+            # A flush marker closes the open windows too
+            batch += self._close_windows(everything=bool(markers))
+            if batch:
+                self._write(batch)
+            for marker in markers:
+                marker.set()
+
+    def _write(self, rows):
+        try:
+            with self.app.app_context():
+                with self.db.engine.begin() as connection:
+                    connection.execute(self.model.__table__.insert(), rows)
+                    for hook in self.write_hooks:
+                        hook(connection, rows)
+            self._count('written', len(rows))
+            self._count('batches')
+        except Exception as e:
+            self._count('failed', len(rows))
+            logger.error(f"Error writing {len(rows)} activity log entries: {e}")
+
+
+activity_writer = ActivityLogWriter()
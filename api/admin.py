@@ -1,14 +1,34 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
 from werkzeug.security import generate_password_hash
 import secrets
 from datetime import datetime, timedelta
 
-from .models.user import db, User, Tool, Permission, ActivityLog
+from .models.user import db, data_versions, permission_resolver, activity_archive, User, Tool, Permission, ActivityLog
 from .auth import is_password_valid
+from .pagination import paginate_request
+from .export import EXPORT_FORMATS, export_lines
+from .database import pool_status
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
+@admin_bp.record_once
+def init_permission_resolver(state):
+    permission_resolver.init_app(state.app)
+
+# Column name and expression for each field of an activity log export, from the entity being queried
+def export_columns(log):
+    return [
+        ('id', log.id),
+        ('timestamp', log.timestamp),
+        ('user_id', log.user_id),
+        ('username', User.username),
+        ('action', log.action),
+        ('details', log.details),
+        ('ip_address', log.ip_address),
+        ('event_count', log.event_count)
+    ]
+
 # Admin required decorator
 def admin_required(f):
     @login_required
@@ -225,7 +245,8 @@ def delete_user(user_id):
 def permissions():
     users = User.query.all()
     tools = Tool.query.all()
-    return render_template('admin/permissions.html', users=users, tools=tools)
+    matrix = permission_resolver.permissions_matrix(users, tools)
+    return render_template('admin/permissions.html', users=users, tools=tools, matrix=matrix)
 
 @admin_bp.route('/permissions/<int:user_id>', methods=['GET', 'POST'])
 @admin_required
@@ -234,14 +255,14 @@ def user_permissions(user_id):
     tools = Tool.query.all()
     
     if request.method == 'POST':
-        # Clear existing permissions
-        Permission.query.filter_by(user_id=user.id).delete()
-        
-        # Add new permissions
+        # Store an explicit grant or denial per tool so unchecked tools override the role default
+        existing = {p.tool_id: p for p in user.permissions}
         for tool in tools:
-            if f'tool_{tool.id}' in request.form:
-                permission = Permission(user_id=user.id, tool_id=tool.id, can_access=True)
-                db.session.add(permission)
+            can_access = f'tool_{tool.id}' in request.form
+            if tool.id in existing:
+                existing[tool.id].can_access = can_access
+            else:
+                db.session.add(Permission(user_id=user.id, tool_id=tool.id, can_access=can_access))
         
         # Log activity
         current_user.log_activity(
@@ -255,8 +276,8 @@ def user_permissions(user_id):
         flash(f'Permissions for {user.username} have been updated.', 'success')
         return redirect(url_for('admin.permissions'))
     
-    # Get current permissions
-    user_permissions = {p.tool_id: p.can_access for p in user.permissions}
+    # Get effective permissions, including role defaults
+    user_permissions = permission_resolver.permissions_matrix([user], tools)[user.id]
     
     return render_template('admin/user_permissions.html', user=user, tools=tools, user_permissions=user_permissions)
 
@@ -264,50 +285,108 @@ def user_permissions(user_id):
 @admin_bp.route('/activity-log')
 @admin_required
 def activity_log():
-    logs = ActivityLog.query.order_by(ActivityLog.timestamp.desc()).limit(100).all()
+    log = activity_archive.source()
+    logs = paginate_request(db.session.query(log), (log.timestamp, log.id), per_page=100)
     return render_template('admin/activity_log.html', logs=logs)
 
-@admin_bp.route('/activity-log/filter', methods=['GET', 'POST'])
-@admin_required
-def filter_activity_log():
-    if request.method == 'POST':
-        user_id = request.form.get('user_id')
-        action = request.form.get('action')
-        start_date = request.form.get('start_date')
-        end_date = request.form.get('end_date')
-        
-        query = ActivityLog.query
-        
-        if user_id and user_id != 'all':
-            query = query.filter_by(user_id=user_id)
-        
-        if action and action != 'all':
-            query = query.filter_by(action=action)
-        
-        if start_date:
-            start_date = datetime.strptime(start_date, '%Y-%m-%d')
-            query = query.filter(ActivityLog.timestamp >= start_date)
-        
-        if end_date:
-            end_date = datetime.strptime(end_date, '%Y-%m-%d')
-            end_date = end_date + timedelta(days=1)  # Include the entire day
-            query = query.filter(ActivityLog.timestamp <= end_date)
-        
-        logs = query.order_by(ActivityLog.timestamp.desc()).all()
-        
-        return render_template('admin/activity_log.html', logs=logs, filters={
-            'user_id': user_id,
-            'action': action,
-            'start_date': start_date,
-            'end_date': end_date
-        })
+# Activity log filters shared by the filter page and the export
+def activity_log_filters(source):
+    """Parse user_id, action, start_date and end_date from a form or query string"""
+    start_date = source.get('start_date')
+    end_date = source.get('end_date')
+    return {
+        'user_id': source.get('user_id'),
+        'action': source.get('action'),
+        'start_date': datetime.strptime(start_date, '%Y-%m-%d') if start_date else None,
+        'end_date': datetime.strptime(end_date, '%Y-%m-%d') if end_date else None
+    }
+
+def filtered_activity_log_query(filters):
+    """Return the filtered query and the entity it selects, which spans the archived months in the date range"""
+    end_date = filters['end_date'] + timedelta(days=1) if filters['end_date'] else None  # Include the entire day
+    log = activity_archive.source(filters['start_date'], end_date)
+    query = db.session.query(log)
+    
+    if filters['user_id'] and filters['user_id'] != 'all':
+        query = query.filter(log.user_id == filters['user_id'])
+    
+    if filters['action'] and filters['action'] != 'all':
+        query = query.filter(log.action == filters['action'])
+    
+    if filters['start_date']:
+        query = query.filter(log.timestamp >= filters['start_date'])
+    
+    if end_date:
+        query = query.filter(log.timestamp <= end_date)
     
+    return query, log
+
+def render_activity_log_filter_form():
     users = User.query.all()
     actions = db.session.query(ActivityLog.action).distinct().all()
     actions = [a[0] for a in actions]
     
     return render_template('admin/filter_activity_log.html', users=users, actions=actions)
 
+@admin_bp.route('/activity-log/filter', methods=['GET', 'POST'])
+@admin_required
+def filter_activity_log():
+    # Filters are posted from the form and carried in the query string when paging through results
+    source = request.form if request.method == 'POST' else request.args
+    
+    if request.method == 'POST' or 'action' in request.args:
+        try:
+            filters = activity_log_filters(source)
+        except ValueError:
+            flash('Dates must be formatted as YYYY-MM-DD', 'danger')
+            return render_activity_log_filter_form(), 400
+        
+        page_params = {
+            'user_id': source.get('user_id') or 'all',
+            'action': source.get('action') or 'all',
+            'start_date': source.get('start_date') or '',
+            'end_date': source.get('end_date') or ''
+        }
+        
+        query, log = filtered_activity_log_query(filters)
+        logs = paginate_request(query, (log.timestamp, log.id), per_page=100, params=page_params)
+        
+        return render_template('admin/activity_log.html', logs=logs, filters=filters, export_params=page_params)
+    
+    return render_activity_log_filter_form()
+
+@admin_bp.route('/activity-log/export')
+@admin_required
+def export_activity_log():
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"Unsupported export format '{export_format}'"}), 400
+    
+    try:
+        filters = activity_log_filters(request.args)
+    except ValueError:
+        return jsonify({'error': 'Dates must be formatted as YYYY-MM-DD'}), 400
+    
+    # Plain rows with the username joined in, so nothing accumulates in the session identity map
+    query, log = filtered_activity_log_query(filters)
+    columns = export_columns(log)
+    query = query.outerjoin(User, log.user_id == User.id).with_entities(
+        *[column for _, column in columns]
+    ).order_by(log.timestamp.desc(), log.id.desc())
+    
+    # yield_per streams through a server-side cursor where the driver supports it
+    rows = query.yield_per(current_app.config.get('ACTIVITY_LOG_EXPORT_BATCH_SIZE', 1000))
+    lines, mimetype = export_lines(export_format, rows, [name for name, _ in columns])
+    
+    # Log activity
+    current_user.log_activity('exported_activity_log', f"Exported activity log as {export_format}")
+    
+    filename = f"activity_log_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    return Response(stream_with_context(lines), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}',
+        'X-Accel-Buffering': 'no'
+    })
+
 # System Settings Routes
 @admin_bp.route('/settings')
 @admin_required
@@ -315,8 +394,14 @@ def settings():
     return render_template('admin/settings.html')
 
 # API Routes for AJAX
+@admin_bp.route('/api/db-pool')
+@admin_required
+def api_db_pool():
+    return jsonify(pool_status(db.engine))
+
 @admin_bp.route('/api/users')
 @admin_required
+@data_versions.conditional('users')
 def api_users():
     users = User.query.all()
     return jsonify([{
@@ -330,14 +415,30 @@ def api_users():
 
 @admin_bp.route('/api/activity-log')
 @admin_required
+@data_versions.conditional('activity_logs', 'users')
 def api_activity_log():
-    logs = ActivityLog.query.order_by(ActivityLog.timestamp.desc()).limit(100).all()
-    return jsonify([{
+    log = activity_archive.source()
+    logs = paginate_request(db.session.query(log), (log.timestamp, log.id), per_page=100)
+    response = jsonify([{
         'id': log.id,
         'user_id': log.user_id,
         'username': log.user.username,
         'action': log.action,
         'timestamp': log.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
         'details': log.details,
-        'ip_address': log.ip_address
+        'ip_address': log.ip_address,
+        'event_count': log.event_count
     } for log in logs])
+    
+    # Cursor links for the next and previous pages, as in RFC 8288
+    links = []
+    if logs.has_next:
+        links.append(f'<{logs.next_url()}>; rel="next"')
+    if logs.has_prev:
+        links.append(f'<{logs.prev_url()}>; rel="prev"')
+    if links:
+        response.headers['Link'] = ', '.join(links)
+    if logs.total is not None:
+        response.headers['X-Total-Count'] = f"{logs.total}+" if logs.total_is_estimate else str(logs.total)
+    
+    return response
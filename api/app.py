@@ -1,13 +1,17 @@
 import os
-from flask import Flask, request, redirect, url_for
+import click
+from flask import Blueprint, Flask, current_app, request, redirect, url_for
+from flask.cli import with_appcontext
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from pymongo import MongoClient
 from bson.objectid import ObjectId
 
-# Initialize Flask app
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your_secret_key')
+from assets import static_assets
+from cache import Cache
+from compression import compression
+from database import is_serverless, mongo_client
+from identity import IdentityCache
+from throttle import login_throttle
 
 # MongoDB Connection
 MONGO_URI = os.environ.get('MONGODB_URI')
@@ -16,21 +20,44 @@ if not MONGO_URI:
     print("Error: MONGODB_URI environment variable not set.")
     MONGO_URI = "mongodb://localhost:27017/test_db" 
 
-try:
-    client = MongoClient(MONGO_URI)
-    db = client.get_database('directory_hub')
-    users_collection = db.users
-    businesses_collection = db.businesses
-    print("MongoDB connection successful!")
-except Exception as e:
-    print(f"Error connecting to MongoDB: {e}")
-    client = None
-    db = None
+main_bp = Blueprint('main', __name__)
 
 # Flask-Login setup
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'main.login'
+
+# Users are cached briefly between requests so most requests skip the MongoDB round trip
+identity_cache = IdentityCache(Cache('identity'))
+
+def create_app():
+    """Create the app without touching MongoDB; the client connects on first use"""
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your_secret_key')
+    
+    login_manager.init_app(app)
+    identity_cache.init_app(app)
+    
+    # Failed logins are throttled per account and per IP
+    login_throttle.init_app(app, serverless=is_serverless())
+    
+    # Built static assets are served precompressed; larger dynamic responses are compressed on the fly
+    static_assets.init_app(app)
+    compression.init_app(app)
+    
+    app.register_blueprint(main_bp)
+    app.cli.add_command(init_db_command)
+    return app
+
+def get_db():
+    """Return the directory_hub database, creating the client on first use, or None if it cannot be created"""
+    extensions = current_app.extensions
+    if 'mongo_db' not in extensions:
+        try:
+            extensions['mongo_db'] = mongo_client(MONGO_URI).get_database('directory_hub')
+        except Exception as e:
+            print(f"Error connecting to MongoDB: {e}")
+            extensions['mongo_db'] = None
+    return extensions['mongo_db']
 
 class User:
     def __init__(self, user_id, email, password, role):
@@ -51,38 +78,53 @@ class User:
     def get_id(self):
         return self.id
 
+def user_snapshot(user_id):
+    user_data = get_db().users.find_one({"_id": ObjectId(user_id)}, {"email": 1, "role": 1})
+    if user_data:
+        return {"id": str(user_data["_id"]), "email": user_data["email"], "role": user_data["role"]}
+    return None
+
 @login_manager.user_loader
 def load_user(user_id):
-    if db is not None and users_collection is not None:
-        user_data = users_collection.find_one({"_id": ObjectId(user_id)})
-        if user_data:
-            return User(user_data["_id"], user_data["email"], user_data["password"], user_data["role"])
+    if get_db() is not None:
+        snapshot = identity_cache.get(user_id, lambda: user_snapshot(user_id))
+        if snapshot:
+            # The password hash is left out of the cache; login reads it straight from MongoDB
+            return User(snapshot["id"], snapshot["email"], None, snapshot["role"])
     return None
 
 # Routes
-@app.route('/')
+@main_bp.route('/')
 def index():
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
-@app.route('/login', methods=['GET', 'POST'])
+@main_bp.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
 
     if request.method == 'POST':
         email = request.form.get('email')
         password = request.form.get('password')
         
-        if db is None or users_collection is None:
+        # Refuse locked-out accounts and abusive IPs before touching MongoDB or hashing
+        retry_after = login_throttle.check(email, request.remote_addr)
+        if retry_after:
+            return '<h1>Too many failed login attempts. Please try again later.</h1>', 429, {'Retry-After': str(retry_after)}
+        
+        db = get_db()
+        if db is None:
             return '<h1>Database not connected. Please check server configuration.</h1>'
 
-        user_data = users_collection.find_one({'email': email})
+        user_data = db.users.find_one({'email': email})
 
         if user_data and check_password_hash(user_data['password'], password):
+            login_throttle.record_success(email)
             user = User(user_data['_id'], user_data['email'], user_data['password'], user_data['role'])
             login_user(user)
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('main.dashboard'))
         else:
+            login_throttle.record_failure(email, request.remote_addr)
             return '''
             <h1>Invalid email or password</h1>
             <form method="post">
@@ -102,12 +144,13 @@ def login():
     </form>
     '''
 
-@app.route('/dashboard')
+@main_bp.route('/dashboard')
 @login_required
 def dashboard():
     total_businesses = 0
-    if db is not None and businesses_collection is not None:
-        total_businesses = businesses_collection.count_documents({})
+    db = get_db()
+    if db is not None:
+        total_businesses = db.businesses.count_documents({})
     
     return f'''
     <h1>Welcome to Directory Hub Dashboard</h1>
@@ -117,26 +160,44 @@ def dashboard():
     <p><a href="/logout">Logout</a></p>
     '''
 
-@app.route('/logout')
+@main_bp.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
-@app.route('/api/test')
+@main_bp.route('/api/test')
 def api_test():
     return {"message": "API is working!"}
 
+def create_admin_user(db):
+    """Create the default admin user if there are no users; return True if one was created"""
+    if db.users.count_documents({}) != 0:
+        return False
+    hashed_password = generate_password_hash('Admin123!')
+    db.users.insert_one({
+        'email': 'admin@directoryhub.com',
+        'password': hashed_password,
+        'role': 'Admin'
+    })
+    return True
+
 # Create admin user if none exists
-@app.route('/setup')
+@main_bp.route('/setup')
 def setup():
-    if db is not None and users_collection is not None and users_collection.count_documents({}) == 0:
-        hashed_password = generate_password_hash('Admin123!')
-        users_collection.insert_one({
-            'email': 'admin@directoryhub.com',
-            'password': hashed_password,
-            'role': 'Admin'
-        })
+    db = get_db()
+    if db is not None and create_admin_user(db):
         return "Default admin user created: admin@directoryhub.com / Admin123!"
     return "Admin user already exists or database not connected."
 
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create the default admin user if the database has no users"""
+    db = get_db()
+    if db is None:
+        raise click.ClickException('Database not connected. Please check MONGODB_URI.')
+    if create_admin_user(db):
+        click.echo("Default admin user created: admin@directoryhub.com / Admin123!")
+    else:
+        click.echo("Admin user already exists.")
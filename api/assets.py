@@ -0,0 +1,252 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+
+from flask import abort, current_app, request, send_file, url_for
+from werkzeug.security import safe_join
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SOURCE_DIR = os.path.join(ROOT_DIR, 'static')
+OUTPUT_DIR = os.path.join(ROOT_DIR, 'static', 'dist')
+
+MANIFEST = 'manifest.json'
+
+# URL prefix the built files are served under
+ASSETS_URL_PATH = '/assets'
+
+# Minified and renamed to name.<hash>.ext, so they can be cached forever
+HASHED_EXTENSIONS = ('.js', '.css')
+
+# Precompressed under their own names; Jinja templates are left to render_template
+PAGE_EXTENSIONS = ('.html',)
+
+# Content-Encoding and file suffix of each precompressed variant, best first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, no-cache'
+
+_CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+_CSS_TOKENS = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|\s*([{};,>])\s*|(:)\s+|\s+')
+_ASSET_REFERENCE = re.compile(r'''((?:src|href)=["'])(?:[^"'#?]*/)?([\w.-]+\.(?:js|css))(["'])''')
+
+
+def minify_css(source):
+    """Drop comments and the whitespace CSS does not need, leaving strings alone"""
+    def replace(match):
+        string, punctuation, colon = match.groups()
+        if string:
+            return string
+        if punctuation:
+            return punctuation
+        if colon:
+            return colon
+        return ' '
+
+    minified = _CSS_TOKENS.sub(replace, _CSS_COMMENT.sub('', source))
+    return minified.replace(';}', '}').strip()
+
+
+def minify_js(source):
+    """Strip indentation, blank lines and whole-line comments
+
+    Line breaks are kept so automatic semicolon insertion behaves as before,
+    and multi-line template literals are copied verbatim. Comments after code
+    stay: telling them apart from regex literals needs a real parser, and
+    gzip takes back most of what they cost.
+    """
+    lines, in_template, in_comment = [], False, False
+    for line in source.splitlines():
+        if in_template:
+            lines.append(line)
+            in_template = _opens_template(line, in_template)
+            continue
+
+        stripped = line.strip()
+        if in_comment:
+            if '*/' in stripped:
+                in_comment = False
+                stripped = stripped.split('*/', 1)[1].strip()
+            else:
+                continue
+        if stripped.startswith('/*'):
+            if '*/' not in stripped:
+                in_comment = True
+                continue
+            stripped = stripped.split('*/', 1)[1].strip()
+        if not stripped or stripped.startswith('//'):
+            continue
+
+        lines.append(stripped)
+        in_template = _opens_template(stripped, in_template)
+    return '\n'.join(lines)
+
+
+def _opens_template(line, in_template):
+    # An odd number of unescaped backticks flips whether the next line is inside a template literal
+    return in_template != (len(re.findall(r'(?<!\\)`', line)) % 2 == 1)
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        logger.info("brotli is not installed; building gzip variants only")
+        return None
+    return brotli
+
+
+def _write(output_dir, name, data, brotli):
+    # gzip level 9 and mtime 0 keep builds reproducible
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+
+    sizes = {'': len(data)}
+    with open(os.path.join(output_dir, name), 'wb') as f:
+        f.write(data)
+    for suffix, compressed in variants.items():
+        # Only keep variants that actually save bytes
+        if len(compressed) < len(data):
+            with open(os.path.join(output_dir, name + suffix), 'wb') as f:
+                f.write(compressed)
+            sizes[suffix] = len(compressed)
+    return sizes
+
+
+def build_assets(source_dir=SOURCE_DIR, output_dir=OUTPUT_DIR, clean=False):
+    """Minify, content-hash and precompress static assets into output_dir; returns {name: (output name, sizes)}
+
+    Scripts and stylesheets become name.<hash>.ext; static pages keep their
+    names and have references to those files rewritten to the hashed URLs.
+    manifest.json maps source names to hashed names. Older hashed files are
+    kept unless clean is set, so pages cached before a deploy still load.
+    """
+    if clean and os.path.isdir(output_dir):
+        shutil.rmtree(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    names = sorted(name for name in os.listdir(source_dir) if os.path.isfile(os.path.join(source_dir, name)))
+    manifest, built = {}, {}
+    brotli = _brotli()
+
+    for name in names:
+        root, extension = os.path.splitext(name)
+        if extension not in HASHED_EXTENSIONS:
+            continue
+        with open(os.path.join(source_dir, name), encoding='utf-8') as f:
+            source = f.read()
+        data = (minify_css(source) if extension == '.css' else minify_js(source)).encode('utf-8')
+        manifest[name] = f'{root}.{content_hash(data)}{extension}'
+        built[name] = (manifest[name], _write(output_dir, manifest[name], data, brotli))
+
+    def hashed_reference(match):
+        prefix, name, quote = match.groups()
+        if name not in manifest:
+            return match.group(0)
+        return f'{prefix}{ASSETS_URL_PATH}/{manifest[name]}{quote}'
+
+    for name in names:
+        if os.path.splitext(name)[1] not in PAGE_EXTENSIONS:
+            continue
+        with open(os.path.join(source_dir, name), encoding='utf-8') as f:
+            source = f.read()
+        if '{%' in source or '{{' in source:
+            continue
+        data = _ASSET_REFERENCE.sub(hashed_reference, source).encode('utf-8')
+        built[name] = (name, _write(output_dir, name, data, brotli))
+
+    with open(os.path.join(output_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return built
+
+
+class StaticAssets:
+    """Serve build_assets output, picking the precompressed variant the client accepts
+
+    Hashed files are cached for a year as immutable; pages are revalidated
+    with their ETag on every use. asset_url('charts.js') in templates gives
+    the hashed URL, or the plain one when the assets have not been built.
+    """
+
+    def __init__(self, app=None):
+        self._manifests = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_DIR', OUTPUT_DIR)
+        app.add_url_rule(f'{ASSETS_URL_PATH}/<path:filename>', 'assets', self.serve)
+        app.jinja_env.globals['asset_url'] = self.url
+        app.extensions['assets'] = self
+
+    def manifest(self):
+        path = os.path.join(current_app.config['ASSETS_DIR'], MANIFEST)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return {}
+        # Re-read after a rebuild without restarting the app
+        cached = self._manifests.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path) as f:
+                cached = self._manifests[path] = (mtime, json.load(f))
+        return cached[1]
+
+    def url(self, name):
+        return url_for('assets', filename=self.manifest().get(name, name))
+
+    def serve(self, filename):
+        path = safe_join(current_app.config['ASSETS_DIR'], filename)
+        if path is None or filename == MANIFEST or filename.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+            abort(404)
+        if not os.path.isfile(path):
+            abort(404)
+
+        encoding = next((
+            (name, suffix) for name, suffix in ENCODINGS
+            if request.accept_encodings[name] and os.path.isfile(path + suffix)
+        ), None)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+        if encoding:
+            response = send_file(path + encoding[1], mimetype=mimetype, conditional=True)
+            response.headers['Content-Encoding'] = encoding[0]
+        else:
+            response = send_file(path, mimetype=mimetype, conditional=True)
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE if filename in self.manifest().values() else REVALIDATE
+        return response
+
+
+static_assets = StaticAssets()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Minify, content-hash and precompress the static assets')
+    parser.add_argument('source', nargs='?', default=SOURCE_DIR)
+    parser.add_argument('output', nargs='?', default=OUTPUT_DIR)
+    parser.add_argument('--clean', action='store_true', help='Remove earlier builds first.')
+    args = parser.parse_args()
+
+    built = build_assets(args.source, args.output, clean=args.clean)
+    print(f"{'source':<44} {'bytes':>8} {'gzip':>8} {'brotli':>8}  output")
+    for name, (output, sizes) in built.items():
+        print(f"{name:<44} {sizes[''] :>8} {sizes.get('.gz', '-'):>8} {sizes.get('.br', '-'):>8}  {output}")
+
+
+if __name__ == '__main__':
+    main()
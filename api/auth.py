@@ -1,11 +1,17 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, session
+from flask import Blueprint, render_template, redirect, url_for, flash, request, session, make_response
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 import re
 from datetime import datetime, timedelta
 import secrets
+from sqlalchemy import select
 
 from .models.user import db, User, PasswordReset, ActivityLog
+from .cache import Cache
+from .database import is_serverless
+from .identity import IdentityCache, restore_row, snapshot_row, split_user_id
+from .hashing import HasherBusy, password_hasher
+from .throttle import login_throttle
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -14,12 +20,43 @@ login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
 login_manager.login_message = 'Please log in to access this page.'
 
+# Users are cached briefly between requests; changes to a user drop their entry on commit
+identity_cache = IdentityCache(Cache('identity'))
+identity_cache.track(User)
+
+def user_snapshot(user_id):
+    user = db.session.get(User, user_id)
+    return snapshot_row(user) if user else None
+
+def session_state(user_id):
+    return db.session.execute(select(User.session_version, User.is_active, User.role).where(User.id == user_id)).first()
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    try:
+        user_id, session_version = split_user_id(user_id)
+    except ValueError:
+        return None
+    
+    # A bumped session version or a deactivated account ends existing sessions
+    snapshot = identity_cache.load(
+        user_id, session_version, lambda: user_snapshot(user_id), lambda: session_state(user_id)
+    )
+    if snapshot is None:
+        return None
+    return restore_row(db, User, snapshot)
 
 def init_app(app):
     login_manager.init_app(app)
+    identity_cache.init_app(app)
+    password_hasher.init_app(app, serverless=is_serverless())
+    login_throttle.init_app(app, serverless=is_serverless())
+
+@auth_bp.app_errorhandler(HasherBusy)
+def password_hasher_busy(error):
+    response = make_response(render_template('error.html', error_message='The server is busy verifying passwords. Please try again in a moment.'), 503)
+    response.headers['Retry-After'] = '5'
+    return response
 
 # Password validation function
 def is_password_valid(password):
@@ -55,13 +92,24 @@ def login():
         password = request.form.get('password')
         remember = 'remember' in request.form
         
+        # Refuse locked-out usernames and abusive IPs before any database or hashing work
+        retry_after = login_throttle.check(username, request.remote_addr)
+        if retry_after:
+            flash('Too many failed login attempts. Please try again later.', 'danger')
+            response = make_response(render_template('login.html'), 429)
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+        
         user = User.query.filter_by(username=username).first()
         
         # Check if user exists and password is correct
         if not user or not user.check_password(password):
+            login_throttle.record_failure(username, request.remote_addr)
             flash('Invalid username or password', 'danger')
             return render_template('login.html')
         
+        login_throttle.record_success(username)
+        
         # Check if user is active
         if not user.is_active:
             flash('Your account has been deactivated. Please contact an administrator.', 'danger')
@@ -219,6 +267,9 @@ def change_password():
         
         db.session.commit()
         
+        # The password change bumped the session version; keep this session signed in
+        login_user(current_user._get_current_object())
+        
         flash('Your password has been changed.', 'success')
         return redirect(url_for('main.dashboard'))
     
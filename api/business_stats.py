@@ -0,0 +1,131 @@
+from collections import Counter
+
+from sqlalchemy import event, func, inspect, literal, select, union_all, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+
+def track_business_counts(business_model, count_model, dimensions=('type', 'state')):
+    """Keep a count table in step with inserts, updates and deletes of businesses
+
+    count_model must have one primary key column per dimension plus an integer
+    business_count column. Bulk statements (query.update/delete, Core inserts)
+    bypass ORM events; run rebuild_business_counts() after them.
+    """
+    dimensions = tuple(dimensions)
+
+    def key_of(target):
+        return tuple(getattr(target, dim) for dim in dimensions)
+
+    def after_insert(mapper, connection, target):
+        _adjust(connection, count_model, dimensions, key_of(target), 1)
+
+    def after_delete(mapper, connection, target):
+        _adjust(connection, count_model, dimensions, key_of(target), -1)
+
+    def after_update(mapper, connection, target):
+        state = inspect(target)
+        old_key = []
+        changed = False
+        for dim in dimensions:
+            history = state.attrs[dim].history
+            if history.deleted:
+                changed = True
+                old_key.append(history.deleted[0])
+            else:
+                old_key.append(getattr(target, dim))
+
+        if changed:
+            _adjust(connection, count_model, dimensions, tuple(old_key), -1)
+            _adjust(connection, count_model, dimensions, key_of(target), 1)
+
+    def keep_old_value(target, value, oldvalue, initiator):
+        return value
+
+    # Make sure the previous value is loaded before it is overwritten so updates can be diffed
+    for dim in dimensions:
+        event.listen(getattr(business_model, dim), 'set', keep_old_value, active_history=True, retval=True)
+
+    event.listen(business_model, 'after_insert', after_insert)
+    event.listen(business_model, 'after_delete', after_delete)
+    event.listen(business_model, 'after_update', after_update)
+
+
+def rebuild_business_counts(connection, business_model, count_model, dimensions=('type', 'state')):
+    """Recompute the count table from scratch to repair drift"""
+    table = count_model.__table__
+    columns = [business_model.__table__.c[dim] for dim in dimensions]
+
+    connection.execute(table.delete())
+    connection.execute(table.insert().from_select(
+        [*dimensions, 'business_count'],
+        select(*columns, func.count()).group_by(*columns)
+    ))
+
+
+def summarize_business_counts(count_model, dimensions=('type', 'state')):
+    """Read the count table once and return the total plus per-dimension totals"""
+    rows = count_model.query.filter(count_model.business_count > 0).all()
+
+    summary = {'total': 0}
+    for dim in dimensions:
+        summary[f'by_{dim}'] = Counter()
+
+    for row in rows:
+        summary['total'] += row.business_count
+        for dim in dimensions:
+            summary[f'by_{dim}'][getattr(row, dim)] += row.business_count
+
+    return summary
+
+
+def facet_counts(session, count_model, filters, dimensions=('type', 'state'), limit=None):
+    """Return ({dimension: {value: count}}, total) for the businesses matching filters
+
+    filters maps dimensions to a selected value or None. Each dimension's
+    counts apply every filter except its own, so the other values of a
+    filtered dimension are still listed. All dimensions come from one UNION ALL
+    over the count table, whose size depends on the number of distinct
+    combinations rather than on the number of businesses. limit keeps the
+    largest values of each dimension.
+    """
+    table = count_model.__table__
+    selects = []
+    for dim in dimensions:
+        conditions = [table.c[other] == value for other, value in filters.items() if other != dim and value is not None]
+        selects.append(
+            select(literal(dim).label('dimension'), table.c[dim].label('value'), func.sum(table.c.business_count).label('count'))
+            .where(table.c.business_count > 0, *conditions)
+            .group_by(table.c[dim])
+        )
+
+    counts = {dim: Counter() for dim in dimensions}
+    for dimension, value, count in session.execute(union_all(*selects)):
+        counts[dimension][value] = count
+
+    first = dimensions[0]
+    total = counts[first][filters[first]] if filters.get(first) is not None else sum(counts[first].values())
+    return {dim: dict(counts[dim].most_common(limit)) for dim in dimensions}, total
+
+
+def _adjust(connection, count_model, dimensions, key, delta):
+    table = count_model.__table__
+    values = dict(zip(dimensions, key))
+    dialect = connection.dialect.name
+
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        stmt = insert(table).values(business_count=delta, **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(dimensions),
+            set_={'business_count': table.c.business_count + delta}
+        )
+        connection.execute(stmt)
+        return
+
+    result = connection.execute(
+        update(table)
+        .where(*[table.c[dim] == values[dim] for dim in dimensions])
+        .values(business_count=table.c.business_count + delta)
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(business_count=delta, **values))
@@ -0,0 +1,176 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    """In-process LRU cache with per-entry expiry"""
+
+    # Entries are private to this process
+    shared = False
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisBackend:
+    """Cache backend for any client implementing the Redis GET, SETEX, DEL and INCR commands
+
+    Values are stored as JSON under a generation number. clear() bumps the
+    generation instead of scanning keys, so stale entries are never read again
+    and simply expire.
+    """
+
+    shared = True
+
+    def __init__(self, client, prefix='directory_hub:cache'):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, key):
+        generation = self.client.get(f'{self.prefix}:generation') or 0
+        return f'{self.prefix}:{int(generation)}:{key}'
+
+    def get(self, key):
+        raw = self.client.get(self._key(key))
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.setex(self._key(key), max(1, int(ttl)), json.dumps(value))
+
+    def delete(self, key):
+        self.client.delete(self._key(key))
+
+    def clear(self):
+        self.client.incr(f'{self.prefix}:generation')
+
+
+class Cache:
+    """Named cache with hit/miss counters in front of a pluggable backend
+
+    Configured from CACHE_TTL, CACHE_MAX_ENTRIES and CACHE_REDIS_URL. Backend
+    errors are logged and treated as misses so a cache outage never fails a
+    request.
+    """
+
+    def __init__(self, namespace, app=None):
+        self.namespace = namespace
+        self.backend = MemoryBackend()
+        self.ttl = 300
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_TTL', 300)
+        app.config.setdefault('CACHE_MAX_ENTRIES', 1024)
+        app.config.setdefault('CACHE_REDIS_URL', None)
+
+        self.ttl = app.config['CACHE_TTL']
+        self.backend = MemoryBackend(app.config['CACHE_MAX_ENTRIES'])
+
+        redis_url = app.config['CACHE_REDIS_URL']
+        if redis_url:
+            try:
+                import redis
+                self.backend = RedisBackend(redis.Redis.from_url(redis_url), prefix=f'directory_hub:{self.namespace}')
+            except ImportError:
+                logger.error("CACHE_REDIS_URL is set but the redis package is not installed; using in-process cache")
+
+        app.extensions.setdefault('caches', {})[self.namespace] = self
+
+    def get_or_set(self, key, compute):
+        """Return the cached value for key, computing and storing it on a miss"""
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            self._count('errors')
+            logger.error(f"Error reading {self.namespace} cache: {e}")
+            value = None
+
+        if value is not None:
+            self._count('hits')
+            return value
+
+        self._count('misses')
+        value = compute()
+
+        try:
+            self.backend.set(key, value, self.ttl)
+        except Exception as e:
+            self._count('errors')
+            logger.error(f"Error writing {self.namespace} cache: {e}")
+
+        return value
+
+    def delete(self, key):
+        """Drop the entry for key"""
+        try:
+            self.backend.delete(key)
+        except Exception as e:
+            self._count('errors')
+            logger.error(f"Error deleting from {self.namespace} cache: {e}")
+
+    def invalidate(self):
+        """Drop every entry in this cache"""
+        self._count('invalidations')
+        try:
+            self.backend.clear()
+        except Exception as e:
+            self._count('errors')
+            logger.error(f"Error clearing {self.namespace} cache: {e}")
+
+    def _count(self, counter):
+        # Request threads share the counters; += on an attribute is not atomic
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'invalidations': self.invalidations,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None
+        }
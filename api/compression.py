@@ -0,0 +1,75 @@
+import gzip
+import logging
+
+from flask import current_app, request
+
+logger = logging.getLogger(__name__)
+
+# Content types compressed on the fly; the monolith's json.dumps views go out as text/html.
+# Scripts, stylesheets and static pages are compressed ahead of time by assets.py
+COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/csv', 'text/plain')
+
+
+class Compression:
+    """Compress dynamic responses of at least COMPRESS_MIN_SIZE bytes with brotli or gzip
+
+    Uses the best encoding the client accepts, brotli only when the package is
+    installed. Streamed responses, files and already encoded bodies pass
+    through untouched. A compressed response's strong ETag becomes weak,
+    since its bytes differ from the uncompressed one while meaning the same;
+    DataVersions.conditional compares If-None-Match weakly to match.
+    """
+
+    def __init__(self, app=None):
+        self._brotli = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BROTLI_QUALITY', 4)
+        app.config.setdefault('COMPRESS_MIMETYPES', COMPRESSIBLE_TYPES)
+
+        try:
+            import brotli
+            self._brotli = brotli
+        except ImportError:
+            logger.info("brotli is not installed; compressing responses with gzip only")
+
+        app.after_request(self.compress_response)
+        app.extensions['compression'] = self
+
+    def compress_response(self, response):
+        config = current_app.config
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in config['COMPRESS_MIMETYPES']):
+            return response
+
+        data = response.get_data()
+        if len(data) < config['COMPRESS_MIN_SIZE']:
+            return response
+
+        # Caches must key on Accept-Encoding whether or not this client gets a compressed body
+        response.vary.add('Accept-Encoding')
+        accepted = request.accept_encodings
+        if self._brotli is not None and accepted['br']:
+            encoding = 'br'
+            compressed = self._brotli.compress(data, quality=config['COMPRESS_BROTLI_QUALITY'])
+        elif accepted['gzip']:
+            encoding = 'gzip'
+            compressed = gzip.compress(data, compresslevel=config['COMPRESS_LEVEL'])
+        else:
+            return response
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+compression = Compression()
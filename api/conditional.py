@@ -0,0 +1,110 @@
+import hashlib
+from functools import wraps
+
+from flask import current_app, g, make_response, request
+from flask_login import current_user
+from sqlalchemy import Column, Integer, String, Table, event, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+
+class DataVersions:
+    """Change counters per data set, used to derive strong ETags
+
+    Each tracked name has a row in data_versions that is bumped in the same
+    transaction as any ORM insert, update or delete of its models. Writers that
+    bypass the session (the activity log writer) bump it through a write hook.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.table = Table(
+            'data_versions', db.metadata,
+            Column('name', String(50), primary_key=True),
+            Column('version', Integer, nullable=False, default=0)
+        )
+        self._names = {}
+        event.listen(Session, 'after_flush', self._after_flush)
+
+    def track(self, name, *models):
+        """Bump the version called name whenever any of models is written"""
+        for model in models:
+            self._names[model] = name
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_CONTROL', {})
+        app.extensions['data_versions'] = self
+
+        writer = app.extensions.get('activity_log_writer')
+        if writer is not None:
+            name = self._names.get(writer.model)
+            if name is not None:
+                writer.write_hooks.append(lambda connection, rows: self.bump(connection, name))
+
+    def bump(self, connection, name):
+        dialect = connection.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+            stmt = insert(self.table).values(name=name, version=1)
+            stmt = stmt.on_conflict_do_update(index_elements=['name'], set_={'version': self.table.c.version + 1})
+            connection.execute(stmt)
+            return
+
+        result = connection.execute(
+            update(self.table).where(self.table.c.name == name).values(version=self.table.c.version + 1)
+        )
+        if result.rowcount == 0:
+            connection.execute(self.table.insert().values(name=name, version=1))
+
+    def current(self, *names):
+        """Return {name: version} for names, with 0 for names never written"""
+        rows = self.db.session.execute(
+            self.table.select().where(self.table.c.name.in_(names))
+        ).all()
+        versions = dict.fromkeys(names, 0)
+        versions.update({row.name: row.version for row in rows})
+        return versions
+
+    def conditional(self, *names, cache_control='private, no-cache', per_user=True):
+        """Serve a strong ETag for the view and answer If-None-Match with 304
+
+        The ETag covers the endpoint, the full path including query string,
+        the versions of names and, when per_user is set, the current user, so a
+        matching request returns before the view runs. CACHE_CONTROL may map an
+        endpoint name to a Cache-Control value overriding cache_control. The
+        versions read are left in g.data_versions for the view.
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                versions = self.current(*names)
+                g.data_versions = versions
+                user_id = current_user.get_id() if per_user and current_user.is_authenticated else None
+                key = repr((request.endpoint, request.full_path, user_id, sorted(versions.items())))
+                etag = hashlib.sha1(key.encode()).hexdigest()
+                policy = current_app.config.get('CACHE_CONTROL', {}).get(request.endpoint, cache_control)
+
+                # Weak comparison, as If-None-Match requires: compression.py weakens the ETag it sends
+                if request.if_none_match.contains_weak(etag):
+                    response = current_app.response_class(status=304)
+                else:
+                    response = make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = policy
+                return response
+            return decorated_function
+        return decorator
+
+    def _after_flush(self, session, flush_context):
+        names = {
+            self._names[type(instance)]
+            for instance in (*session.new, *session.dirty, *session.deleted)
+            if type(instance) in self._names
+        }
+        if names:
+            connection = session.connection()
+            for name in sorted(names):
+                self.bump(connection, name)
@@ -1,6 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from .user import db
+from .user import db, data_versions
+from ..business_stats import track_business_counts
+from ..geo import gazetteer, track_locations
 
 class Business(db.Model):
     """Business model for directory listings"""
@@ -16,12 +18,66 @@ class Business(db.Model):
     email = db.Column(db.String(100))
     website = db.Column(db.String(200))
     description = db.Column(db.Text)
+    # City-level location from the bundled gazetteer; see geo.py
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12))
+    county = db.Column(db.String(100))
+    metro = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_businesses_type_state', 'type', 'state'),
+        db.Index('ix_businesses_state', 'state'),
+        db.Index('uq_businesses_natural_key', 'name', 'state', 'city', db.text("coalesce(address, '')"), unique=True),
+        db.Index('ix_businesses_city', 'city'),
+        db.Index('ix_businesses_geohash', 'geohash'),
+        # Covering indexes for the per-metro and per-county region counts
+        db.Index('ix_businesses_metro_type', 'metro', 'type'),
+        db.Index('ix_businesses_county_state_type', 'county', 'state', 'type'),
+    )
+    
     def __repr__(self):
         return f'<Business {self.name}>'
 
+track_locations(Business, gazetteer)
+
+class BusinessStat(db.Model):
+    """Business counts per type and state, maintained on every Business write"""
+    __tablename__ = 'business_stats'
+    
+    type = db.Column(db.String(50), primary_key=True)
+    state = db.Column(db.String(50), primary_key=True)
+    business_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<BusinessStat {self.type} {self.state}={self.business_count}>'
+
+track_business_counts(Business, BusinessStat)
+
+FACET_DIMENSIONS = ('type', 'state', 'city')
+
+class BusinessFacetCount(db.Model):
+    """Business counts per type, state and city, maintained on every Business write for facet counts"""
+    __tablename__ = 'business_facet_counts'
+    
+    type = db.Column(db.String(50), primary_key=True)
+    state = db.Column(db.String(50), primary_key=True)
+    city = db.Column(db.String(50), primary_key=True)
+    business_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.Index('ix_business_facet_counts_state_city', 'state', 'city'),
+        db.Index('ix_business_facet_counts_city', 'city'),
+    )
+    
+    def __repr__(self):
+        return f'<BusinessFacetCount {self.type} {self.state} {self.city}={self.business_count}>'
+
+track_business_counts(Business, BusinessFacetCount, dimensions=FACET_DIMENSIONS)
+data_versions.track('businesses', Business)
+
 class Document(db.Model):
     """Document model for storing document metadata"""
     __tablename__ = 'documents'
@@ -1,109 +1,167 @@
-from flask import Blueprint, render_template, jsonify
+from flask import Blueprint, render_template, jsonify, current_app, g
 from flask_login import login_required, current_user
-from sqlalchemy import func
+from sqlalchemy import event, func, or_
+from sqlalchemy.orm import Session, object_session
 import json
 
-from .models.user import db, User, Tool, ActivityLog
+from .models.user import db, data_versions, User, Tool, ActivityLog
 from .models.content import Business
+from .cache import Cache
+from .geo import region_counts
 
 # Create blueprint for data visualization routes
 data_bp = Blueprint('data', __name__, url_prefix='/data')
 
+# Chart payloads only change when businesses do, so they are cached between writes
+chart_cache = Cache('charts')
+
+@data_bp.record_once
+def init_chart_cache(state):
+    chart_cache.init_app(state.app)
+
+@event.listens_for(Business, 'after_insert')
+@event.listens_for(Business, 'after_update')
+@event.listens_for(Business, 'after_delete')
+def mark_charts_stale(mapper, connection, target):
+    object_session(target).info['charts_stale'] = True
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_stale_charts(session):
+    # Invalidate after commit so a concurrent request cannot re-cache pre-commit data
+    if session.info.pop('charts_stale', False):
+        chart_cache.invalidate()
+
+def cached_chart(key, compute):
+    """Return the chart payload for key at the current businesses version, computing it on a miss"""
+    # Invalidation only reaches this process's cache; keying on the version the ETag was built
+    # from keeps a write by another process (an import) from being served stale under the new ETag
+    versions = g.get('data_versions') or data_versions.current('businesses')
+    return chart_cache.get_or_set(f"{key}:v{versions['businesses']}", compute)
+
 @data_bp.route('/state-distribution')
 @login_required
+@data_versions.conditional('businesses', per_user=False)
 def state_distribution():
     """Get business distribution by state"""
-    # Query the database for businesses grouped by state
-    state_counts = db.session.query(
-        Business.state, 
-        func.count(Business.id).label('count')
-    ).group_by(Business.state).order_by(func.count(Business.id).desc()).all()
-    
-    # Format data for Chart.js
-    labels = [state[0] for state in state_counts]
-    data = [state[1] for state in state_counts]
-    
-    # Generate color gradient based on number of states
-    colors = generate_blue_gradient(len(labels))
+    payload = cached_chart('state-distribution', state_distribution_payload)
     
     # Log this activity
     current_user.log_activity('viewed_state_distribution')
     
-    return jsonify({
-        'labels': labels,
-        'datasets': [{
-            'label': 'Businesses by State',
-            'data': data,
-            'backgroundColor': [f'rgba({r}, {g}, {b}, 0.8)' for r, g, b in colors],
-            'borderColor': [f'rgba({r}, {g}, {b}, 1)' for r, g, b in colors],
-            'borderWidth': 1
-        }]
-    })
+    return jsonify(payload)
 
 @data_bp.route('/state-distribution/<business_type>')
 @login_required
+@data_versions.conditional('businesses', per_user=False)
 def state_distribution_by_type(business_type):
     """Get business distribution by state for a specific business type"""
-    # Query the database for businesses of a specific type grouped by state
-    state_counts = db.session.query(
-        Business.state, 
-        func.count(Business.id).label('count')
-    ).filter(Business.type == business_type).group_by(Business.state).order_by(func.count(Business.id).desc()).all()
+    payload = cached_chart(
+        f'state-distribution:type:{business_type}',
+        lambda: state_distribution_payload(business_type)
+    )
     
-    # Format data for Chart.js
-    labels = [state[0] for state in state_counts]
-    data = [state[1] for state in state_counts]
+    # Log this activity
+    current_user.log_activity('viewed_state_distribution_by_type', details=f'Business type: {business_type}')
     
-    # Generate color gradient based on number of states
-    colors = generate_blue_gradient(len(labels))
+    return jsonify(payload)
+
+@data_bp.route('/metro-distribution')
+@login_required
+@data_versions.conditional('businesses', per_user=False)
+def metro_distribution():
+    """Get business distribution by metro area"""
+    payload = cached_chart('metro-distribution', lambda: region_distribution_payload('metro'))
     
     # Log this activity
-    current_user.log_activity('viewed_state_distribution_by_type', details=f'Business type: {business_type}')
+    current_user.log_activity('viewed_metro_distribution')
     
-    return jsonify({
-        'labels': labels,
-        'datasets': [{
-            'label': f'{business_type} by State',
-            'data': data,
-            'backgroundColor': [f'rgba({r}, {g}, {b}, 0.8)' for r, g, b in colors],
-            'borderColor': [f'rgba({r}, {g}, {b}, 1)' for r, g, b in colors],
-            'borderWidth': 1
-        }]
-    })
+    return jsonify(payload)
+
+@data_bp.route('/county-distribution')
+@login_required
+@data_versions.conditional('businesses', per_user=False)
+def county_distribution():
+    """Get business distribution by county"""
+    payload = cached_chart('county-distribution', lambda: region_distribution_payload('county'))
+    
+    # Log this activity
+    current_user.log_activity('viewed_county_distribution')
+    
+    return jsonify(payload)
 
 @data_bp.route('/business-types')
 @login_required
+@data_versions.conditional('businesses', per_user=False)
 def business_types():
     """Get distribution of business types"""
+    payload = cached_chart('business-types', business_types_payload)
+    
+    # Log this activity
+    current_user.log_activity('viewed_business_types_distribution')
+    
+    return jsonify(payload)
+
+@data_bp.route('/cache-stats')
+@login_required
+def cache_stats():
+    """Get hit/miss counters for every registered cache"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Administrator access required'}), 403
+    
+    caches = current_app.extensions.get('caches', {})
+    return jsonify({namespace: cache.stats() for namespace, cache in caches.items()})
+
+def state_distribution_payload(business_type=None):
+    """Build the Chart.js payload for businesses grouped by state"""
+    # Query the database for businesses grouped by state
+    query = db.session.query(
+        Business.state, 
+        func.count(Business.id).label('count')
+    )
+    if business_type is not None:
+        query = query.filter(Business.type == business_type)
+    state_counts = query.group_by(Business.state).order_by(func.count(Business.id).desc()).all()
+    
+    label = f'{business_type} by State' if business_type is not None else 'Businesses by State'
+    return chart_payload(label, state_counts)
+
+def region_distribution_payload(level):
+    """Build the Chart.js payload for geocoded businesses grouped by county or metro area"""
+    label = 'Businesses by Metro Area' if level == 'metro' else 'Businesses by County'
+    return chart_payload(label, region_counts(db.session, Business, level))
+
+def business_types_payload():
+    """Build the Chart.js payload for businesses grouped by type"""
     # Query the database for businesses grouped by type
     type_counts = db.session.query(
         Business.type, 
         func.count(Business.id).label('count')
     ).group_by(Business.type).order_by(func.count(Business.id).desc()).all()
     
-    # Format data for Chart.js
-    labels = [type_[0] for type_ in type_counts]
-    data = [type_[1] for type_ in type_counts]
+    return chart_payload('Business Types', type_counts)
+
+def chart_payload(label, counts):
+    """Format (label, count) rows as a single-dataset Chart.js payload"""
+    labels = [row[0] for row in counts]
+    data = [row[1] for row in counts]
     
-    # Generate color gradient based on number of types
+    # Generate color gradient based on number of labels
     colors = generate_blue_gradient(len(labels))
     
-    # Log this activity
-    current_user.log_activity('viewed_business_types_distribution')
-    
-    return jsonify({
+    return {
         'labels': labels,
         'datasets': [{
-            'label': 'Business Types',
+            'label': label,
             'data': data,
             'backgroundColor': [f'rgba({r}, {g}, {b}, 0.8)' for r, g, b in colors],
             'borderColor': [f'rgba({r}, {g}, {b}, 1)' for r, g, b in colors],
             'borderWidth': 1
         }]
-    })
+    }
 
 @data_bp.route('/recent-activity')
 @login_required
+@data_versions.conditional('activity_logs', 'users')
 def recent_activity():
     """Get recent activity data"""
     # Query for recent activity logs
@@ -112,9 +170,8 @@ def recent_activity():
         logs = ActivityLog.query.order_by(ActivityLog.timestamp.desc()).limit(10).all()
     elif current_user.is_manager:
         # Managers see activity from staff and themselves
-        staff_ids = [user.id for user in User.query.filter_by(role='Staff').all()]
-        staff_ids.append(current_user.id)
-        logs = ActivityLog.query.filter(ActivityLog.user_id.in_(staff_ids)).order_by(ActivityLog.timestamp.desc()).limit(10).all()
+        staff_ids = db.session.query(User.id).filter_by(role='Staff').scalar_subquery()
+        logs = ActivityLog.query.filter(or_(ActivityLog.user_id.in_(staff_ids), ActivityLog.user_id == current_user.id)).order_by(ActivityLog.timestamp.desc()).limit(10).all()
     else:
         # Staff only see their own activity
         logs = ActivityLog.query.filter_by(user_id=current_user.id).order_by(ActivityLog.timestamp.desc()).limit(10).all()
@@ -125,7 +182,8 @@ def recent_activity():
         'user': log.user.username,
         'action': log.action,
         'timestamp': log.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-        'details': log.details
+        'details': log.details,
+        'event_count': log.event_count
     } for log in logs]
     
     return jsonify(activity_data)
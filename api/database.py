@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool, QueuePool
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts take, including waits for a free connection"""
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self._metrics_lock = threading.Lock()
+        self.metrics = {'checkouts': 0, 'timeouts': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            with self._metrics_lock:
+                self.metrics['timeouts'] += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._metrics_lock:
+                self.metrics['checkouts'] += 1
+                self.metrics['wait_seconds'] += waited
+                self.metrics['max_wait_seconds'] = max(self.metrics['max_wait_seconds'], waited)
+
+    def checkout_metrics(self):
+        with self._metrics_lock:
+            metrics = dict(self.metrics)
+        checkouts = metrics['checkouts']
+        metrics['avg_wait_seconds'] = round(metrics['wait_seconds'] / checkouts, 6) if checkouts else None
+        return metrics
+
+
+def is_serverless(environ=os.environ):
+    """True on Vercel or when DB_SERVERLESS is set, where pooled connections outlive their process"""
+    if 'DB_SERVERLESS' in environ:
+        return environ['DB_SERVERLESS'].lower() in TRUE_VALUES
+    return bool(environ.get('VERCEL'))
+
+
+def engine_options(database_uri, environ=os.environ):
+    """Return SQLALCHEMY_ENGINE_OPTIONS for database_uri configured from the environment
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (seconds), DB_POOL_RECYCLE
+    (seconds) and DB_POOL_PRE_PING size the pool; DB_STATEMENT_TIMEOUT
+    (milliseconds) caps statement run time on PostgreSQL. Serverless mode uses
+    NullPool so each invocation opens and closes its own connection.
+    In-memory SQLite is left to Flask-SQLAlchemy's defaults.
+    """
+    url = make_url(database_uri)
+    backend = url.get_backend_name()
+
+    if backend == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}
+
+    if is_serverless(environ):
+        options = {'poolclass': NullPool}
+    else:
+        options = {
+            'poolclass': TimedQueuePool,
+            'pool_size': int(environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(environ.get('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': float(environ.get('DB_POOL_TIMEOUT', 30)),
+            'pool_recycle': int(environ.get('DB_POOL_RECYCLE', 1800)),
+            'pool_pre_ping': environ.get('DB_POOL_PRE_PING', 'true').lower() in TRUE_VALUES,
+        }
+
+    statement_timeout = environ.get('DB_STATEMENT_TIMEOUT')
+    if statement_timeout and backend == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={int(statement_timeout)}'}
+
+    return options
+
+
+def configure_engine(app, environ=os.environ):
+    """Fill in SQLALCHEMY_ENGINE_OPTIONS for the app's database; call before SQLAlchemy(app)"""
+    options = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], environ)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def pool_status(engine):
+    """Return a dict describing the engine's connection pool"""
+    pool = engine.pool
+    status = {'pool': type(pool).__name__}
+
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+            'timeout': pool.timeout(),
+        })
+
+    if isinstance(pool, TimedQueuePool):
+        status.update(pool.checkout_metrics())
+
+    return status
+
+
+def mongo_client(uri, environ=os.environ):
+    """Build a MongoClient with pool sizing and timeouts from the environment
+
+    The client does not connect until the first operation. MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_CONNECT_TIMEOUT_MS and MONGO_SOCKET_TIMEOUT_MS override the defaults;
+    serverless mode keeps the pool small since each instance serves one
+    request at a time.
+    """
+    from pymongo import MongoClient
+
+    serverless = is_serverless(environ)
+    return MongoClient(
+        uri,
+        connect=False,
+        maxPoolSize=int(environ.get('MONGO_MAX_POOL_SIZE', 5 if serverless else 50)),
+        minPoolSize=int(environ.get('MONGO_MIN_POOL_SIZE', 0)),
+        maxIdleTimeMS=int(environ.get('MONGO_MAX_IDLE_MS', 60000)),
+        serverSelectionTimeoutMS=int(environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+        connectTimeoutMS=int(environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+        socketTimeoutMS=int(environ.get('MONGO_SOCKET_TIMEOUT_MS', 20000)),
+    )
@@ -0,0 +1,51 @@
+import csv
+import json
+from datetime import date, datetime
+
+
+class _LineBuffer:
+    """File-like target for csv.writer that hands back each written line"""
+
+    def __init__(self):
+        self.value = ''
+
+    def write(self, line):
+        self.value = line
+
+
+def csv_lines(rows, columns):
+    """Yield a CSV header and one CSV line per row, holding only the current row"""
+    buffer = _LineBuffer()
+    writer = csv.writer(buffer)
+
+    writer.writerow(columns)
+    yield buffer.value
+
+    for row in rows:
+        writer.writerow([_plain(value) for value in row])
+        yield buffer.value
+
+
+def ndjson_lines(rows, columns):
+    """Yield one JSON object per row, newline-delimited"""
+    for row in rows:
+        yield json.dumps({column: _plain(value) for column, value in zip(columns, row)}) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson')
+}
+
+
+def export_lines(format, rows, columns):
+    """Return (line generator, mimetype) for format, raising KeyError for unknown formats"""
+    generate, mimetype = EXPORT_FORMATS[format]
+    return generate(rows, columns), mimetype
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
@@ -0,0 +1,117 @@
+import os
+
+import click
+from flask import Flask
+from flask.cli import with_appcontext
+
+from .models.user import db, data_versions, activity_archive, User, ActivityLog
+from .models.content import Business, BusinessStat, BusinessFacetCount, FACET_DIMENSIONS
+from .activity_archive import SECURITY_ACTIONS, register_compact_command
+from .activity_policy import activity_policy
+from .activity_writer import activity_writer
+from .assets import static_assets
+from .business_stats import rebuild_business_counts
+from .compression import compression
+from .database import configure_engine, is_serverless, pool_status
+from .geo import gazetteer, geocode_businesses, register_geocode_command
+from .importer import register_import_command
+from .instrumentation import instrumentation
+from .migrations import run_migrations
+from .query_audit import register_audit_command
+from .profiling import profiling_bp, sampling_profiler
+from .stream import activity_broker, stream_bp
+
+# Routes covered by 'flask audit-queries'
+AUDITED_PATHS = [
+    '/admin/users',
+    '/admin/activity-log',
+    '/admin/api/activity-log',
+    '/data/state-distribution',
+    '/data/state-distribution/Vehicle Dealership',
+    '/data/metro-distribution',
+    '/data/county-distribution',
+    '/data/business-types',
+    '/data/recent-activity',
+]
+
+
+def create_app(config=None):
+    """Create the blueprint app
+
+    Nothing here touches the database: connections open on the first query,
+    and schema setup runs from 'flask init-db' instead of on startup.
+    """
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-key-for-testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///directory_hub.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    if config:
+        app.config.update(config)
+
+    configure_engine(app)
+    db.init_app(app)
+    instrumentation.init_app(app, pool_status)
+
+    # Imported here so building the app is the only thing that pulls in the views
+    from . import auth
+    from .auth import auth_bp
+    from .admin import admin_bp
+    from .data import chart_cache, data_bp
+    from .test import test_bp
+
+    auth.init_app(app)
+    activity_writer.init_app(app, db, ActivityLog, serverless=is_serverless())
+    activity_archive.init_app(app)
+    activity_policy.init_app(app, always_record=SECURITY_ACTIONS, serverless=is_serverless())
+    data_versions.init_app(app)
+    gazetteer.init_app(app)
+    static_assets.init_app(app)
+    compression.init_app(app)
+    activity_broker.init_app(app)
+    activity_broker.viewer_loader(auth.load_user)
+    sampling_profiler.init_app(app)
+
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(admin_bp)
+    app.register_blueprint(data_bp)
+    app.register_blueprint(test_bp)
+    app.register_blueprint(stream_bp)
+    app.register_blueprint(profiling_bp)
+
+    register_audit_command(app, db, AUDITED_PATHS, lambda: User.query.filter_by(role='Admin').first())
+    app.cli.add_command(init_db_command)
+
+    def after_business_import():
+        # Bulk inserts skip the ORM events that keep the count tables, locations, the ETags and the chart cache current
+        geocode_businesses(db, Business, gazetteer)
+        with db.engine.begin() as connection:
+            rebuild_business_counts(connection, Business, BusinessStat)
+            rebuild_business_counts(connection, Business, BusinessFacetCount, dimensions=FACET_DIMENSIONS)
+            data_versions.bump(connection, 'businesses')
+        chart_cache.invalidate()
+
+    def after_geocode():
+        with db.engine.begin() as connection:
+            data_versions.bump(connection, 'businesses')
+        chart_cache.invalidate()
+
+    register_import_command(app, db, Business, after_business_import)
+    register_geocode_command(app, db, Business, gazetteer, after_geocode)
+
+    def after_activity_compaction():
+        # Roll-ups delete raw rows with Core statements, which skip the ORM events behind the ETags
+        with db.engine.begin() as connection:
+            data_versions.bump(connection, 'activity_logs')
+
+    register_compact_command(app, activity_archive, after_activity_compaction)
+
+    return app
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create tables and apply migrations"""
+    db.create_all()
+    run_migrations(db.engine)
+    click.echo("Database initialized")
@@ -0,0 +1,336 @@
+import csv
+import math
+import os
+from collections import Counter, namedtuple
+from itertools import islice
+
+import click
+from sqlalchemy import and_, bindparam, event, func, inspect, or_, select, true, update
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gazetteer.csv')
+
+# Characters stored per geohash; nine is a cell a few metres across
+GEOHASH_PRECISION = 9
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Most geohash ranges one radius query ORs together; wider circles use shorter, coarser prefixes
+MAX_CELLS = 16
+
+# Columns filled from the gazetteer
+LOCATION_FIELDS = ('latitude', 'longitude', 'geohash', 'county', 'metro')
+
+# Columns the region rollups group by
+REGION_LEVELS = ('county', 'metro')
+
+Place = namedtuple('Place', 'latitude longitude county metro')
+
+
+def geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Encode a point as a geohash; points sharing a prefix share the cell it names"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, use_longitude = [], 0, 0, True
+    while len(chars) < precision:
+        span, coordinate = (lon_range, longitude) if use_longitude else (lat_range, latitude)
+        middle = (span[0] + span[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            span[0] = middle
+        else:
+            span[1] = middle
+        use_longitude = not use_longitude
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """(south, west, north, east) of a box containing the circle; west/east may pass ±180"""
+    south = max(latitude - radius_km / KM_PER_DEGREE, -90.0)
+    north = min(latitude + radius_km / KM_PER_DEGREE, 90.0)
+    # Degrees of longitude shrink towards the poles, so size the box at its widest-reaching latitude
+    cos_lat = math.cos(math.radians(max(abs(south), abs(north))))
+    half_width = 180.0 if cos_lat < 1e-9 else min(radius_km / (KM_PER_DEGREE * cos_lat), 180.0)
+    return south, longitude - half_width, north, longitude + half_width
+
+
+def _cell_size(precision):
+    # (height, width) in degrees; longitude takes the odd bit
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def _steps(low, high, step):
+    value = low
+    while value < high:
+        yield value
+        value += step
+    yield high
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """Geohash prefixes whose cells together cover the circle around a point"""
+    south, west, north, east = bounding_box(latitude, longitude, radius_km)
+    if east - west >= 360:
+        return ['']
+
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = _cell_size(precision)
+        if (math.ceil((north - south) / height) + 1) * (math.ceil((east - west) / width) + 1) <= MAX_CELLS:
+            break
+
+    return sorted({
+        geohash(lat, (lon + 180) % 360 - 180, precision)
+        for lat in _steps(south, north, height)
+        for lon in _steps(west, east, width)
+    })
+
+
+def _prefix_range(column, prefix):
+    # Range rather than LIKE so both SQLite and PostgreSQL walk the index; the upper bound is
+    # the next prefix in geohash order, carrying past 'z'
+    stripped = prefix.rstrip('z')
+    if not stripped:
+        return column >= prefix
+    upper = stripped[:-1] + _BASE32[_BASE32.index(stripped[-1]) + 1]
+    return and_(column >= prefix, column < upper)
+
+
+def place_key(city, state):
+    """Normalize a city and state so 'St. Louis' matches 'Saint Louis' and 'New York City' matches 'New York'"""
+    words = (city or '').lower().replace('.', ' ').split()
+    if words and words[0] == 'saint':
+        words[0] = 'st'
+    if words and words[0] == 'fort':
+        words[0] = 'ft'
+    if len(words) > 1 and words[-1] == 'city':
+        words.pop()
+    return ' '.join(words), ' '.join((state or '').lower().split())
+
+
+class Gazetteer:
+    """City centroids with their county and metro area, read from a bundled CSV
+
+    Lookups never leave the machine; cities missing from the file stay ungeocoded.
+    """
+
+    def __init__(self, path=GAZETTEER_PATH):
+        self.path = path
+        self._places = None
+
+    def init_app(self, app):
+        app.config.setdefault('GAZETTEER_PATH', self.path)
+        if app.config['GAZETTEER_PATH'] != self.path:
+            self.path = app.config['GAZETTEER_PATH']
+            self._places = None
+        app.extensions['gazetteer'] = self
+
+    @property
+    def places(self):
+        if self._places is None:
+            self._places = self._load()
+        return self._places
+
+    def _load(self):
+        with open(self.path, encoding='utf-8', newline='') as f:
+            return {
+                place_key(row['city'], row['state']): Place(
+                    float(row['latitude']), float(row['longitude']), row['county'] or None, row['metro'] or None
+                )
+                for row in csv.DictReader(f)
+            }
+
+    def lookup(self, city, state):
+        return self.places.get(place_key(city, state))
+
+
+gazetteer = Gazetteer()
+
+
+def location_values(place):
+    """Location column values for a gazetteer place, or all None when there is none"""
+    if place is None:
+        return dict.fromkeys(LOCATION_FIELDS)
+    return {
+        'latitude': place.latitude,
+        'longitude': place.longitude,
+        'geohash': geohash(place.latitude, place.longitude),
+        'county': place.county,
+        'metro': place.metro,
+    }
+
+
+def track_locations(business_model, gazetteer):
+    """Geocode businesses from the gazetteer as they are written, and again when their city or state changes"""
+
+    @event.listens_for(business_model, 'before_insert')
+    def locate_business(mapper, connection, target):
+        if target.latitude is None:
+            _locate(target)
+
+    @event.listens_for(business_model, 'before_update')
+    def relocate_business(mapper, connection, target):
+        attrs = inspect(target).attrs
+        moved = attrs.city.history.has_changes() or attrs.state.history.has_changes()
+        # Coordinates set explicitly in the same change win over the city centroid
+        if moved and not attrs.latitude.history.has_changes():
+            _locate(target)
+
+    def _locate(target):
+        for field, value in location_values(gazetteer.lookup(target.city, target.state)).items():
+            setattr(target, field, value)
+
+
+def geocode_businesses(db, business_model, gazetteer, refresh=False, chunk_size=500):
+    """Fill the location columns of businesses from the gazetteer; returns (geocoded, unmatched)
+
+    Businesses are matched by city and state, so the work is one UPDATE per
+    distinct city rather than per row, batched chunk_size cities to a
+    transaction. Only businesses without coordinates are touched unless
+    refresh is set. unmatched is a Counter of (city, state) to businesses.
+    Core updates bypass ORM events, so callers must bump data versions and
+    invalidate caches afterwards.
+    """
+    table = business_model.__table__
+    pending = true() if refresh else table.c.latitude.is_(None)
+
+    with db.engine.connect() as connection:
+        places = connection.execute(
+            select(table.c.city, table.c.state, func.count()).where(pending).group_by(table.c.city, table.c.state)
+        ).all()
+
+    stmt = update(table).where(
+        table.c.city == bindparam('match_city'), table.c.state == bindparam('match_state'), pending
+    ).values({field: bindparam(f'new_{field}') for field in LOCATION_FIELDS})
+
+    geocoded, unmatched, params = 0, Counter(), []
+    for city, state, count in places:
+        place = gazetteer.lookup(city, state)
+        if place is None:
+            unmatched[(city, state)] = count
+            continue
+        geocoded += count
+        values = {f'new_{field}': value for field, value in location_values(place).items()}
+        params.append({'match_city': city, 'match_state': state, **values})
+
+    params = iter(params)
+    while True:
+        chunk = list(islice(params, chunk_size))
+        if not chunk:
+            break
+        with db.engine.begin() as connection:
+            connection.execute(stmt, chunk)
+
+    return geocoded, unmatched
+
+
+def region_counts(session, business_model, level, business_type=None):
+    """(label, count) rows of geocoded businesses per county or metro area, largest first"""
+    if level not in REGION_LEVELS:
+        raise ValueError(f'unknown region level {level!r}')
+
+    region = getattr(business_model, level)
+    count = func.count(business_model.id)
+    # County names repeat across states, so they are grouped and labelled with theirs
+    columns = (region, business_model.state) if level == 'county' else (region,)
+    query = session.query(*columns, count.label('count')).filter(region.isnot(None))
+    if business_type is not None:
+        query = query.filter(business_model.type == business_type)
+    rows = query.group_by(*columns).order_by(count.desc()).all()
+
+    if level == 'county':
+        return [(f'{county}, {state}', total) for county, state, total in rows]
+    return [(metro, total) for metro, total in rows]
+
+
+class BusinessLocator:
+    """Within-radius and nearest-N queries over geocoded businesses
+
+    The circle's bounding box is covered by at most MAX_CELLS geohash
+    prefixes, each read as a range on the indexed geohash column; exact
+    great-circle distances are then computed in Python for the candidates
+    only, so a query never scans businesses far from the point.
+    """
+
+    def __init__(self, db, business_model, app=None):
+        self.db = db
+        self.model = business_model
+        self.max_radius_km = 500
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('GEO_MAX_RADIUS_KM', 500)
+        self.max_radius_km = app.config['GEO_MAX_RADIUS_KM']
+        app.extensions['business_locator'] = self
+
+    def within(self, latitude, longitude, radius_km, business_type=None, limit=None):
+        """(business, distance_km) pairs within radius_km of the point, nearest first"""
+        radius_km = min(radius_km, self.max_radius_km)
+        return self._load(self._distances(latitude, longitude, radius_km, business_type)[:limit])
+
+    def nearest(self, latitude, longitude, count=10, business_type=None):
+        """The count businesses nearest the point, as (business, distance_km) pairs, searching out to max_radius_km"""
+        radius_km = min(25, self.max_radius_km)
+        while True:
+            found = self._distances(latitude, longitude, radius_km, business_type)
+            # Everything inside the radius has been seen, so once it holds count businesses they are the nearest
+            if len(found) >= count or radius_km >= self.max_radius_km:
+                return self._load(found[:count])
+            radius_km = min(radius_km * 4, self.max_radius_km)
+
+    def _distances(self, latitude, longitude, radius_km, business_type):
+        table = self.model.__table__
+        cells = covering_cells(latitude, longitude, radius_km)
+        query = select(table.c.id, table.c.latitude, table.c.longitude).where(
+            or_(*[_prefix_range(table.c.geohash, cell) for cell in cells])
+        )
+        if business_type is not None:
+            query = query.where(table.c.type == business_type)
+
+        found = []
+        for id_, lat, lon in self.db.session.execute(query):
+            distance = distance_km(latitude, longitude, lat, lon)
+            if distance <= radius_km:
+                found.append((distance, id_))
+        found.sort()
+        return found
+
+    def _load(self, found):
+        if not found:
+            return []
+        ids = [id_ for _, id_ in found]
+        rows = {row.id: row for row in self.model.query.filter(self.model.id.in_(ids)).all()}
+        return [(rows[id_], distance) for distance, id_ in found if id_ in rows]
+
+
+def register_geocode_command(app, db, business_model, gazetteer, after_geocode):
+    """Add a 'flask geocode-businesses' command; after_geocode() runs once locations are written"""
+
+    @app.cli.command('geocode-businesses')
+    @click.option('--refresh', is_flag=True, help='Re-geocode businesses that already have coordinates.')
+    def geocode_businesses_command(refresh):
+        """Fill business coordinates, county and metro area from the bundled gazetteer"""
+        geocoded, unmatched = geocode_businesses(db, business_model, gazetteer, refresh=refresh)
+        if geocoded:
+            after_geocode()
+
+        click.echo(f'Geocoded {geocoded:,} businesses; {sum(unmatched.values()):,} in cities not in the gazetteer')
+        for (city, state), count in unmatched.most_common(20):
+            click.echo(f'  {city}, {state}: {count:,}')
+        if len(unmatched) > 20:
+            click.echo(f'  ... and {len(unmatched) - 20:,} more cities')
@@ -0,0 +1,173 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+logger = logging.getLogger(__name__)
+
+
+class HasherBusy(Exception):
+    """Raised when the password hashing pool has no capacity left within the timeout"""
+
+
+def _timed(function, args, submitted_at):
+    # Runs in a pool process; wall clock times because monotonic clocks are per process on some platforms
+    started_at = time.time()
+    result = function(*args)
+    return result, started_at - submitted_at, time.time() - started_at
+
+
+class PasswordHasher:
+    """Runs password hashing and verification in a process pool
+
+    Key derivation is CPU bound and holds the GIL, so running it on request
+    threads lets a burst of logins starve every other page. The pool has
+    PASSWORD_HASH_WORKERS processes (0 runs everything inline) and at most
+    PASSWORD_HASH_MAX_PENDING jobs queued or running; a job that cannot get a
+    slot or a result within PASSWORD_HASH_TIMEOUT seconds raises HasherBusy.
+
+    The pool is created on first use and again in any forked child, since
+    executors do not survive fork(). Serverless hosts such as AWS Lambda
+    have no /dev/shm for the pool's queues and locks, so init_app() with
+    serverless=True defaults to hashing inline.
+    """
+
+    def __init__(self, app=None):
+        self.workers = min(4, os.cpu_count() or 1)
+        self.max_pending = self.workers * 4
+        self.timeout = 10.0
+        self.start_method = 'spawn'
+        self._executor = None
+        self._pid = None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'submitted': 0, 'completed': 0, 'rejected': 0, 'cancelled': 0,
+            'queue_seconds': 0.0, 'max_queue_seconds': 0.0, 'run_seconds': 0.0
+        }
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, serverless=False):
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 0 if serverless else self.workers)
+        app.config.setdefault('PASSWORD_HASH_MAX_PENDING', app.config['PASSWORD_HASH_WORKERS'] * 4)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 10.0)
+        app.config.setdefault('PASSWORD_HASH_START_METHOD', 'spawn')
+
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.max_pending = max(1, app.config['PASSWORD_HASH_MAX_PENDING'])
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self.start_method = app.config['PASSWORD_HASH_START_METHOD']
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+        app.extensions['password_hasher'] = self
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def verify_any(self, password_hashes, password):
+        """Return True if password matches any of password_hashes
+
+        The hashes are checked in parallel and the remaining checks are
+        cancelled as soon as one matches.
+        """
+        password_hashes = list(password_hashes)
+        if not password_hashes:
+            return False
+        if not self.workers:
+            return any(check_password_hash(password_hash, password) for password_hash in password_hashes)
+
+        pending = set()
+        deadline = time.monotonic() + self.timeout
+        try:
+            for password_hash in password_hashes:
+                pending.add(self._submit(check_password_hash, password_hash, password))
+            while pending:
+                done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+                if not done:
+                    raise HasherBusy('Timed out waiting for password verification')
+                if any(self._result(future) for future in done):
+                    return True
+            return False
+        finally:
+            for future in pending:
+                if future.cancel():
+                    self._count('cancelled')
+
+    def metrics(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        completed = stats['completed']
+        stats['avg_queue_seconds'] = round(stats['queue_seconds'] / completed, 6) if completed else None
+        stats['avg_run_seconds'] = round(stats['run_seconds'] / completed, 6) if completed else None
+        stats['workers'] = self.workers
+        stats['max_pending'] = self.max_pending
+        return stats
+
+    def _run(self, function, *args):
+        if not self.workers:
+            return function(*args)
+        future = self._submit(function, *args)
+        try:
+            return self._result(future, timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise HasherBusy('Timed out waiting for password hashing')
+
+    def _submit(self, function, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            self._count('rejected')
+            raise HasherBusy('Password hashing pool is at capacity')
+
+        try:
+            future = self._get_executor().submit(_timed, function, args, time.time())
+        except Exception:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda f: self._slots.release())
+        self._count('submitted')
+        return future
+
+    def _result(self, future, timeout=None):
+        try:
+            result, queue_seconds, run_seconds = future.result(timeout=timeout)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool for the next job
+            logger.error("Password hashing pool is broken, restarting it")
+            self._executor = None
+            raise
+        with self._stats_lock:
+            self.stats['completed'] += 1
+            self.stats['queue_seconds'] += queue_seconds
+            self.stats['max_queue_seconds'] = max(self.stats['max_queue_seconds'], queue_seconds)
+            self.stats['run_seconds'] += run_seconds
+        return result
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _get_executor(self):
+        if self._executor is not None and self._pid == os.getpid():
+            return self._executor
+
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                context = multiprocessing.get_context(self.start_method)
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                self._pid = os.getpid()
+        return self._executor
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,155 @@
+from datetime import date, datetime
+
+from sqlalchemy import Date, DateTime, event
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+# Re-read on every cache hit when sessions are verified, in this order
+VERIFIED_FIELDS = ('session_version', 'is_active', 'role')
+
+
+class IdentityCache:
+    """Short-lived cache of the users Flask-Login loads on every request
+
+    Entries are plain dicts of a user's attributes, so they work with the
+    in-process and Redis cache backends alike, and live for IDENTITY_CACHE_TTL
+    seconds. Call forget() when a user changes; track() does that
+    automatically for SQLAlchemy models once the change commits.
+
+    forget() only reaches other workers through a shared backend. With the
+    in-process one, load() re-reads the user's session_version, is_active and
+    role on every cache hit (IDENTITY_VERIFY_SESSIONS, on by default unless
+    the backend is shared), so a password change, deactivation or role change
+    committed by any worker applies on the next request everywhere. That
+    check is still one primary key query per request, so the cache only saves
+    queries with a shared backend (CACHE_REDIS_URL).
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.verify_sessions = True
+
+    def init_app(self, app):
+        app.config.setdefault('IDENTITY_CACHE_TTL', 30)
+        app.config.setdefault('IDENTITY_VERIFY_SESSIONS', None)
+        self.cache.init_app(app)
+        self.cache.ttl = app.config['IDENTITY_CACHE_TTL']
+
+        verify = app.config['IDENTITY_VERIFY_SESSIONS']
+        self.verify_sessions = not getattr(self.cache.backend, 'shared', False) if verify is None else verify
+        app.extensions['identity_cache'] = self
+
+    def get(self, user_id, fetch):
+        """Return the cached snapshot for user_id, calling fetch() for it on a miss
+
+        fetch returns a snapshot dict, or None when there is no such user; None
+        is never cached.
+        """
+        return self.cache.get_or_set(f'user:{user_id}', fetch)
+
+    def load(self, user_id, session_version, fetch, fetch_state):
+        """Return the snapshot for a session of user_id at session_version, or None when that session has ended
+
+        fetch returns a snapshot as for get(); fetch_state returns the user's
+        current VERIFIED_FIELDS values from the database as a row, or None.
+        """
+        fetched = []
+
+        def fetch_once():
+            fetched.append(True)
+            return fetch()
+
+        snapshot = self.get(user_id, fetch_once)
+        if snapshot is None:
+            return None
+
+        current = tuple(snapshot[field] for field in VERIFIED_FIELDS)
+        if self.verify_sessions and not fetched:
+            state = fetch_state()
+            if state is None or tuple(state) != current:
+                # Changed by another worker: this copy is stale
+                self.forget(user_id)
+                if state is None:
+                    return None
+                current = tuple(state)
+                snapshot = dict(snapshot, **dict(zip(VERIFIED_FIELDS, current)))
+
+        version, is_active, _ = current
+        if version != session_version or not is_active:
+            return None
+        return snapshot
+
+    def forget(self, user_id):
+        self.cache.delete(f'user:{user_id}')
+
+    def track(self, model):
+        """Forget users of model written by a session once the transaction commits
+
+        Deactivating a user (is_active set false) also bumps session_version,
+        so their existing sessions end even if they are reactivated later.
+        """
+        def deactivated(target, value, oldvalue, initiator):
+            if oldvalue is True and not value:
+                target.session_version = (target.session_version or 0) + 1
+            return value
+
+        def after_flush(session, flush_context):
+            changed = session.info.setdefault('identity_changed', set())
+            for instance in (*session.dirty, *session.deleted):
+                if isinstance(instance, model):
+                    changed.add(instance.id)
+
+        def after_commit(session):
+            for user_id in session.info.pop('identity_changed', ()):
+                self.forget(user_id)
+
+        def after_soft_rollback(session, previous_transaction):
+            session.info.pop('identity_changed', None)
+
+        event.listen(Session, 'after_flush', after_flush)
+        event.listen(Session, 'after_commit', after_commit)
+        event.listen(Session, 'after_soft_rollback', after_soft_rollback)
+        event.listen(model.is_active, 'set', deactivated, active_history=True, retval=True)
+
+
+def split_user_id(value):
+    """Split a Flask-Login id of the form 'id:session_version' into (id, version)
+
+    Ids stored before session versions existed carry no version and are
+    treated as version 0.
+    """
+    user_id, _, version = str(value).partition(':')
+    return int(user_id), int(version or 0)
+
+
+def snapshot_row(instance, exclude=('password_hash',)):
+    """Return a cacheable dict of instance's column attributes, leaving out secrets in exclude"""
+    values = {}
+    for attr in instance.__mapper__.column_attrs:
+        if attr.key in exclude:
+            continue
+        value = getattr(instance, attr.key)
+        values[attr.key] = value.isoformat() if isinstance(value, (datetime, date)) else value
+    return values
+
+
+def restore_row(db, model, snapshot):
+    """Rebuild an instance from snapshot_row() output and attach it to the session without a query
+
+    Attributes missing from the snapshot are left unloaded and fetched from the
+    database only if something reads them.
+    """
+    values = {}
+    for attr in model.__mapper__.column_attrs:
+        if attr.key not in snapshot:
+            continue
+        value = snapshot[attr.key]
+        column_type = attr.columns[0].type
+        if isinstance(value, str) and isinstance(column_type, DateTime):
+            value = datetime.fromisoformat(value)
+        elif isinstance(value, str) and isinstance(column_type, Date):
+            value = date.fromisoformat(value)
+        values[attr.key] = value
+
+    instance = model(**values)
+    make_transient_to_detached(instance)
+    return db.session.merge(instance, load=False)
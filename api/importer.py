@@ -0,0 +1,281 @@
+import csv
+import gzip
+import io
+import json
+import os
+import time
+from datetime import datetime
+from itertools import islice
+
+import click
+from sqlalchemy import func, literal_column, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+
+STATES = {
+    'AL': 'Alabama', 'AK': 'Alaska', 'AZ': 'Arizona', 'AR': 'Arkansas', 'CA': 'California',
+    'CO': 'Colorado', 'CT': 'Connecticut', 'DE': 'Delaware', 'DC': 'District of Columbia',
+    'FL': 'Florida', 'GA': 'Georgia', 'HI': 'Hawaii', 'ID': 'Idaho', 'IL': 'Illinois',
+    'IN': 'Indiana', 'IA': 'Iowa', 'KS': 'Kansas', 'KY': 'Kentucky', 'LA': 'Louisiana',
+    'ME': 'Maine', 'MD': 'Maryland', 'MA': 'Massachusetts', 'MI': 'Michigan', 'MN': 'Minnesota',
+    'MS': 'Mississippi', 'MO': 'Missouri', 'MT': 'Montana', 'NE': 'Nebraska', 'NV': 'Nevada',
+    'NH': 'New Hampshire', 'NJ': 'New Jersey', 'NM': 'New Mexico', 'NY': 'New York',
+    'NC': 'North Carolina', 'ND': 'North Dakota', 'OH': 'Ohio', 'OK': 'Oklahoma', 'OR': 'Oregon',
+    'PA': 'Pennsylvania', 'RI': 'Rhode Island', 'SC': 'South Carolina', 'SD': 'South Dakota',
+    'TN': 'Tennessee', 'TX': 'Texas', 'UT': 'Utah', 'VT': 'Vermont', 'VA': 'Virginia',
+    'WA': 'Washington', 'WV': 'West Virginia', 'WI': 'Wisconsin', 'WY': 'Wyoming',
+}
+
+BUSINESS_TYPES = {
+    'Vehicle Dealership': ('vehicle dealership', 'vehicle dealer', 'auto dealer', 'auto dealership', 'car dealer', 'car dealership', 'dealership'),
+    'Real Estate Professional': ('real estate professional', 'real estate agent', 'real estate', 'realtor', 'realty', 'broker'),
+    'Apartment Rental': ('apartment rental', 'apartment rentals', 'apartments', 'apartment', 'rental'),
+}
+
+# Lower-cased spellings accepted for each state and type, mapped to the stored value
+_STATE_LOOKUP = {**{code.lower(): name for code, name in STATES.items()}, **{name.lower(): name for name in STATES.values()}}
+_TYPE_LOOKUP = {alias: name for name, aliases in BUSINESS_TYPES.items() for alias in (name.lower(), *aliases)}
+
+# Column lengths of the businesses table
+FIELD_LENGTHS = {
+    'name': 100, 'type': 50, 'state': 50, 'city': 50, 'address': 200,
+    'phone': 20, 'email': 100, 'website': 200, 'description': None,
+}
+
+OPTIONAL_FIELDS = ('address', 'phone', 'email', 'website', 'description')
+
+# Chains have several locations in one city, so the address is part of the key; no address counts as ''
+NATURAL_KEY = ('name', 'state', 'city', 'address')
+
+
+class InvalidRow(ValueError):
+    """Raised for an import row that cannot be normalized"""
+
+
+class ImportStats:
+    """Counters for one import run"""
+
+    def __init__(self, max_errors=20):
+        self.read = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.errors = []
+        self.max_errors = max_errors
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @property
+    def seconds(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.read / self.seconds if self.seconds else 0
+
+    def reject(self, line, error):
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line, str(error)))
+
+
+def clean(value):
+    """Strip and collapse whitespace; empty strings become None"""
+    if value is None:
+        return None
+    return ' '.join(str(value).split()) or None
+
+
+def normalize_state(value):
+    state = _STATE_LOOKUP.get((clean(value) or '').lower().rstrip('.'))
+    if state is None:
+        raise InvalidRow(f'unknown state {value!r}')
+    return state
+
+
+def normalize_type(value):
+    business_type = _TYPE_LOOKUP.get((clean(value) or '').lower())
+    if business_type is None:
+        raise InvalidRow(f'unknown business type {value!r}')
+    return business_type
+
+
+def normalize_city(value):
+    city = clean(value)
+    if city is None:
+        raise InvalidRow('city is required')
+    # Title-case shouted or lower-case feeds, but leave mixed case ('McAllen', 'DeKalb') alone
+    if city.isupper() or city.islower():
+        city = city.title()
+    return city
+
+
+def normalize_business(row):
+    """Return the businesses table values for one input row, raising InvalidRow if it cannot be stored"""
+    if not isinstance(row, dict):
+        raise InvalidRow('row is not an object')
+    business = {field: clean(row.get(field)) for field in OPTIONAL_FIELDS}
+    business['name'] = clean(row.get('name'))
+    if business['name'] is None:
+        raise InvalidRow('name is required')
+    business['type'] = normalize_type(row.get('type'))
+    business['state'] = normalize_state(row.get('state'))
+    business['city'] = normalize_city(row.get('city'))
+    if business['email']:
+        business['email'] = business['email'].lower()
+
+    for field, length in FIELD_LENGTHS.items():
+        if length and business[field] and len(business[field]) > length:
+            raise InvalidRow(f'{field} is longer than {length} characters')
+
+    return business
+
+
+def natural_key(business):
+    return tuple(business[field] or '' for field in NATURAL_KEY)
+
+
+def natural_key_columns(table):
+    """The expressions of the unique natural key index, as ON CONFLICT must name them"""
+    # A literal '' rather than a bound parameter, or the target no longer matches the index
+    return [func.coalesce(table.c[field], literal_column("''")) if field == 'address' else table.c[field]
+            for field in NATURAL_KEY]
+
+
+def read_rows(path, format=None):
+    """Yield dicts from a CSV or NDJSON file, one at a time; '.gz' files are decompressed on the fly
+
+    The format comes from the file extension unless given. '-' reads standard input.
+    """
+    name = path[:-3] if path.endswith('.gz') else path
+    if format is None:
+        format = 'csv' if name.endswith('.csv') else 'ndjson'
+
+    if path == '-':
+        stream = io.TextIOWrapper(click.get_binary_stream('stdin'), encoding='utf-8-sig', newline='')
+    elif path.endswith('.gz'):
+        stream = gzip.open(path, 'rt', encoding='utf-8-sig', newline='')
+    else:
+        stream = open(path, encoding='utf-8-sig', newline='')
+
+    with stream:
+        if format == 'csv':
+            reader = csv.DictReader(stream)
+            reader.fieldnames = [(clean(field) or '').lower().replace(' ', '_') for field in reader.fieldnames or []]
+            yield from reader
+        else:
+            for line in stream:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Passed on so the importer counts it as a rejected row
+                    yield None
+
+
+def import_businesses(db, business_model, rows, chunk_size=5000, stats=None, on_chunk=None):
+    """Normalize rows and insert them into business_model's table in chunks
+
+    Each chunk is one executemany INSERT in its own transaction, so memory stays
+    bounded by chunk_size and an interrupted import can simply be re-run: rows
+    whose (name, state, city, address) already exists are skipped, both within the file
+    and against the table. Core inserts bypass ORM events, so callers must
+    rebuild the business counts and invalidate caches afterwards.
+    """
+    stats = stats or ImportStats()
+    table = business_model.__table__
+    rows = iter(rows)
+
+    while True:
+        batch = list(islice(rows, chunk_size))
+        if not batch:
+            break
+
+        chunk = {}
+        for row in batch:
+            stats.read += 1
+            try:
+                business = normalize_business(row)
+            except InvalidRow as e:
+                stats.reject(stats.read, e)
+                continue
+            key = natural_key(business)
+            if key in chunk:
+                stats.duplicates += 1
+            else:
+                chunk[key] = business
+
+        if chunk:
+            inserted = _insert_chunk(db.engine, table, list(chunk.values()))
+            stats.inserted += inserted
+            stats.duplicates += len(chunk) - inserted
+        if on_chunk:
+            on_chunk(stats)
+
+    stats.finished = time.perf_counter()
+    return stats
+
+
+def _insert_chunk(engine, table, businesses):
+    now = datetime.utcnow()
+    for business in businesses:
+        business['created_at'] = business['updated_at'] = now
+
+    dialect = engine.dialect.name
+    with engine.begin() as connection:
+        if dialect == 'sqlite':
+            stmt = sqlite.insert(table).on_conflict_do_nothing(index_elements=natural_key_columns(table))
+            return connection.execute(stmt, businesses).rowcount
+        if dialect == 'postgresql':
+            # rowcount is not reliable across psycopg2's batched executemany; count the returned ids instead
+            stmt = postgresql.insert(table).on_conflict_do_nothing(index_elements=natural_key_columns(table)).returning(table.c.id)
+            return len(connection.execute(stmt, businesses).all())
+
+        columns = natural_key_columns(table)
+        existing = set(connection.execute(
+            select(*columns).where(tuple_(*columns).in_([natural_key(business) for business in businesses]))
+        ).all())
+        fresh = [business for business in businesses if natural_key(business) not in existing]
+        if fresh:
+            connection.execute(table.insert(), fresh)
+        return len(fresh)
+
+
+def register_import_command(app, db, business_model, after_import):
+    """Add a 'flask import-businesses' command; after_import() runs once the rows are in"""
+    app.config.setdefault('IMPORT_CHUNK_SIZE', 5000)
+
+    @app.cli.command('import-businesses')
+    @click.argument('path')
+    @click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson']), default=None,
+                  help='Input format; taken from the file extension by default.')
+    @click.option('--chunk-size', type=int, default=None, help='Rows per INSERT transaction.')
+    def import_businesses_command(path, file_format, chunk_size):
+        """Load businesses from a CSV or NDJSON file, skipping rows already in the directory"""
+        if path != '-' and not os.path.exists(path):
+            raise click.ClickException(f'No such file: {path}')
+
+        def progress(stats):
+            click.echo(
+                f'\r  {stats.read:,} read, {stats.inserted:,} inserted, {stats.duplicates:,} duplicates, '
+                f'{stats.rejected:,} rejected ({stats.rows_per_second:,.0f} rows/s)',
+                nl=False
+            )
+
+        stats = import_businesses(
+            db, business_model, read_rows(path, file_format),
+            chunk_size=chunk_size or app.config['IMPORT_CHUNK_SIZE'], on_chunk=progress
+        )
+        click.echo()
+
+        for line, error in stats.errors:
+            click.echo(f'  row {line}: {error}')
+        if stats.rejected > len(stats.errors):
+            click.echo(f'  ... and {stats.rejected - len(stats.errors):,} more rejected rows')
+
+        if stats.inserted:
+            after_import()
+        click.echo(
+            f'Imported {stats.inserted:,} of {stats.read:,} rows in {stats.seconds:.1f}s '
+            f'({stats.rows_per_second:,.0f} rows/s)'
+        )
@@ -0,0 +1,335 @@
+import hmac
+import json
+import logging
+import threading
+import time
+
+from flask import Response, abort, current_app, g, has_request_context, request
+from flask_login import current_user
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger(f'{__name__}.slow_queries')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Extensions whose stats dicts are exported as counters, under these metric prefixes
+EXTENSION_STATS = {
+    'activity_log_writer': 'activity_writer',
+    'activity_policy': 'activity_policy',
+    'activity_broker': 'activity_stream',
+    'password_hasher': 'password_hash',
+}
+
+# Bind parameters longer than this are cut in the slow query log
+MAX_PARAMETERS_LENGTH = 1000
+
+
+class RequestMetrics:
+    """What one request cost: SQL statements, database time and the slowest statement"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Histogram:
+    """Prometheus histogram keyed by label values; callers hold Instrumentation's lock"""
+
+    def __init__(self, name, documentation, labels, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, label_values, value):
+        series = self.series.get(label_values)
+        if series is None:
+            # One count per bucket, then the sum and the total count
+            series = self.series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for label_values, series in sorted(self.series.items()):
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{_labels(self.labels, label_values, [("le", bound)])} {count}')
+            lines.append(f'{self.name}_bucket{_labels(self.labels, label_values, [("le", "+Inf")])} {series[-1]}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, label_values)} {series[-2]}')
+            lines.append(f'{self.name}_count{_labels(self.labels, label_values)} {series[-1]}')
+        return lines
+
+
+class Counter:
+    """Prometheus counter keyed by label values; callers hold Instrumentation's lock"""
+
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, label_values, amount=1):
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for label_values, value in sorted(self.series.items()):
+            lines.append(f'{self.name}{_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+def _metric(kind, name, documentation, samples):
+    """Render samples [(labels dict, value)] collected at scrape time"""
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+    for labels, value in samples:
+        if value is not None:
+            lines.append(f'{name}{_labels(list(labels), list(labels.values()))} {value}')
+    return lines
+
+
+def collect_pool(status):
+    lines = []
+    for key in ('size', 'checked_in', 'checked_out', 'overflow', 'max_wait_seconds'):
+        if key in status:
+            lines += _metric('gauge', f'db_pool_{key}', f'Connection pool {key.replace("_", " ")}', [({}, status[key])])
+    for key in ('checkouts', 'timeouts', 'wait_seconds'):
+        if key in status:
+            lines += _metric('counter', f'db_pool_{key}_total', f'Connection pool {key.replace("_", " ")}',
+                             [({}, status[key])])
+    return lines
+
+
+def collect_caches(caches):
+    lines = []
+    for key in ('hits', 'misses', 'errors', 'invalidations'):
+        lines += _metric('counter', f'cache_{key}_total', f'Cache {key}', [
+            ({'cache': namespace}, cache.stats()[key]) for namespace, cache in sorted(caches.items())
+        ])
+    return lines
+
+
+def collect_stats(prefix, stats):
+    lines = []
+    for key, value in sorted(stats.items()):
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            continue
+        if key.startswith('max_'):
+            lines += _metric('gauge', f'{prefix}_{key}', f'{prefix} {key}', [({}, value)])
+        else:
+            lines += _metric('counter', f'{prefix}_{key}_total', f'{prefix} {key}', [({}, value)])
+    return lines
+
+
+class Instrumentation:
+    """Per-request wall time, SQL statements, database time, rows and response size
+
+    Each request gets a Server-Timing header (total, db and the slowest
+    statement) and, with INSTRUMENTATION_LOG_REQUESTS, one JSON log line.
+    Per-endpoint histograms plus the connection pool, caches and background
+    workers are exported in Prometheus text format at METRICS_PATH to admins
+    and to scrapers sending METRICS_TOKEN as a bearer token. Statements
+    slower than SLOW_QUERY_MS are logged, inside requests or not; their bind
+    parameters hold emails and password hashes, so they are only included
+    with SLOW_QUERY_LOG_PARAMETERS.
+
+    Rows are what the driver reports in cursor.rowcount: affected rows, and
+    returned rows only where the driver counts them (psycopg2 does, SQLite
+    does not). Metrics are per process; each worker is a separate target.
+    Pass database.pool_status to init_app to export the connection pool.
+    """
+
+    def __init__(self, app=None):
+        self.slow_query_seconds = 0.5
+        self.log_parameters = False
+        self.pool_status = None
+        self._engines = set()
+        self._lock = threading.Lock()
+        self.request_duration = Histogram(
+            'http_request_duration_seconds', 'Request wall time', ('endpoint', 'method'), LATENCY_BUCKETS
+        )
+        self.request_queries = Histogram(
+            'http_request_queries', 'SQL statements per request', ('endpoint', 'method'), QUERY_COUNT_BUCKETS
+        )
+        self.request_db_duration = Histogram(
+            'http_request_db_duration_seconds', 'Database time per request', ('endpoint', 'method'), LATENCY_BUCKETS
+        )
+        self.response_size = Histogram(
+            'http_response_size_bytes', 'Response body size', ('endpoint', 'method'), SIZE_BUCKETS
+        )
+        self.requests = Counter('http_requests_total', 'Requests by status', ('endpoint', 'method', 'status'))
+        self.slow_queries = Counter('db_slow_queries_total', 'Statements slower than SLOW_QUERY_MS', ('endpoint',))
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, pool_status=None):
+        app.config.setdefault('SLOW_QUERY_MS', 500)
+        app.config.setdefault('SLOW_QUERY_LOG_PARAMETERS', False)
+        app.config.setdefault('SERVER_TIMING', True)
+        app.config.setdefault('INSTRUMENTATION_LOG_REQUESTS', True)
+        app.config.setdefault('METRICS_PATH', '/metrics')
+        app.config.setdefault('METRICS_TOKEN', None)
+
+        self.slow_query_seconds = app.config['SLOW_QUERY_MS'] / 1000
+        self.log_parameters = app.config['SLOW_QUERY_LOG_PARAMETERS']
+        self.pool_status = pool_status
+
+        # Flask-SQLAlchemy creates its engines in init_app; one set up later is attached on the first request
+        if 'sqlalchemy' in app.extensions:
+            with app.app_context():
+                self.instrument(app.extensions['sqlalchemy'].engine)
+
+        app.before_request(self.start_request)
+        # after_request hooks run last-registered first; going to the front makes this one run after
+        # all the others, compression included, so the time and size are of what is sent
+        app.after_request_funcs.setdefault(None, []).insert(0, self.finish_request)
+        app.add_url_rule(app.config['METRICS_PATH'], 'metrics', self.metrics)
+        app.extensions['instrumentation'] = self
+
+    def instrument(self, engine):
+        """Time every statement run on engine"""
+        with self._lock:
+            if engine in self._engines:
+                return
+            self._engines.add(engine)
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def start_request(self):
+        self.instrument(current_app.extensions['sqlalchemy'].engine)
+        g.request_metrics = RequestMetrics()
+
+    def finish_request(self, response):
+        metrics = g.pop('request_metrics', None)
+        if metrics is None or request.endpoint in ('metrics', 'static'):
+            return response
+
+        elapsed = time.perf_counter() - metrics.started
+        size = response.content_length
+        if size is None and not response.is_streamed:
+            size = len(response.get_data())
+        labels = (request.endpoint or 'unmatched', request.method)
+
+        with self._lock:
+            self.request_duration.observe(labels, elapsed)
+            self.request_queries.observe(labels, metrics.queries)
+            self.request_db_duration.observe(labels, metrics.db_seconds)
+            if size is not None:
+                self.response_size.observe(labels, size)
+            self.requests.inc(labels + (response.status_code,))
+
+        if current_app.config['SERVER_TIMING']:
+            timings = [
+                f'app;dur={elapsed * 1000:.1f}',
+                f'db;desc="{metrics.queries} queries";dur={metrics.db_seconds * 1000:.1f}',
+            ]
+            if metrics.queries:
+                timings.append(f'db-slowest;dur={metrics.slowest_seconds * 1000:.1f}')
+            response.headers.add('Server-Timing', ', '.join(timings))
+
+        if current_app.config['INSTRUMENTATION_LOG_REQUESTS'] and logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'endpoint': labels[0],
+                'status': response.status_code,
+                'duration_ms': round(elapsed * 1000, 2),
+                'queries': metrics.queries,
+                'db_ms': round(metrics.db_seconds * 1000, 2),
+                'slowest_ms': round(metrics.slowest_seconds * 1000, 2),
+                'slowest_statement': metrics.slowest_statement,
+                'rows': metrics.rows,
+                'response_bytes': size,
+            }))
+        return response
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('instrumentation_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('instrumentation_started')
+        if not started:
+            # Attached while this statement was running
+            return
+        elapsed = time.perf_counter() - started.pop()
+        metrics = g.get('request_metrics') if has_request_context() else None
+
+        if metrics is not None:
+            metrics.queries += 1
+            metrics.db_seconds += elapsed
+            if cursor.rowcount > 0:
+                metrics.rows += cursor.rowcount
+            if elapsed >= metrics.slowest_seconds:
+                metrics.slowest_seconds = elapsed
+                metrics.slowest_statement = ' '.join(statement.split())
+
+        if elapsed >= self.slow_query_seconds:
+            endpoint = request.endpoint if has_request_context() else None
+            with self._lock:
+                self.slow_queries.inc((endpoint or 'none',))
+            entry = {
+                'duration_ms': round(elapsed * 1000, 2),
+                'endpoint': endpoint,
+                'statement': ' '.join(statement.split()),
+                'executemany': executemany,
+            }
+            if self.log_parameters:
+                bound = repr(parameters)
+                if len(bound) > MAX_PARAMETERS_LENGTH:
+                    bound = bound[:MAX_PARAMETERS_LENGTH] + '...'
+                entry['parameters'] = bound
+            slow_query_logger.warning(json.dumps(entry))
+
+    def metrics(self):
+        """Prometheus text exposition of this process's request, pool, cache and worker metrics"""
+        token = current_app.config['METRICS_TOKEN']
+        authorization = request.headers.get('Authorization', '')
+        scraper = bool(token) and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())
+        # Endpoint names, traffic and pool internals are not for the public
+        if not scraper and not (current_user.is_authenticated and current_user.role == 'Admin'):
+            abort(401)
+
+        with self._lock:
+            lines = []
+            for metric in (self.request_duration, self.request_queries, self.request_db_duration,
+                           self.response_size, self.requests, self.slow_queries):
+                lines += metric.render()
+
+        extensions = current_app.extensions
+        if self.pool_status is not None:
+            lines += collect_pool(self.pool_status(extensions['sqlalchemy'].engine))
+        lines += collect_caches(extensions.get('caches', {}))
+        for name, prefix in EXTENSION_STATS.items():
+            if name in extensions:
+                lines += collect_stats(prefix, dict(extensions[name].stats))
+        if 'activity_broker' in extensions:
+            lines += _metric('gauge', 'activity_stream_subscribers', 'Open activity streams',
+                             [({}, extensions['activity_broker'].subscribers)])
+
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+instrumentation = Instrumentation()
@@ -6,9 +6,17 @@ import os
 from datetime import datetime, timedelta
 import json
 import logging
+import click
+from sqlalchemy import inspect, select, text
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+from cache import Cache
+from database import configure_engine, pool_status
+from identity import IdentityCache, restore_row, snapshot_row, split_user_id
+from instrumentation import instrumentation
+from profiling import profiling_bp, sampling_profiler
+
+# Set up logging; each request logs one line with its timings at INFO
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
 
 # Initialize Flask app
@@ -18,9 +26,13 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:/
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # Initialize extensions
+configure_engine(app)
 db = SQLAlchemy(app)
+instrumentation.init_app(app, pool_status)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
+sampling_profiler.init_app(app)
+app.register_blueprint(profiling_bp)
 
 # User model - simplified
 class User(UserMixin, db.Model):
@@ -33,9 +45,15 @@ class User(UserMixin, db.Model):
     full_name = db.Column(db.String(100), nullable=False)
     role = db.Column(db.String(20), default='Staff')  # Admin, Manager, Staff
     is_active = db.Column(db.Boolean, default=True)
+    # Part of the login session id; bumping it signs the user out everywhere
+    session_version = db.Column(db.Integer, nullable=False, default=0)
     
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
+        self.session_version = (self.session_version or 0) + 1
+    
+    def get_id(self):
+        return f'{self.id}:{self.session_version or 0}'
     
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
@@ -55,12 +73,32 @@ class ActivityLog(db.Model):
     action = db.Column(db.String(64), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
-    user = db.relationship('User', backref='activity_logs')
+    # Every log listing shows the username, so the owning user is loaded in the same query
+    user = db.relationship('User', backref='activity_logs', lazy='joined', innerjoin=True)
+
+# Users are cached briefly between requests; changes to a user drop their entry on commit
+identity_cache = IdentityCache(Cache('identity'))
+identity_cache.init_app(app)
+identity_cache.track(User)
+
+def user_snapshot(user_id):
+    user = db.session.get(User, user_id)
+    return snapshot_row(user) if user else None
+
+def session_state(user_id):
+    return db.session.execute(select(User.session_version, User.is_active, User.role).where(User.id == user_id)).first()
 
 @login_manager.user_loader
 def load_user(user_id):
     try:
-        return User.query.get(int(user_id))
+        user_id, session_version = split_user_id(user_id)
+        # A bumped session version or a deactivated account ends existing sessions
+        snapshot = identity_cache.load(
+            user_id, session_version, lambda: user_snapshot(user_id), lambda: session_state(user_id)
+        )
+        if snapshot is None:
+            return None
+        return restore_row(db, User, snapshot)
     except Exception as e:
         logger.error(f"Error loading user: {e}")
         return None
@@ -170,6 +208,7 @@ def dashboard():
             recent_activity = []
         
         # Get business counts - using static data for reliability
+        # (this app has no Business model; simplified_app.py serves live counts from business_stats)
         total_businesses = 152
         vehicle_dealerships = 48
         real_estate = 64
@@ -333,6 +372,11 @@ def create_initial_data():
         with app.app_context():
             db.create_all()
             
+            # Databases created before session versions lack the column load_user checks
+            if 'session_version' not in {column['name'] for column in inspect(db.engine).get_columns('users')}:
+                with db.engine.begin() as connection:
+                    connection.execute(text('ALTER TABLE users ADD COLUMN session_version INTEGER NOT NULL DEFAULT 0'))
+            
             # Check if admin user exists
             admin = User.query.filter_by(email='admin@directoryhub.com').first()
             if not admin:
@@ -378,17 +422,22 @@ def create_initial_data():
         logger.error(f"Error creating initial data: {e}")
         db.session.rollback()
 
-# Call create_initial_data at startup with explicit schema reset
-with app.app_context():
-    try:
-        # Force drop all tables first to ensure clean schema
-        db.drop_all()
-        logger.info("Dropped all tables successfully")
-    except Exception as e:
-        logger.error(f"Error dropping tables: {e}")
+# Schema setup runs from 'flask init-db' instead of on every import, which kept DDL off cold starts
+@app.cli.command('init-db')
+@click.option('--drop', is_flag=True, help='Drop all tables first to get a clean schema.')
+def init_db_command(drop):
+    """Create tables and the default users"""
+    if drop:
+        with app.app_context():
+            try:
+                db.drop_all()
+                logger.info("Dropped all tables successfully")
+            except Exception as e:
+                logger.error(f"Error dropping tables: {e}")
     
-    # Now create tables and initial data
     create_initial_data()
+    click.echo("Database initialized")
 
 if __name__ == '__main__':
+    create_initial_data()
     app.run(host='0.0.0.0', port=5000, debug=False)
@@ -0,0 +1,235 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+
+def _add_query_indexes(connection):
+    # Duplicate (user_id, tool_id) rows would block the unique index. They are reported rather than
+    # deleted: lookups read the oldest row, so keeping any other could change a user's tool access
+    duplicates = connection.execute(text(
+        'SELECT user_id, tool_id, count(*) FROM permissions GROUP BY user_id, tool_id HAVING count(*) > 1'
+    )).all()
+    if duplicates:
+        examples = '; '.join(f'user {user_id}, tool {tool_id}: {count} rows' for user_id, tool_id, count in duplicates[:5])
+        raise RuntimeError(
+            f'{len(duplicates)} user and tool pairs have several permission rows ({examples}). '
+            'Keep the one that should apply, then run the migrations again.'
+        )
+
+    for statement in (
+        'CREATE INDEX IF NOT EXISTS ix_businesses_type_state ON businesses (type, state)',
+        'CREATE INDEX IF NOT EXISTS ix_businesses_state ON businesses (state)',
+        'CREATE INDEX IF NOT EXISTS ix_activity_logs_timestamp ON activity_logs (timestamp)',
+        'CREATE INDEX IF NOT EXISTS ix_activity_logs_user_id_timestamp ON activity_logs (user_id, timestamp)',
+        'CREATE INDEX IF NOT EXISTS ix_activity_logs_action_timestamp ON activity_logs (action, timestamp)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_permissions_user_id_tool_id ON permissions (user_id, tool_id)',
+    ):
+        connection.execute(text(statement))
+
+
+# Non-admin (user, tool) pairs without a permission row, which role defaults would now decide
+UNDECIDED_PERMISSIONS = (
+    'FROM users CROSS JOIN tools WHERE users.role != \'Admin\' AND NOT EXISTS '
+    '(SELECT 1 FROM permissions WHERE permissions.user_id = users.id AND permissions.tool_id = tools.id)'
+)
+
+
+def _add_tool_staff_default_access(connection):
+    # Older blueprint databases predate the column; the monolith schema always had it
+    columns = {column['name'] for column in inspect(connection).get_columns('tools')}
+    if 'staff_default_access' in columns:
+        return
+
+    connection.execute(text('ALTER TABLE tools ADD COLUMN staff_default_access BOOLEAN DEFAULT TRUE'))
+    connection.execute(text('UPDATE tools SET staff_default_access = TRUE'))
+
+    # The blueprint app denied any tool without a row (unticking a tool deleted it), while the
+    # resolver falls back to role defaults; explicit denials keep every existing user's access as it was
+    connection.execute(text(
+        f'INSERT INTO permissions (user_id, tool_id, can_access) SELECT users.id, tools.id, FALSE {UNDECIDED_PERMISSIONS}'
+    ))
+    undecided = connection.execute(text(f'SELECT count(*) {UNDECIDED_PERMISSIONS}')).scalar()
+    if undecided:
+        raise RuntimeError(f'{undecided} tool permissions would fall back to role defaults after migration')
+
+
+def _add_user_session_version(connection):
+    columns = {column['name'] for column in inspect(connection).get_columns('users')}
+    if 'session_version' not in columns:
+        connection.execute(text('ALTER TABLE users ADD COLUMN session_version INTEGER NOT NULL DEFAULT 0'))
+
+
+# The importer's natural key; chains have several locations in one city, so it includes the address
+BUSINESS_NATURAL_KEY = "name, state, city, coalesce(address, '')"
+
+
+def _add_business_natural_key(connection):
+    # Duplicates are reported rather than deleted: which row to keep is a decision for a person
+    duplicates = connection.execute(text(
+        f'SELECT name, state, city, address, count(*) FROM businesses '
+        f'GROUP BY {BUSINESS_NATURAL_KEY} HAVING count(*) > 1'
+    )).all()
+    if duplicates:
+        examples = '; '.join(f'{name}, {city}, {state}, {address or "(no address)"}: {count} rows'
+                             for name, state, city, address, count in duplicates[:5])
+        raise RuntimeError(
+            f'{len(duplicates)} businesses share a name, state, city and address ({examples}). '
+            'Merge or correct them, then run the migrations again.'
+        )
+    connection.execute(text(
+        f'CREATE UNIQUE INDEX IF NOT EXISTS uq_businesses_natural_key ON businesses ({BUSINESS_NATURAL_KEY})'
+    ))
+
+
+def _add_business_search(connection):
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        _add_sqlite_business_search(connection)
+    elif dialect == 'postgresql':
+        _add_postgres_business_search(connection)
+
+
+# Columns searched by search.BusinessSearch, in the order of its BM25_WEIGHTS
+BUSINESS_SEARCH_COLUMNS = ('name', 'city', 'description', 'website')
+
+
+def _add_sqlite_business_search(connection):
+    if not connection.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar():
+        logger.warning("SQLite was built without FTS5; business search will fall back to LIKE")
+        return
+
+    columns = ', '.join(BUSINESS_SEARCH_COLUMNS)
+    new_values = ', '.join(f'new.{name}' for name in BUSINESS_SEARCH_COLUMNS)
+    old_values = ', '.join(f'old.{name}' for name in BUSINESS_SEARCH_COLUMNS)
+
+    # External content table: the index holds only tokens and reads rows back from businesses
+    connection.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS businesses_fts USING fts5({columns}, "
+        f"content='businesses', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    ))
+    # Triggers rather than ORM events so the importer's bulk inserts are indexed too
+    for statement in (
+        f"CREATE TRIGGER IF NOT EXISTS businesses_fts_insert AFTER INSERT ON businesses BEGIN "
+        f"INSERT INTO businesses_fts (rowid, {columns}) VALUES (new.id, {new_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS businesses_fts_delete AFTER DELETE ON businesses BEGIN "
+        f"INSERT INTO businesses_fts (businesses_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS businesses_fts_update AFTER UPDATE OF {columns} ON businesses BEGIN "
+        f"INSERT INTO businesses_fts (businesses_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO businesses_fts (rowid, {columns}) VALUES (new.id, {new_values}); END",
+    ):
+        connection.execute(text(statement))
+    connection.execute(text("INSERT INTO businesses_fts (businesses_fts) VALUES ('rebuild')"))
+
+
+def _add_postgres_business_search(connection):
+    # Weighted A to D by importance; the column is generated so every write keeps it current
+    vector = ' || '.join(
+        f"setweight(to_tsvector('simple', coalesce({name}, '')), '{weight}')"
+        for name, weight in (('name', 'A'), ('city', 'B'), ('website', 'C'), ('description', 'D'))
+    )
+    connection.execute(text(
+        f"ALTER TABLE businesses ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        f"GENERATED ALWAYS AS ({vector}) STORED"
+    ))
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_businesses_search_vector ON businesses USING gin (search_vector)'
+    ))
+
+
+def _add_business_facet_counts(connection):
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_businesses_city ON businesses (city)'))
+
+    # db.create_all() made the table; fill it for businesses written before it existed
+    if inspect(connection).has_table('business_facet_counts'):
+        connection.execute(text('DELETE FROM business_facet_counts'))
+        connection.execute(text(
+            'INSERT INTO business_facet_counts (type, state, city, business_count) '
+            'SELECT type, state, city, count(*) FROM businesses GROUP BY type, state, city'
+        ))
+
+
+def _add_business_locations(connection):
+    columns = {column['name'] for column in inspect(connection).get_columns('businesses')}
+    for name, column_type in (
+        ('latitude', 'FLOAT'),
+        ('longitude', 'FLOAT'),
+        ('geohash', 'VARCHAR(12)'),
+        ('county', 'VARCHAR(100)'),
+        ('metro', 'VARCHAR(100)'),
+    ):
+        if name not in columns:
+            connection.execute(text(f'ALTER TABLE businesses ADD COLUMN {name} {column_type}'))
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_businesses_geohash ON businesses (geohash)'))
+    # Existing rows get their locations from 'flask geocode-businesses'
+
+
+def _add_activity_log_event_count(connection):
+    # Coalesced and sampled entries stand for event_count events; every older row is one
+    inspector = inspect(connection)
+    tables = ['activity_logs']
+    if connection.dialect.name == 'postgresql':
+        # Monthly partitions take their columns from the archive parent
+        if inspector.has_table('activity_logs_archive'):
+            tables.append('activity_logs_archive')
+    elif inspector.has_table('activity_log_partitions'):
+        tables += [row[0] for row in connection.execute(text('SELECT name FROM activity_log_partitions'))]
+
+    for table in tables:
+        columns = {column['name'] for column in inspector.get_columns(table)}
+        if 'event_count' not in columns:
+            connection.execute(text(f'ALTER TABLE {table} ADD COLUMN event_count INTEGER NOT NULL DEFAULT 1'))
+
+
+
+def _add_business_region_indexes(connection):
+    # Region counts group every geocoded business; these let them read an index instead of the table
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_businesses_metro_type ON businesses (metro, type)'))
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_businesses_county_state_type ON businesses (county, state, type)'
+    ))
+
+# Ordered list of (version, function); append new migrations, never reorder or rename
+MIGRATIONS = [
+    ('0001_query_indexes', _add_query_indexes),
+    ('0002_tool_staff_default_access', _add_tool_staff_default_access),
+    ('0003_user_session_version', _add_user_session_version),
+    ('0004_business_natural_key', _add_business_natural_key),
+    ('0005_business_search', _add_business_search),
+    ('0006_business_facet_counts', _add_business_facet_counts),
+    ('0007_business_locations', _add_business_locations),
+    ('0008_activity_log_event_count', _add_activity_log_event_count),
+    ('0009_business_region_indexes', _add_business_region_indexes),
+]
+
+
+def run_migrations(engine):
+    """Apply every migration not yet recorded in schema_migrations
+
+    Run after db.create_all(): fresh databases already have the current schema,
+    so migrations must be idempotent (IF NOT EXISTS and friends).
+    """
+    with engine.begin() as connection:
+        connection.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migrations '
+            '(version VARCHAR(100) PRIMARY KEY, applied_at TIMESTAMP NOT NULL)'
+        ))
+        applied = {row[0] for row in connection.execute(text('SELECT version FROM schema_migrations'))}
+
+    newly_applied = []
+    for version, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+
+        with engine.begin() as connection:
+            migrate(connection)
+            connection.execute(
+                text('INSERT INTO schema_migrations (version, applied_at) VALUES (:version, :applied_at)'),
+                {'version': version, 'applied_at': datetime.utcnow()}
+            )
+        logger.info(f"Applied migration {version}")
+        newly_applied.append(version)
+
+    return newly_applied
@@ -0,0 +1,161 @@
+import base64
+import json
+from datetime import datetime
+
+from flask import abort, current_app, request, url_for
+from sqlalchemy import DateTime, and_, func, or_, select
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+class KeysetPage:
+    """One page of keyset-paginated results
+
+    Iterating the page yields its items, so templates written for a plain list
+    keep working. total is only set when a count was requested and is capped
+    at the count limit, in which case total_is_estimate is True.
+    """
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None,
+                 total_is_estimate=False, params=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+        self.total_is_estimate = total_is_estimate
+        self.params = params if params is not None else {}
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def next_url(self):
+        return self._url(after=self.next_cursor) if self.has_next else None
+
+    def prev_url(self):
+        return self._url(before=self.prev_cursor) if self.has_prev else None
+
+    def _url(self, **cursor):
+        args = {key: value for key, value in self.params.items() if key not in ('after', 'before')}
+        args.update(cursor)
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values):
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(payload, list) or len(payload) != len(columns):
+            raise ValueError('wrong number of values')
+        return [
+            datetime.fromisoformat(value) if isinstance(column.type, DateTime) and value is not None else value
+            for column, value in zip(columns, payload)
+        ]
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f'Invalid pagination cursor: {e}')
+
+
+def keyset_paginate(query, columns, after=None, before=None, per_page=20, descending=True,
+                    count_limit=None, params=None):
+    """Return a KeysetPage of query ordered by columns
+
+    columns must end in a unique column (usually the primary key) so the
+    ordering is total; each page then costs one index range scan no matter how
+    deep it is. after/before are cursors taken from a previous page. Pass
+    count_limit to also count matching rows, stopping at count_limit.
+    """
+    columns = list(columns)
+    # An empty ?before= or ?after= is the same as leaving it out
+    after = after or None
+    before = before or None
+    cursor = before or after
+    backwards = before is not None
+
+    # Walking backwards reads the index in the opposite direction and flips the page afterwards
+    reverse = descending != backwards
+    ordered = query.order_by(*[column.desc() if reverse else column.asc() for column in columns])
+
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        ordered = ordered.filter(_seek_condition(columns, values, reverse))
+
+    rows = ordered.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def cursor_for(item):
+        return encode_cursor([getattr(item, column.key) for column in columns])
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = cursor_for(rows[-1])
+        if (has_more and backwards) or (after is not None):
+            prev_cursor = cursor_for(rows[0])
+
+    total = None
+    total_is_estimate = False
+    if count_limit is not None:
+        limited = query.order_by(None).with_entities(columns[-1]).limit(count_limit + 1).subquery()
+        total = query.session.execute(select(func.count()).select_from(limited)).scalar()
+        if total > count_limit:
+            total = count_limit
+            total_is_estimate = True
+
+    return KeysetPage(rows, per_page, next_cursor, prev_cursor, total, total_is_estimate, params)
+
+
+def paginate_request(query, columns, descending=True, per_page=20, params=None):
+    """Keyset-paginate query using the after, before and count request arguments
+
+    A count is only run when the request asks for one with count=1, capped at
+    PAGINATION_COUNT_LIMIT. Malformed cursors abort with 400.
+    """
+    params = request.args if params is None else params
+    count_limit = current_app.config.get('PAGINATION_COUNT_LIMIT', 10000) if request.args.get('count') else None
+    try:
+        return keyset_paginate(
+            query, columns,
+            after=request.args.get('after'),
+            before=request.args.get('before'),
+            per_page=per_page,
+            descending=descending,
+            count_limit=count_limit,
+            params=params
+        )
+    except InvalidCursor:
+        abort(400)
+
+
+def _seek_condition(columns, values, descending):
+    # (a, b) < (x, y) expanded as a <= x AND (a < x OR (a = x AND b < y)) so the leading column bounds an index range
+    def beyond(column, value):
+        return column < value if descending else column > value
+
+    alternatives = []
+    for i, (column, value) in enumerate(zip(columns, values)):
+        equal_prefix = [columns[j] == values[j] for j in range(i)]
+        alternatives.append(and_(*equal_prefix, beyond(column, value)))
+
+    leading = columns[0] <= values[0] if descending else columns[0] >= values[0]
+    return and_(leading, or_(*alternatives))
@@ -0,0 +1,110 @@
+from sqlalchemy import and_, event, select
+from sqlalchemy.orm import Session
+
+
+class PermissionResolver:
+    """Effective tool permissions per user, resolved in one query and cached
+
+    A user's access to a tool is, in order: everything for admins, an explicit
+    Permission row if there is one, and otherwise the role default (managers
+    get every tool, staff get tools with staff_default_access). Resolved sets
+    are kept in cache (a cache.Cache) per user and role for
+    PERMISSION_CACHE_TTL seconds and dropped whenever a transaction that wrote
+    a tool or permission commits.
+    """
+
+    def __init__(self, db, tool_model, permission_model, cache, access_attribute='can_access'):
+        self.db = db
+        self.tool_model = tool_model
+        self.permission_model = permission_model
+        self.cache = cache
+        self.access_attribute = access_attribute
+
+        event.listen(Session, 'after_flush', self._after_flush)
+        event.listen(Session, 'after_commit', self._after_commit)
+
+    def init_app(self, app):
+        app.config.setdefault('PERMISSION_CACHE_TTL', 60)
+        self.cache.init_app(app)
+        self.cache.ttl = app.config['PERMISSION_CACHE_TTL']
+        app.extensions['permission_resolver'] = self
+
+    def effective_permissions(self, user):
+        """Return {tool_id: bool} for every tool"""
+        if user.role == 'Admin':
+            return {tool_id: True for tool_id in self._tool_ids()}
+
+        cached = self.cache.get_or_set(f'{user.id}:{user.role}', lambda: self._resolve(user))
+        return {int(tool_id): allowed for tool_id, allowed in cached.items()}
+
+    def has_permission(self, user, tool_id):
+        if user.role == 'Admin':
+            return True
+        return self.effective_permissions(user).get(tool_id, False)
+
+    def permissions_matrix(self, users, tools):
+        """Return {user_id: {tool_id: bool}} for users and tools using a single query"""
+        users = list(users)
+        tools = list(tools)
+        access = getattr(self.permission_model, self.access_attribute)
+
+        overrides = {}
+        user_ids = [user.id for user in users if user.role != 'Admin']
+        if user_ids and tools:
+            rows = self.db.session.execute(
+                select(self.permission_model.user_id, self.permission_model.tool_id, access).where(
+                    self.permission_model.user_id.in_(user_ids),
+                    self.permission_model.tool_id.in_([tool.id for tool in tools])
+                )
+            )
+            overrides = {(user_id, tool_id): bool(allowed) for user_id, tool_id, allowed in rows}
+
+        matrix = {}
+        for user in users:
+            matrix[user.id] = {
+                tool.id: True if user.role == 'Admin' else overrides.get(
+                    (user.id, tool.id), _role_default(user.role, tool.staff_default_access)
+                )
+                for tool in tools
+            }
+        return matrix
+
+    def invalidate(self):
+        """Drop every cached permission set"""
+        self.cache.invalidate()
+
+    def _resolve(self, user):
+        tool = self.tool_model
+        permission = self.permission_model
+        rows = self.db.session.execute(
+            select(tool.id, tool.staff_default_access, getattr(permission, self.access_attribute)).outerjoin(
+                permission, and_(permission.tool_id == tool.id, permission.user_id == user.id)
+            )
+        )
+        # Keys are strings so the set survives a JSON round trip through a Redis backend
+        return {
+            str(tool_id): bool(allowed) if allowed is not None else _role_default(user.role, staff_default)
+            for tool_id, staff_default, allowed in rows
+        }
+
+    def _tool_ids(self):
+        return self.db.session.execute(select(self.tool_model.id)).scalars().all()
+
+    def _after_flush(self, session, flush_context):
+        if any(
+            isinstance(instance, (self.tool_model, self.permission_model))
+            for instance in (*session.new, *session.dirty, *session.deleted)
+        ):
+            session.info['permissions_stale'] = True
+
+    def _after_commit(self, session):
+        if session.info.pop('permissions_stale', False):
+            self.invalidate()
+
+
+def _role_default(role, staff_default_access):
+    if role == 'Manager':
+        return True
+    if role == 'Staff':
+        return bool(staff_default_access)
+    return False
@@ -0,0 +1,320 @@
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from flask import Blueprint, Response, abort, current_app, g, jsonify, request
+from flask_login import current_user, login_required
+
+logger = logging.getLogger(__name__)
+
+profiling_bp = Blueprint('profiling', __name__, url_prefix='/admin/profiling')
+
+CONTROL_FILE = 'capture.json'
+CAPTURE_ID = re.compile(r'^[\w-]+$')
+
+
+def frame_stack(frame):
+    """Collapse frame and its callers into 'outermost;...;innermost' as flamegraph tools expect"""
+    names = []
+    while frame is not None:
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def read_folded(path):
+    stacks = Counter()
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack and count.isdigit():
+                stacks[stack] += int(count)
+    return stacks
+
+
+class SamplingProfiler:
+    """Statistical profiler for a share of requests, switched on from the admin pages
+
+    A capture covers one endpoint or all of them for a number of seconds,
+    profiling each matching request with probability rate. While a profiled
+    request runs, a sampler thread records its stack every
+    PROFILE_INTERVAL_MS, so the cost is per sample rather than per call and
+    the stacks are wall-clock: time waiting on the database shows up too.
+
+    Captures are coordinated through PROFILE_DIR, which every worker on the
+    host must share: start() writes a control file that each process re-reads
+    at most once per PROFILE_CHECK_INTERVAL, and each process writes its
+    stacks to '<capture>.<pid>.folded' there. Downloads merge all of them.
+    With no capture running a request costs one clock comparison.
+    """
+
+    def __init__(self, app=None):
+        self.directory = os.path.join(tempfile.gettempdir(), 'directory_hub_profiles')
+        self.interval = 0.005
+        self.check_interval = 1.0
+        self.flush_interval = 2.0
+        self._capture = None
+        self._checked = None
+        self._control_mtime = None
+        self._threads = {}
+        self._stacks = {}
+        self._sampler = None
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILE_DIR', self.directory)
+        app.config.setdefault('PROFILE_INTERVAL_MS', 5)
+        app.config.setdefault('PROFILE_CHECK_INTERVAL', 1.0)
+        app.config.setdefault('PROFILE_MAX_SECONDS', 300)
+        # Capture files older than this are removed when the next capture starts
+        app.config.setdefault('PROFILE_KEEP_SECONDS', 7 * 24 * 3600)
+
+        self.directory = app.config['PROFILE_DIR']
+        self.interval = app.config['PROFILE_INTERVAL_MS'] / 1000
+        self.check_interval = app.config['PROFILE_CHECK_INTERVAL']
+
+        app.before_request(self.start_request)
+        app.teardown_request(self.finish_request)
+        app.extensions['profiler'] = self
+
+    def capture(self):
+        """The running capture, or None"""
+        now = time.monotonic()
+        if self._checked is None or now - self._checked >= self.check_interval:
+            self._checked = now
+            self._capture = self._read_control()
+        capture = self._capture
+        if capture is None or capture['until'] <= time.time():
+            return None
+        return capture
+
+    def _read_control(self):
+        path = os.path.join(self.directory, CONTROL_FILE)
+        try:
+            mtime = os.stat(path).st_mtime
+            if mtime == self._control_mtime:
+                return self._capture
+            with open(path) as f:
+                capture = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._control_mtime = mtime
+        return capture
+
+    def _write_control(self, capture):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, CONTROL_FILE)
+        # Written whole and renamed into place so workers never read half a file
+        with open(f'{path}.{os.getpid()}', 'w') as f:
+            json.dump(capture, f)
+        os.replace(f'{path}.{os.getpid()}', path)
+        self._checked = None
+
+    def start(self, endpoint=None, rate=1.0, seconds=30, started_by=None, keep_seconds=None):
+        """Start a capture on every worker sharing PROFILE_DIR, replacing any running one"""
+        if keep_seconds is not None:
+            self._prune(keep_seconds)
+        capture = {
+            'id': f"{time.strftime('%Y%m%d-%H%M%S')}-{os.urandom(3).hex()}",
+            'endpoint': endpoint,
+            'rate': rate,
+            'started': time.time(),
+            'until': time.time() + seconds,
+            'started_by': started_by,
+        }
+        self._write_control(capture)
+        return capture
+
+    def stop(self):
+        """End the running capture early; returns it, or None"""
+        capture = self.capture()
+        if capture is not None:
+            self._write_control(dict(capture, until=time.time()))
+        return capture
+
+    def start_request(self):
+        capture = self.capture()
+        if capture is None:
+            return
+        if capture['endpoint'] and request.endpoint != capture['endpoint']:
+            return
+        if random.random() >= capture['rate']:
+            return
+
+        g.profiled = True
+        with self._lock:
+            self._threads[threading.get_ident()] = (capture['id'], request.endpoint or 'unmatched')
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._sampler.start()
+
+    def finish_request(self, exception=None):
+        if g.pop('profiled', False):
+            with self._lock:
+                self._threads.pop(threading.get_ident(), None)
+
+    def _run(self):
+        flushed = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, (capture_id, endpoint) in self._threads.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks = self._stacks.setdefault(capture_id, Counter())
+                        stacks[f'{endpoint};{frame_stack(frame)}'] += 1
+                # Keep sampling until the capture is over and its last requests have finished
+                done = not self._threads and self.capture() is None
+                if done:
+                    self._sampler = None
+            del frames
+
+            if done or time.monotonic() - flushed >= self.flush_interval:
+                self.flush()
+                flushed = time.monotonic()
+            if done:
+                return
+
+    def flush(self):
+        """Write this process's stacks for each capture to PROFILE_DIR"""
+        with self._lock:
+            captures = {capture_id: Counter(stacks) for capture_id, stacks in self._stacks.items()}
+            running = self.capture()
+            sampling = {capture_id for capture_id, _ in self._threads.values()}
+            # Stacks of a capture are dropped after their last write: once it has ended and none of its requests still run
+            for capture_id in list(self._stacks):
+                if capture_id not in sampling and (running is None or capture_id != running['id']):
+                    del self._stacks[capture_id]
+
+        for capture_id, stacks in captures.items():
+            path = os.path.join(self.directory, f'{capture_id}.{os.getpid()}.folded')
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(f'{path}.tmp', 'w') as f:
+                    for stack, count in stacks.most_common():
+                        f.write(f'{stack} {count}\n')
+                os.replace(f'{path}.tmp', path)
+            except OSError as e:
+                logger.error(f"Error writing profile {path}: {e}")
+
+    def captures(self):
+        """Summaries of the captures with stacks in PROFILE_DIR, newest first"""
+        summaries = {}
+        for capture_id, path in self._files():
+            summary = summaries.setdefault(capture_id, {'id': capture_id, 'workers': 0, 'samples': 0})
+            summary['workers'] += 1
+            summary['samples'] += sum(read_folded(path).values())
+        return sorted(summaries.values(), key=lambda summary: summary['id'], reverse=True)
+
+    def collapsed(self, capture_id):
+        """Merged 'stack count' lines for a capture across all workers, or None when it has no stacks"""
+        stacks = Counter()
+        found = False
+        for file_capture_id, path in self._files():
+            if file_capture_id == capture_id:
+                stacks.update(read_folded(path))
+                found = True
+        if not found:
+            return None
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+    def _files(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        files = []
+        for name in names:
+            if not name.endswith('.folded'):
+                continue
+            capture_id = name.split('.', 1)[0]
+            files.append((capture_id, os.path.join(self.directory, name)))
+        return files
+
+    def _prune(self, keep_seconds):
+        cutoff = time.time() - keep_seconds
+        for _, path in self._files():
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+sampling_profiler = SamplingProfiler()
+
+
+def _require_admin():
+    if current_user.role != 'Admin':
+        abort(403)
+
+
+@profiling_bp.route('')
+@login_required
+def status():
+    """The running capture and the captures available for download"""
+    _require_admin()
+    profiler = current_app.extensions['profiler']
+    return jsonify({'capture': profiler.capture(), 'captures': profiler.captures()})
+
+
+@profiling_bp.route('/start', methods=['POST'])
+@login_required
+def start():
+    """Profile requests to endpoint (all endpoints when omitted) with probability rate for seconds"""
+    _require_admin()
+    profiler = current_app.extensions['profiler']
+    endpoint = request.values.get('endpoint') or None
+    max_seconds = current_app.config['PROFILE_MAX_SECONDS']
+
+    try:
+        rate = float(request.values.get('rate', 1.0))
+        seconds = int(request.values.get('seconds', 30))
+    except ValueError:
+        return jsonify({'error': 'rate and seconds must be numbers'}), 400
+    if not 0 < rate <= 1:
+        return jsonify({'error': 'rate must be above 0 and at most 1'}), 400
+    if not 0 < seconds <= max_seconds:
+        return jsonify({'error': f'seconds must be between 1 and {max_seconds}'}), 400
+    if endpoint is not None and endpoint not in current_app.view_functions:
+        return jsonify({'error': f'Unknown endpoint {endpoint}'}), 400
+
+    capture = profiler.start(
+        endpoint, rate, seconds, started_by=current_user.username,
+        keep_seconds=current_app.config['PROFILE_KEEP_SECONDS']
+    )
+    return jsonify({'capture': capture}), 201
+
+
+@profiling_bp.route('/stop', methods=['POST'])
+@login_required
+def stop():
+    """End the running capture"""
+    _require_admin()
+    return jsonify({'capture': current_app.extensions['profiler'].stop()})
+
+
+@profiling_bp.route('/<capture_id>.folded')
+@login_required
+def download(capture_id):
+    """Collapsed stacks for a capture, merged across workers, for flamegraph.pl or speedscope"""
+    _require_admin()
+    if not CAPTURE_ID.match(capture_id):
+        abort(404)
+    collapsed = current_app.extensions['profiler'].collapsed(capture_id)
+    if collapsed is None:
+        abort(404)
+    response = Response(collapsed, mimetype='text/plain')
+    response.headers['Content-Disposition'] = f'attachment; filename=profile-{capture_id}.folded'
+    return response
@@ -0,0 +1,156 @@
+import re
+from contextlib import contextmanager
+
+import click
+from sqlalchemy import event, inspect
+
+SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?$')
+POSTGRES_SCAN = re.compile(r'Seq Scan on (\w+)')
+TABLE_ALIAS = re.compile(r'\b(\w+) AS (\w+)\b')
+ORDER_BY_LIMIT = re.compile(r'ORDER BY (?:(\w+)\.)?(\w+)(?: ASC| DESC)?\s+LIMIT\b', re.IGNORECASE)
+
+EXPLAIN_DIALECTS = ('sqlite', 'postgresql')
+
+
+@contextmanager
+def capture_selects(engine):
+    """Collect (statement, parameters) for every SELECT run on engine inside the block"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def explain(connection, statement, parameters):
+    """Return the query plan for a captured statement as a list of lines, or None on other dialects"""
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+        return [row[-1] for row in rows]
+    if dialect == 'postgresql':
+        rows = connection.exec_driver_sql(f'EXPLAIN {statement}', parameters).fetchall()
+        return [row[0] for row in rows]
+    return None
+
+
+def full_scans(dialect, statement, plan, primary_keys=None):
+    """Return the names of tables the plan reads without using an index
+
+    A scan in primary key order under a LIMIT stops after LIMIT rows, so it
+    is not reported for tables whose primary key columns primary_keys gives.
+    """
+    aliases = {alias: table for table, alias in TABLE_ALIAS.findall(statement)}
+    tables = set()
+
+    for line in plan:
+        if dialect == 'sqlite':
+            match = SQLITE_SCAN.match(line.strip())
+            if match:
+                tables.add(match.group(1))
+        else:
+            tables.update(POSTGRES_SCAN.findall(line))
+
+    tables = {aliases.get(table, table) for table in tables}
+    ordered = ORDER_BY_LIMIT.search(statement)
+    # SQLite sorts into a temporary b-tree when the scan is not already in ORDER BY order
+    if ordered and primary_keys and not any('TEMP B-TREE' in line for line in plan):
+        qualifier, column = ordered.groups()
+        table = aliases.get(qualifier, qualifier) if qualifier else (next(iter(tables)) if len(tables) == 1 else None)
+        if column in primary_keys.get(table, ()):
+            tables.discard(table)
+    return tables
+
+
+def audit_requests(client, engine, paths, max_rows=1000):
+    """Request each path and report full scans on tables above max_rows
+
+    Returns a list of findings, one per (path, statement, table), each a dict
+    with the path, table, row count, statement and plan. A path that fails or
+    answers other than 2xx is a finding too, with its error instead: its
+    queries were not all run, so it cannot pass. Raises ValueError on
+    dialects without EXPLAIN support.
+    """
+    findings = []
+    row_counts = {}
+    primary_keys = {}
+
+    if engine.dialect.name not in EXPLAIN_DIALECTS:
+        raise ValueError(f'Query plan audit is not supported on {engine.dialect.name}')
+
+    for path in paths:
+        with capture_selects(engine) as statements:
+            try:
+                status = client.get(path).status_code
+                error = None if 200 <= status < 300 else f'HTTP {status}'
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+        if error is not None:
+            findings.append({'path': path, 'error': error})
+
+        with engine.connect() as connection:
+            known_tables = set(inspect(connection).get_table_names())
+
+            for table in known_tables - set(primary_keys):
+                primary_keys[table] = set(inspect(connection).get_pk_constraint(table)['constrained_columns'])
+
+            for statement, parameters in statements:
+                plan = explain(connection, statement, parameters)
+                for table in full_scans(connection.dialect.name, statement, plan, primary_keys):
+                    if table not in known_tables:
+                        continue
+                    if table not in row_counts:
+                        row_counts[table] = connection.exec_driver_sql(f'SELECT count(*) FROM {table}').scalar()
+                    if row_counts[table] > max_rows:
+                        findings.append({
+                            'path': path,
+                            'table': table,
+                            'rows': row_counts[table],
+                            'statement': statement,
+                            'plan': plan
+                        })
+
+    return findings
+
+
+def register_audit_command(app, db, paths, audit_user):
+    """Add a 'flask audit-queries' command that audits paths logged in as audit_user()"""
+    app.config.setdefault('QUERY_AUDIT_MAX_ROWS', 1000)
+
+    @app.cli.command('audit-queries')
+    @click.option('--max-rows', type=int, default=None, help='Only fail on full scans of tables larger than this.')
+    def audit_queries(max_rows):
+        """EXPLAIN every query the routes issue and fail on full table scans"""
+        if max_rows is None:
+            max_rows = app.config['QUERY_AUDIT_MAX_ROWS']
+        if db.engine.dialect.name not in EXPLAIN_DIALECTS:
+            raise click.ClickException(f'Query plan audit is not supported on {db.engine.dialect.name}; nothing checked')
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = audit_user().get_id()
+            session['_fresh'] = True
+
+        findings = audit_requests(client, db.engine, paths, max_rows=max_rows)
+
+        for finding in findings:
+            if 'error' in finding:
+                click.echo(f"{finding['path']}: {finding['error']}; its queries were not all audited")
+                continue
+            click.echo(f"{finding['path']}: full scan of {finding['table']} ({finding['rows']} rows)")
+            click.echo(f"    {finding['statement']}")
+            for line in finding['plan']:
+                click.echo(f"    | {line}")
+
+        failed = sum('error' in finding for finding in findings)
+        if failed:
+            raise click.ClickException(f'{failed} route(s) failed and {len(findings) - failed} full table scan(s) above {max_rows} rows')
+        if findings:
+            raise click.ClickException(f'{len(findings)} full table scan(s) above {max_rows} rows')
+        click.echo(f'No full table scans above {max_rows} rows in {len(paths)} routes')
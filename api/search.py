@@ -0,0 +1,195 @@
+import re
+from collections import Counter, namedtuple
+
+from sqlalchemy import and_, column, func, inspect, literal_column, or_, select, table as table_clause
+
+# Columns covered by the search index of migration 0005
+SEARCH_COLUMNS = ('name', 'city', 'description', 'website')
+
+# FTS5 bm25() weight per column of SEARCH_COLUMNS, in the same order; PostgreSQL weights them A to D
+BM25_WEIGHTS = (10.0, 5.0, 1.0, 1.0)
+
+# Score for a term matching the start of the name, a word in the name, a word in the city, or only elsewhere
+NAME_START_SCORE = 12
+NAME_SCORE = 10
+CITY_SCORE = 5
+OTHER_SCORE = 1
+
+# FTS5's unicode61 tokenizer splits on anything that is not a letter or digit
+_TERM = re.compile(r'[^\W_]+')
+
+MAX_TERMS = 8
+
+# Shortest term matched as a prefix, the smallest prefix length migration 0005 indexes
+MIN_PREFIX = 2
+
+# FROM and WHERE clauses that apply a search to the businesses table, and its full-text relevance ordering
+_Match = namedtuple('_Match', 'from_ where order_by')
+
+_fts = table_clause('businesses_fts', column('rowid'))
+
+
+def search_terms(query):
+    """Split a user query into lower-cased search terms, dropping FTS syntax and punctuation"""
+    return _TERM.findall((query or '').lower())[:MAX_TERMS]
+
+
+def _prefixed(terms):
+    # Only the last term is still being typed; whole-word matches for the rest are far cheaper
+    # than prefix scans, and single letters are too broad to expand
+    for position, term in enumerate(terms, 1):
+        yield term, position == len(terms) and len(term) >= MIN_PREFIX
+
+
+def score(terms, name, city):
+    """Rank a matching business by where the terms occur, weighting name over city over the rest"""
+    # Leading spaces turn "starts a word" into a substring test; cheap enough to run on every candidate
+    name = ' ' + (name or '').lower()
+    city = ' ' + (city or '').lower()
+    total = 0
+    for term in terms:
+        word = ' ' + term
+        if name.startswith(word):
+            total += NAME_START_SCORE
+        elif word in name:
+            total += NAME_SCORE
+        elif word in city:
+            total += CITY_SCORE
+        else:
+            total += OTHER_SCORE
+    return total
+
+
+class BusinessSearch:
+    """Ranked prefix search over businesses with type and state facets
+
+    Uses the SQLite FTS5 index or the PostgreSQL search_vector column created
+    by migration 0005, and falls back to LIKE when neither exists. All terms
+    must match; the last one matches as a prefix, so results follow typing.
+    Facet counts ignore the filter on their own dimension, so picking a type
+    still shows the counts for the other types.
+
+    Each search reads the SEARCH_MAX_CANDIDATES most relevant matches by
+    full-text rank (weighted bm25 on FTS5, ts_rank on PostgreSQL, id order
+    for LIKE) in one query and computes facets and ranking from them, so
+    broad queries stay cheap on large directories and the best matches are
+    always among the candidates; past that, totals and facets are lower
+    bounds and total_is_estimate says so. Candidates are then re-ranked by
+    where the terms occur.
+    """
+
+    def __init__(self, db, business_model, app=None):
+        self.db = db
+        self.model = business_model
+        self.max_candidates = 1000
+        self._backend = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SEARCH_MAX_CANDIDATES', 1000)
+        self.max_candidates = app.config['SEARCH_MAX_CANDIDATES']
+        app.extensions['business_search'] = self
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = self._detect_backend()
+        return self._backend
+
+    def search(self, query, business_type=None, state=None, limit=20, offset=0):
+        """Return results, total, total_is_estimate, facets and backend for query with optional filters"""
+        terms = search_terms(query)
+        found = {
+            'results': [], 'total': 0, 'total_is_estimate': False,
+            'facets': {'type': {}, 'state': {}}, 'backend': self.backend
+        }
+        if not terms:
+            return found
+
+        # Whole words first: a common word fills the candidates without the cost of expanding
+        # it as a prefix, which only runs while there is room for more matches
+        match = self._match(terms, prefix=False)
+        candidates = self._candidates(match)
+        if len(candidates) < self.max_candidates and any(prefix for _, prefix in _prefixed(terms)):
+            match = self._match(terms)
+            candidates = self._candidates(match)
+        capped = len(candidates) >= self.max_candidates
+
+        type_counts = Counter(row.type for row in candidates if not state or row.state == state)
+        state_counts = Counter(row.state for row in candidates if not business_type or row.type == business_type)
+        found['facets'] = {'type': dict(type_counts.most_common()), 'state': dict(state_counts.most_common())}
+        found['total'] = type_counts[business_type] if business_type else sum(type_counts.values())
+        found['total_is_estimate'] = capped
+
+        matching = [
+            row for row in candidates
+            if (not business_type or row.type == business_type) and (not state or row.state == state)
+        ]
+        if capped and (business_type or state) and len(matching) < offset + limit:
+            # The unfiltered sample holds too few of the filtered matches for this page; fetch them directly
+            conditions = [self._filter('type', business_type)] if business_type else []
+            conditions += [self._filter('state', state)] if state else []
+            matching = self._candidates(match, conditions)
+
+        ranked = sorted(matching, key=lambda row: (-score(terms, row.name, row.city), len(row.name), row.id))
+        ids = [row.id for row in ranked[offset:offset + limit]]
+
+        if ids:
+            rows = {row.id: row for row in self.model.query.filter(self.model.id.in_(ids)).all()}
+            found['results'] = [rows[id_] for id_ in ids if id_ in rows]
+        return found
+
+    def _candidates(self, match, conditions=()):
+        table = self.model.__table__
+        return self.db.session.execute(
+            select(table.c.id, table.c.type, table.c.state, table.c.name, table.c.city)
+            .select_from(match.from_).where(match.where, *conditions)
+            .order_by(*match.order_by, table.c.id)
+            .limit(self.max_candidates)
+        ).all()
+
+    def _filter(self, dimension, value):
+        if self.backend == 'fts5':
+            # Unary + stops SQLite from driving the join off ix_businesses_type_state and
+            # re-running MATCH for every row of the type; the full-text index must go first
+            return literal_column(f'+businesses.{dimension}') == value
+        return self.model.__table__.c[dimension] == value
+
+    def _match(self, terms, prefix=True):
+        table = self.model.__table__
+        backend = self.backend
+        terms = [(term, prefix and expand) for term, expand in _prefixed(terms)]
+
+        if backend == 'fts5':
+            fts_query = ' '.join(f'"{term}"*' if expand else f'"{term}"' for term, expand in terms)
+            # bm25() is lower for better matches
+            return _Match(
+                table.join(_fts, _fts.c.rowid == table.c.id),
+                literal_column('businesses_fts').op('MATCH')(fts_query),
+                [func.bm25(literal_column('businesses_fts'), *BM25_WEIGHTS)]
+            )
+
+        if backend == 'tsvector':
+            ts_query = func.to_tsquery('simple', ' & '.join(f'{term}:*' if expand else term for term, expand in terms))
+            vector = literal_column('businesses.search_vector')
+            return _Match(table, vector.op('@@')(ts_query), [func.ts_rank(vector, ts_query).desc()])
+
+        searched = [table.c[name] for name in SEARCH_COLUMNS]
+        where = and_(*[
+            or_(*[func.lower(searched_column).like(f'%{term}%') for searched_column in searched])
+            for term, _ in terms
+        ])
+        return _Match(table, where, [])
+
+    def _detect_backend(self):
+        engine = self.db.engine
+        inspector = inspect(engine)
+        if engine.dialect.name == 'sqlite' and inspector.has_table('businesses_fts'):
+            return 'fts5'
+        if engine.dialect.name == 'postgresql' and 'search_vector' in {
+            info['name'] for info in inspector.get_columns('businesses')
+        }:
+            return 'tsvector'
+        return 'like'
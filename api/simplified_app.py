@@ -1,19 +1,57 @@
-from flask import Flask, render_template, redirect, url_for, request, flash, session
+from flask import Flask, render_template, redirect, url_for, request, flash, session, make_response
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import or_, select
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 import os
 from datetime import datetime, timedelta
 import json
 
+from activity_archive import SECURITY_ACTIONS, ActivityArchive, register_compact_command
+from activity_policy import COALESCE, DROP, activity_policy
+from activity_writer import activity_writer
+from business_stats import facet_counts, track_business_counts, rebuild_business_counts, summarize_business_counts
+from conditional import DataVersions
+from pagination import paginate_request
+from cache import Cache
+from permissions import PermissionResolver
+from identity import IdentityCache, restore_row, snapshot_row, split_user_id
+from hashing import HasherBusy, password_hasher
+from throttle import login_throttle
+from database import configure_engine, is_serverless, pool_status
+from importer import import_businesses, register_import_command
+from search import BusinessSearch
+from geo import BusinessLocator, gazetteer, geocode_businesses, region_counts, register_geocode_command, track_locations
+from migrations import run_migrations
+from query_audit import register_audit_command
+from assets import static_assets
+from compression import compression
+from instrumentation import instrumentation
+from stream import activity_broker, stream_bp
+from profiling import profiling_bp, sampling_profiler
+
 # Initialize Flask app
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-key-for-testing')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///directory_hub.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Most values listed per facet; cities run into the thousands
+app.config['FACET_LIMIT'] = 50
+app.config['PAGINATION_COUNT_LIMIT'] = 10000
+
+# Password hashing runs in a process pool so login bursts cannot starve page views, and failed logins are throttled
+password_hasher.init_app(app, serverless=is_serverless())
+login_throttle.init_app(app, serverless=is_serverless())
+
+# Built static assets are served precompressed; larger dynamic responses are compressed on the fly
+static_assets.init_app(app)
+compression.init_app(app)
 
 # Initialize extensions
+configure_engine(app)
 db = SQLAlchemy(app)
+# Per-request SQL and latency: Server-Timing headers, request log lines and /metrics
+instrumentation.init_app(app, pool_status)
+data_versions = DataVersions(db)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
@@ -33,13 +71,19 @@ class User(UserMixin, db.Model):
     password_changed_at = db.Column(db.DateTime, default=datetime.utcnow)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_login = db.Column(db.DateTime)
+    # Part of the login session id; bumping it signs the user out everywhere
+    session_version = db.Column(db.Integer, nullable=False, default=0)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
         self.password_changed_at = datetime.utcnow()
+        self.session_version = (self.session_version or 0) + 1
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+    
+    def get_id(self):
+        return f'{self.id}:{self.session_version or 0}'
     
     def is_password_expired(self):
         # Check if password is older than 3 months
@@ -55,30 +99,15 @@ class User(UserMixin, db.Model):
         return self.role == 'Manager'
     
     def log_activity(self, action, details=None):
-        log = ActivityLog(user_id=self.id, action=action, details=details)
-        db.session.add(log)
+        # Views are coalesced into counts by default; open streams still see every entry
+        mode, event_count = activity_policy.decide(action)
+        if mode != DROP:
+            activity_writer.enqueue(self.id, action, details=details, event_count=event_count, coalesce=mode == COALESCE)
+        activity_broker.publish(self, action, details)
         
     def has_permission(self, tool_id):
-        # Admin has all permissions
-        if self.is_admin():
-            return True
-        
-        # Check specific permissions
-        permission = Permission.query.filter_by(user_id=self.id, tool_id=tool_id).first()
-        if permission:
-            return permission.has_access
-        
-        # Default permissions based on role
-        tool = Tool.query.get(tool_id)
-        if not tool:
-            return False
-            
-        # Managers have access to most tools
-        if self.is_manager():
-            return True
-            
-        # Staff have access to basic tools
-        return tool.staff_default_access
+        # Explicit permissions first, then role defaults; resolved once per user and cached
+        return permission_resolver.has_permission(self, tool_id)
 
 # Tool model
 class Tool(db.Model):
@@ -100,6 +129,13 @@ class Permission(db.Model):
     tool_id = db.Column(db.Integer, db.ForeignKey('tools.id'), nullable=False)
     has_access = db.Column(db.Boolean, default=True)
     
+    __table_args__ = (
+        db.Index('uq_permissions_user_id_tool_id', 'user_id', 'tool_id', unique=True),
+    )
+
+permission_resolver = PermissionResolver(db, Tool, Permission, Cache('permissions'), access_attribute='has_access')
+permission_resolver.init_app(app)
+    
 # Activity Log model
 class ActivityLog(db.Model):
     __tablename__ = 'activity_logs'
@@ -110,8 +146,50 @@ class ActivityLog(db.Model):
     details = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     ip_address = db.Column(db.String(45))
+    # Events this row stands for: above 1 for coalesced or sampled entries, see activity_policy.py
+    event_count = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     
-    user = db.relationship('User', backref='activity_logs')
+    # Every log listing shows the username, so the owning user is loaded in the same query
+    user = db.relationship('User', backref='activity_logs', lazy='joined', innerjoin=True)
+    
+    __table_args__ = (
+        db.Index('ix_activity_logs_timestamp', 'timestamp'),
+        db.Index('ix_activity_logs_user_id_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_activity_logs_action_timestamp', 'action', 'timestamp'),
+    )
+
+# Monthly tables that activity older than ACTIVITY_LOG_HOT_DAYS has been moved to
+class ActivityLogPartition(db.Model):
+    __tablename__ = 'activity_log_partitions'
+    
+    name = db.Column(db.String(64), primary_key=True)
+    month = db.Column(db.Date, nullable=False, unique=True)
+    # Roll-up progress: the last day counted into activity_log_daily, and when the raw rows were cut down
+    rolled_up_through = db.Column(db.Date)
+    compacted_at = db.Column(db.DateTime)
+
+# Per-day activity counts for months past ACTIVITY_LOG_RETENTION_DAYS
+class ActivityLogDaily(db.Model):
+    __tablename__ = 'activity_log_daily'
+    
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True)
+    action = db.Column(db.String(64), primary_key=True)
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.Index('ix_activity_log_daily_user_id_day', 'user_id', 'day'),
+    )
+
+# Activity log entries are batched by a background writer instead of committed per request
+activity_writer.init_app(app, db, ActivityLog, serverless=is_serverless())
+
+# Old activity moves to monthly partitions and is eventually rolled up into daily counts
+activity_archive = ActivityArchive(db, ActivityLog, ActivityLogPartition, ActivityLogDaily)
+activity_archive.init_app(app)
+
+# Security events are always written; high-volume views are sampled, coalesced or dropped per ACTIVITY_LOG_POLICY
+activity_policy.init_app(app, always_record=SECURITY_ACTIONS, serverless=is_serverless())
 
 # Business model
 class Business(db.Model):
@@ -127,12 +205,128 @@ class Business(db.Model):
     email = db.Column(db.String(100))
     website = db.Column(db.String(200))
     description = db.Column(db.Text)
+    # City-level location from the bundled gazetteer; see geo.py
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12))
+    county = db.Column(db.String(100))
+    metro = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_businesses_type_state', 'type', 'state'),
+        db.Index('ix_businesses_state', 'state'),
+        db.Index('uq_businesses_natural_key', 'name', 'state', 'city', db.text("coalesce(address, '')"), unique=True),
+        db.Index('ix_businesses_city', 'city'),
+        db.Index('ix_businesses_geohash', 'geohash'),
+        # Covering indexes for the per-metro and per-county region counts
+        db.Index('ix_businesses_metro_type', 'metro', 'type'),
+        db.Index('ix_businesses_county_state_type', 'county', 'state', 'type'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'type': self.type,
+            'state': self.state,
+            'city': self.city,
+            'phone': self.phone,
+            'email': self.email,
+            'website': self.website,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'county': self.county,
+            'metro': self.metro
+        }
+
+# Business counts per (type, state), maintained on every Business write
+class BusinessStat(db.Model):
+    __tablename__ = 'business_stats'
+    
+    type = db.Column(db.String(50), primary_key=True)
+    state = db.Column(db.String(50), primary_key=True)
+    business_count = db.Column(db.Integer, nullable=False, default=0)
+
+track_business_counts(Business, BusinessStat)
+
+# Dimensions /api/businesses filters and counts by
+FACET_DIMENSIONS = ('type', 'state', 'city')
+
+# Business counts per (type, state, city), maintained on every Business write for the facet counts
+class BusinessFacetCount(db.Model):
+    __tablename__ = 'business_facet_counts'
+    
+    type = db.Column(db.String(50), primary_key=True)
+    state = db.Column(db.String(50), primary_key=True)
+    city = db.Column(db.String(50), primary_key=True)
+    business_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.Index('ix_business_facet_counts_state_city', 'state', 'city'),
+        db.Index('ix_business_facet_counts_city', 'city'),
+    )
+
+track_business_counts(Business, BusinessFacetCount, dimensions=FACET_DIMENSIONS)
+
+# Businesses get city-level coordinates from the bundled gazetteer as they are written
+gazetteer.init_app(app)
+track_locations(Business, gazetteer)
+business_locator = BusinessLocator(db, Business)
+business_locator.init_app(app)
+
+# Ranked full-text search over businesses, backed by the index from migration 0005
+business_search = BusinessSearch(db, Business)
+business_search.init_app(app)
 
+# Open dashboards get activity pushed over /stream/activity instead of polling for it
+activity_broker.init_app(app)
+app.register_blueprint(stream_bp)
+
+# Admins can sample-profile requests from /admin/profiling
+sampling_profiler.init_app(app)
+app.register_blueprint(profiling_bp)
+
+# Data sets whose versions feed the ETags of the JSON API routes
+data_versions.track('businesses', Business)
+data_versions.track('activity_logs', ActivityLog)
+data_versions.init_app(app)
+
+# Users are cached briefly between requests; changes to a user drop their entry on commit
+identity_cache = IdentityCache(Cache('identity'))
+identity_cache.init_app(app)
+identity_cache.track(User)
+
+def user_snapshot(user_id):
+    user = db.session.get(User, user_id)
+    return snapshot_row(user) if user else None
+
+def session_state(user_id):
+    return db.session.execute(select(User.session_version, User.is_active, User.role).where(User.id == user_id)).first()
+
+# Open activity streams re-load their viewer through it on every heartbeat
+@activity_broker.viewer_loader
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    try:
+        user_id, session_version = split_user_id(user_id)
+    except ValueError:
+        return None
+    
+    # A bumped session version or a deactivated account ends existing sessions
+    snapshot = identity_cache.load(
+        user_id, session_version, lambda: user_snapshot(user_id), lambda: session_state(user_id)
+    )
+    if snapshot is None:
+        return None
+    return restore_row(db, User, snapshot)
+
+@app.errorhandler(HasherBusy)
+def password_hasher_busy(error):
+    response = make_response(render_template('error.html', error_message='The server is busy verifying passwords. Please try again in a moment.'), 503)
+    response.headers['Retry-After'] = '5'
+    return response
 
 # Routes
 @app.route('/')
@@ -150,9 +344,19 @@ def login():
         email = request.form.get('email')
         password = request.form.get('password')
         
+        # Refuse locked-out accounts and abusive IPs before any database or hashing work
+        retry_after = login_throttle.check(email, request.remote_addr)
+        if retry_after:
+            flash('Too many failed login attempts. Please try again later.', 'danger')
+            response = make_response(render_template('login.html'), 429)
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+        
         user = User.query.filter_by(email=email).first()
         
         if user and user.check_password(password):
+            login_throttle.record_success(email)
+            
             if not user.is_active:
                 flash('Your account is disabled. Please contact an administrator.', 'danger')
                 return render_template('login.html')
@@ -168,6 +372,7 @@ def login():
                 
             return redirect(url_for('dashboard'))
         else:
+            login_throttle.record_failure(email, request.remote_addr)
             flash('Invalid email or password', 'danger')
             
     return render_template('login.html')
@@ -176,7 +381,6 @@ def login():
 @login_required
 def logout():
     current_user.log_activity('logout')
-    db.session.commit()
     logout_user()
     return redirect(url_for('login'))
 
@@ -187,31 +391,20 @@ def dashboard():
     tools = Tool.query.all()
     
     # Get recent activity for dashboard
-    if current_user.is_admin():
-        # Admins see all activity
-        recent_activity = ActivityLog.query.order_by(ActivityLog.timestamp.desc()).limit(10).all()
-    elif current_user.is_manager():
-        # Managers see activity from staff and themselves
-        staff_ids = [user.id for user in User.query.filter_by(role='Staff').all()]
-        staff_ids.append(current_user.id)
-        recent_activity = ActivityLog.query.filter(ActivityLog.user_id.in_(staff_ids)).order_by(ActivityLog.timestamp.desc()).limit(10).all()
-    else:
-        # Staff only see their own activity
-        recent_activity = ActivityLog.query.filter_by(user_id=current_user.id).order_by(ActivityLog.timestamp.desc()).limit(10).all()
+    recent_activity = recent_activity_for(current_user)
     
-    # Get business counts
-    total_businesses = Business.query.count()
-    vehicle_dealerships = Business.query.filter_by(type='Vehicle Dealership').count()
-    real_estate = Business.query.filter_by(type='Real Estate Professional').count()
-    apartment_rentals = Business.query.filter_by(type='Apartment Rental').count()
+    # Get business counts from the maintained aggregate
+    stats = summarize_business_counts(BusinessStat)
+    total_businesses = stats['total']
+    vehicle_dealerships = stats['by_type']['Vehicle Dealership']
+    real_estate = stats['by_type']['Real Estate Professional']
+    apartment_rentals = stats['by_type']['Apartment Rental']
     
     # Get business types for filter
-    business_types = db.session.query(Business.type).distinct().all()
-    business_types = [t[0] for t in business_types]
+    business_types = sorted(stats['by_type'])
     
     # Log dashboard view
     current_user.log_activity('viewed_dashboard')
-    db.session.commit()
     
     return render_template(
         'dashboard.html', 
@@ -224,8 +417,32 @@ def dashboard():
         apartment_rentals=apartment_rentals
     )
 
+def recent_activity_for(user):
+    """The ten newest activity log entries user may see on the dashboard"""
+    if user.is_admin():
+        # Admins see all activity
+        return ActivityLog.query.order_by(ActivityLog.timestamp.desc()).limit(10).all()
+    if user.is_manager():
+        # Managers see activity from staff and themselves
+        staff_ids = db.session.query(User.id).filter_by(role='Staff').scalar_subquery()
+        return ActivityLog.query.filter(or_(ActivityLog.user_id.in_(staff_ids), ActivityLog.user_id == user.id)).order_by(ActivityLog.timestamp.desc()).limit(10).all()
+    # Staff only see their own activity
+    return ActivityLog.query.filter_by(user_id=user.id).order_by(ActivityLog.timestamp.desc()).limit(10).all()
+
+@app.route('/api/recent-activity')
+@login_required
+def api_recent_activity():
+    # The dashboard reloads its activity panel from here when its stream cannot replay what it missed
+    return json.dumps([{
+        'user': log.user.username,
+        'action': log.action,
+        'details': log.details,
+        'timestamp': log.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+    } for log in recent_activity_for(current_user)])
+
 @app.route('/api/chart-data')
 @login_required
+@data_versions.conditional('businesses', per_user=False)
 def chart_data():
     # Get business distribution by state
     state_data = db.session.query(
@@ -249,6 +466,106 @@ def chart_data():
     
     return json.dumps(data)
 
+@app.route('/api/businesses')
+@login_required
+@data_versions.conditional('businesses', per_user=False)
+def api_businesses():
+    filters = {dim: request.args.get(dim) or None for dim in FACET_DIMENSIONS}
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+    
+    query = Business.query.filter_by(**{dim: value for dim, value in filters.items() if value is not None})
+    businesses = paginate_request(query, (Business.id,), descending=False, per_page=per_page)
+    
+    # Facet counts come from business_facet_counts rather than GROUP BY queries over businesses
+    facets, total = facet_counts(db.session, BusinessFacetCount, filters, FACET_DIMENSIONS, limit=app.config['FACET_LIMIT'])
+    
+    return json.dumps({
+        'filters': filters,
+        'total': total,
+        'results': [business.to_dict() for business in businesses],
+        'next': businesses.next_url(),
+        'prev': businesses.prev_url(),
+        'facets': facets
+    })
+
+@app.route('/api/businesses/search')
+@login_required
+@data_versions.conditional('businesses', per_user=False)
+def search_businesses():
+    query = request.args.get('q', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+    
+    found = business_search.search(
+        query,
+        business_type=request.args.get('type') or None,
+        state=request.args.get('state') or None,
+        limit=per_page,
+        offset=(page - 1) * per_page
+    )
+    
+    return json.dumps({
+        'query': query,
+        'page': page,
+        'per_page': per_page,
+        'total': found['total'],
+        'total_is_estimate': found['total_is_estimate'],
+        'results': [business.to_dict() for business in found['results']],
+        'facets': found['facets']
+    })
+
+@app.route('/api/businesses/nearby')
+@login_required
+@data_versions.conditional('businesses', per_user=False)
+def nearby_businesses():
+    latitude = request.args.get('lat', type=float)
+    longitude = request.args.get('lon', type=float)
+    if latitude is None or longitude is None:
+        # Fall back to the centre of a named city
+        place = gazetteer.lookup(request.args.get('city'), request.args.get('state'))
+        if place is None:
+            return json.dumps({'error': 'Give lat and lon, or a city and state in the gazetteer'}), 400
+        latitude, longitude = place.latitude, place.longitude
+    
+    business_type = request.args.get('type') or None
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    radius_km = request.args.get('radius_km', type=float)
+    
+    if radius_km is not None:
+        found = business_locator.within(latitude, longitude, radius_km, business_type=business_type, limit=limit)
+    else:
+        found = business_locator.nearest(latitude, longitude, limit, business_type=business_type)
+    
+    return json.dumps({
+        'latitude': latitude,
+        'longitude': longitude,
+        'radius_km': radius_km,
+        'results': [dict(business.to_dict(), distance_km=round(distance, 2)) for business, distance in found]
+    })
+
+@app.route('/api/region-distribution')
+@login_required
+@data_versions.conditional('businesses', per_user=False)
+def region_distribution():
+    level = request.args.get('level', 'metro')
+    if level not in ('county', 'metro'):
+        return json.dumps({'error': 'level must be county or metro'}), 400
+    
+    business_type = request.args.get('type')
+    counts = region_counts(db.session, Business, level, None if business_type in (None, '', 'all') else business_type)
+    
+    return json.dumps({
+        'labels': [label for label, _ in counts],
+        'data': [count for _, count in counts]
+    })
+
+@app.route('/api/db-pool')
+@login_required
+def db_pool():
+    if not current_user.is_admin():
+        return json.dumps({'error': 'Forbidden'}), 403
+    return json.dumps(pool_status(db.engine))
+
 @app.route('/users')
 @login_required
 def users():
@@ -470,6 +787,9 @@ def change_password():
         current_user.log_activity('changed_password')
         db.session.commit()
         
+        # The password change bumped the session version; keep this session signed in
+        login_user(current_user._get_current_object())
+        
         flash('Password changed successfully.', 'success')
         return redirect(url_for('dashboard'))
         
@@ -482,33 +802,28 @@ def activity_log():
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('dashboard'))
         
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    
+    # Spans the archived months as well as the hot table
+    log = activity_archive.source()
     if current_user.is_admin():
         # Admins see all activity
-        logs = ActivityLog.query.order_by(ActivityLog.timestamp.desc()).paginate(page=page, per_page=per_page)
+        query = db.session.query(log)
     else:
         # Managers see activity from staff and themselves
-        staff_ids = [user.id for user in User.query.filter_by(role='Staff').all()]
-        staff_ids.append(current_user.id)
-        logs = ActivityLog.query.filter(ActivityLog.user_id.in_(staff_ids)).order_by(ActivityLog.timestamp.desc()).paginate(page=page, per_page=per_page)
+        staff_ids = db.session.query(User.id).filter_by(role='Staff').scalar_subquery()
+        query = db.session.query(log).filter(or_(log.user_id.in_(staff_ids), log.user_id == current_user.id))
+    
+    logs = paginate_request(query, (log.timestamp, log.id))
     
     current_user.log_activity('viewed_activity_log')
-    db.session.commit()
     
     return render_template('activity_log.html', logs=logs)
 
 @app.route('/businesses')
 @login_required
 def businesses():
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    
-    businesses = Business.query.paginate(page=page, per_page=per_page)
+    businesses = paginate_request(Business.query, (Business.id,), descending=False)
     
     current_user.log_activity('viewed_businesses')
-    db.session.commit()
     
     return render_template('businesses.html', businesses=businesses)
 
@@ -518,7 +833,6 @@ def business_detail(business_id):
     business = Business.query.get_or_404(business_id)
     
     current_user.log_activity('viewed_business_detail', details=f'Business ID: {business_id}')
-    db.session.commit()
     
     return render_template('business_detail.html', business=business)
 
@@ -602,6 +916,8 @@ def create_default_data():
         staff.set_password('Staff123!')
         db.session.add(staff)
     
+    db.session.commit()
+    
     # Create sample business data if none exists
     if Business.query.count() == 0:
         # Sample data for businesses across different states
@@ -678,16 +994,78 @@ def create_default_data():
             })
         
         # Add all businesses to database
-        for business_data in sample_businesses:
-            business = Business(**business_data)
-            db.session.add(business)
+        import_businesses(db, Business, sample_businesses)
+        after_business_import()
     
-    db.session.commit()
+    # Populate the aggregate for databases created before business_stats existed
+    elif BusinessStat.query.first() is None:
+        rebuild_business_stats()
+
+def rebuild_business_stats():
+    with db.engine.begin() as connection:
+        rebuild_business_counts(connection, Business, BusinessStat)
+        rebuild_business_counts(connection, Business, BusinessFacetCount, dimensions=FACET_DIMENSIONS)
+
+def after_business_import():
+    # Bulk inserts skip the ORM events that keep business_stats, locations and the ETags current
+    geocode_businesses(db, Business, gazetteer)
+    rebuild_business_stats()
+    with db.engine.begin() as connection:
+        data_versions.bump(connection, 'businesses')
+
+def after_geocode():
+    with db.engine.begin() as connection:
+        data_versions.bump(connection, 'businesses')
+
+register_import_command(app, db, Business, after_business_import)
+register_geocode_command(app, db, Business, gazetteer, after_geocode)
 
-# Initialize database and create default data
-with app.app_context():
+def after_activity_compaction():
+    # Roll-ups delete raw rows with Core statements, which skip the ORM events behind the ETags
+    with db.engine.begin() as connection:
+        data_versions.bump(connection, 'activity_logs')
+
+register_compact_command(app, activity_archive, after_activity_compaction)
+
+@app.cli.command('rebuild-business-stats')
+def rebuild_business_stats_command():
+    """Recompute business_stats and business_facet_counts from the businesses table"""
+    rebuild_business_stats()
+    print(f"Rebuilt business_stats: {summarize_business_counts(BusinessStat)['total']} businesses")
+
+# Routes covered by 'flask audit-queries'
+AUDITED_PATHS = [
+    '/dashboard',
+    '/api/chart-data',
+    '/api/chart-data?type=Vehicle Dealership',
+    '/users',
+    '/activity-log',
+    '/businesses',
+    '/businesses/1',
+    '/api/businesses',
+    '/api/businesses?type=Vehicle Dealership',
+    '/api/businesses/search?q=auto',
+    '/api/businesses/nearby?lat=40.7&lon=-74.0',
+    '/api/businesses/nearby?lat=40.7&lon=-74.0&radius_km=50',
+    '/api/region-distribution',
+    '/api/region-distribution?level=county',
+]
+
+register_audit_command(app, db, AUDITED_PATHS, lambda: User.query.filter_by(role='Admin').first())
+
+def init_db():
     db.create_all()
+    run_migrations(db.engine)
     create_default_data()
 
+# Schema and seed data are set up explicitly rather than on every import, which kept DDL off cold starts
+@app.cli.command('init-db')
+def init_db_command():
+    """Create tables, apply migrations and load default data"""
+    init_db()
+    print("Database initialized")
+
 if __name__ == '__main__':
+    with app.app_context():
+        init_db()
     app.run(host='0.0.0.0', port=5000, debug=False)
@@ -0,0 +1,272 @@
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import Blueprint, Response, current_app, request
+from flask_login import current_user, login_required
+
+logger = logging.getLogger(__name__)
+
+stream_bp = Blueprint('stream', __name__, url_prefix='/stream')
+
+
+def can_see(viewer_id, viewer_role, event):
+    """Apply the recent activity visibility rules: admins see everything, managers staff and themselves, staff themselves"""
+    if viewer_role == 'Admin':
+        return True
+    if event['user_id'] == viewer_id:
+        return True
+    return viewer_role == 'Manager' and event['role'] == 'Staff'
+
+
+class Subscription:
+    """One open stream: a bounded queue of the events its viewer may see"""
+
+    def __init__(self, viewer_id, viewer_role, size, session_id=None):
+        self.viewer_id = viewer_id
+        self.viewer_role = viewer_role
+        self.session_id = session_id
+        self.queue = queue.Queue(maxsize=size)
+        self.closed = False
+
+
+class ActivityBroker:
+    """In-process pub/sub for activity log entries, fanned out to open streams
+
+    log_activity() publishes each entry once; the broker checks every open
+    subscription's visibility and queues the entry for those allowed to see
+    it, so N dashboards cost one publish instead of N polling queries. The
+    last STREAM_REPLAY_SIZE events are kept so a reconnecting client can
+    resume from its Last-Event-ID.
+
+    Each process has its own broker: under a multi-process server a stream
+    only sees activity logged by the process serving it. A subscriber whose
+    queue fills is closed rather than slowing publishers; its browser
+    reconnects and replays what it missed.
+
+    Every open stream holds a thread (or greenlet) for up to
+    STREAM_MAX_DURATION seconds, so streams are refused on servers that run
+    one request at a time, such as gunicorn's default sync workers; use
+    '-k gthread --threads N' or '-k gevent'. With STREAM_WORKER_THREADS set
+    to N, at most half of those threads are given to streams.
+
+    The function registered with viewer_loader() re-loads each viewer from
+    their session id every STREAM_HEARTBEAT_INTERVAL seconds, so a demoted
+    viewer sees what their new role allows and a deactivated one is cut off.
+    """
+
+    def __init__(self, app=None):
+        # Event ids are '<epoch>.<sequence>'; the epoch tells a resume from another process or run
+        self.epoch = f'{int(time.time()):x}{os.getpid():x}'
+        self.replay_size = 100
+        self.queue_size = 100
+        self.max_subscribers = 500
+        self._load_viewer = None
+        self._sequence = 0
+        self._recent = deque(maxlen=self.replay_size)
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self.stats = {'published': 0, 'delivered': 0, 'overflowed': 0, 'rejected': 0}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('STREAM_REPLAY_SIZE', 100)
+        app.config.setdefault('STREAM_QUEUE_SIZE', 100)
+        app.config.setdefault('STREAM_MAX_SUBSCRIBERS', 500)
+        app.config.setdefault('STREAM_HEARTBEAT_INTERVAL', 15)
+        app.config.setdefault('STREAM_MAX_DURATION', 300)
+        app.config.setdefault('STREAM_WORKER_THREADS', None)
+
+        self.replay_size = app.config['STREAM_REPLAY_SIZE']
+        self.queue_size = app.config['STREAM_QUEUE_SIZE']
+        self.max_subscribers = app.config['STREAM_MAX_SUBSCRIBERS']
+        if app.config['STREAM_WORKER_THREADS']:
+            # Streams past this would leave page requests waiting for a free thread
+            self.max_subscribers = min(self.max_subscribers, app.config['STREAM_WORKER_THREADS'] // 2)
+        with self._lock:
+            self._recent = deque(self._recent, maxlen=self.replay_size)
+
+        app.extensions['activity_broker'] = self
+
+    def viewer_loader(self, callback):
+        """Register callback(session_id), returning the viewer's current user or None once their session has ended"""
+        self._load_viewer = callback
+        return callback
+
+    @property
+    def subscribers(self):
+        return len(self._subscriptions)
+
+    def publish(self, user, action, details=None):
+        """Fan an activity log entry for user out to every stream allowed to see it"""
+        with self._lock:
+            self._sequence += 1
+            event = {
+                'id': f'{self.epoch}.{self._sequence}',
+                'sequence': self._sequence,
+                'user_id': user.id,
+                'role': user.role,
+                'user': user.username,
+                'action': action,
+                'details': details,
+                'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+            }
+            self._recent.append(event)
+            subscriptions = list(self._subscriptions)
+        self.stats['published'] += 1
+
+        for subscription in subscriptions:
+            if not can_see(subscription.viewer_id, subscription.viewer_role, event):
+                continue
+            try:
+                subscription.queue.put_nowait(event)
+                self.stats['delivered'] += 1
+            except queue.Full:
+                self.stats['overflowed'] += 1
+                self.unsubscribe(subscription)
+
+    def subscribe(self, viewer_id, viewer_role, last_event_id=None, session_id=None):
+        """Open a subscription; returns (subscription, backlog), or (None, None) when at capacity
+
+        backlog holds the visible events after last_event_id, or is None when
+        they are no longer all held (another process, a restart, or too long
+        ago) and the client must reload its panel instead.
+        """
+        subscription = Subscription(viewer_id, viewer_role, self.queue_size, session_id)
+        with self._lock:
+            if len(self._subscriptions) >= self.max_subscribers:
+                self.stats['rejected'] += 1
+                return None, None
+            # Registered under the lock so nothing published between the replay and the first get() is lost
+            self._subscriptions.add(subscription)
+            backlog = self._backlog(last_event_id)
+
+        if backlog is not None:
+            backlog = [event for event in backlog if can_see(viewer_id, viewer_role, event)]
+        return subscription, backlog
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+        if not subscription.closed:
+            subscription.closed = True
+            # Wake the stream so it notices the close; a full queue is already being read
+            try:
+                subscription.queue.put_nowait(None)
+            except queue.Full:
+                pass
+
+    def refresh(self, subscription, app):
+        """Re-load a subscription's viewer and apply their current role; False once they may no longer stream"""
+        if self._load_viewer is None:
+            return True
+        # The app context ends the database session again, so a stream never holds a connection
+        with app.app_context():
+            viewer = self._load_viewer(subscription.session_id)
+            if viewer is None or not viewer.is_active:
+                return False
+            subscription.viewer_role = viewer.role
+        return True
+
+    def _backlog(self, last_event_id):
+        if not last_event_id:
+            return []
+        epoch, _, sequence = last_event_id.partition('.')
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        # Events between last_event_id and the oldest one still held are gone
+        if self._recent and self._recent[0]['sequence'] > sequence + 1:
+            return None
+        return [event for event in self._recent if event['sequence'] > sequence]
+
+
+activity_broker = ActivityBroker()
+
+
+def concurrent_worker(environ):
+    """Whether the server runs other requests while this one waits, so a stream does not stall them"""
+    if environ.get('wsgi.multithread'):
+        return True
+    # gevent and eventlet run each request on a greenlet once blocking calls are patched
+    gevent_monkey = sys.modules.get('gevent.monkey')
+    if gevent_monkey is not None and gevent_monkey.is_module_patched('threading'):
+        return True
+    eventlet_patcher = sys.modules.get('eventlet.patcher')
+    return eventlet_patcher is not None and eventlet_patcher.is_monkey_patched('thread')
+
+
+def format_event(event):
+    data = {key: event[key] for key in ('user', 'action', 'details', 'timestamp')}
+    return f"id: {event['id']}\nevent: activity\ndata: {json.dumps(data)}\n\n"
+
+
+@stream_bp.route('/activity')
+@login_required
+def activity():
+    """Stream activity log entries visible to the current user as server-sent events"""
+    app = current_app._get_current_object()
+    broker = app.extensions['activity_broker']
+    heartbeat = current_app.config['STREAM_HEARTBEAT_INTERVAL']
+    max_duration = current_app.config['STREAM_MAX_DURATION']
+
+    if not concurrent_worker(request.environ):
+        return Response('Activity streams need a threaded or async worker\n', status=503, mimetype='text/plain')
+
+    subscription, backlog = broker.subscribe(
+        current_user.id, current_user.role, request.headers.get('Last-Event-ID'), current_user.get_id()
+    )
+    if subscription is None:
+        response = Response('Too many open activity streams\n', status=503, mimetype='text/plain')
+        response.headers['Retry-After'] = '30'
+        return response
+
+    def events():
+        try:
+            # Browsers reconnect after this many milliseconds when the stream ends
+            yield 'retry: 5000\n\n'
+            if backlog is None:
+                yield 'event: reset\ndata: {}\n\n'
+            for event in backlog or ():
+                yield format_event(event)
+
+            # Streams end after max_duration so a worker is never held indefinitely; the client resumes
+            deadline = time.monotonic() + max_duration
+            recheck = time.monotonic() + heartbeat
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                if now >= recheck:
+                    # Role changes and deactivations apply to open streams too
+                    if not broker.refresh(subscription, app):
+                        break
+                    recheck = now + heartbeat
+                try:
+                    event = subscription.queue.get(timeout=min(recheck, deadline) - now)
+                except queue.Empty:
+                    if subscription.closed:
+                        break
+                    # Comment lines keep proxies from timing out an idle connection
+                    yield ': keepalive\n\n'
+                    continue
+                if event is None:
+                    break
+                # Queued before a demotion took effect
+                if can_see(subscription.viewer_id, subscription.viewer_role, event):
+                    yield format_event(event)
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = Response(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,14 +1,58 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
 from flask_login import login_required, current_user
+from sqlalchemy import event
 import os
+from contextlib import contextmanager
 from datetime import datetime
 
-from .models.user import db, User, Tool, ActivityLog
+from .models.user import db, permission_resolver, User, Tool, ActivityLog
 from .models.content import Business
 
 # Create blueprint for testing routes
 test_bp = Blueprint('test', __name__, url_prefix='/test')
 
+def flush_activity_log():
+    """Write queued activity log entries so they can be queried immediately"""
+    writer = current_app.extensions.get('activity_log_writer')
+    if writer is not None:
+        writer.flush()
+
+# Most SQL statements each listing may run, however many log rows it returns: what each
+# measured plus one, so a single query per row (an N+1) fails even on a short page
+QUERY_BUDGETS = {
+    # session check, archive partition lookup and the page
+    '/admin/activity-log': 4,
+    # the same, plus the ETag version check
+    '/admin/api/activity-log': 5,
+    # session check, ETag version check and the page
+    '/data/recent-activity': 4
+}
+
+@contextmanager
+def count_queries():
+    """Count the SQL statements executed inside the block"""
+    statements = []
+    
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+def assert_max_queries(client, path, limit):
+    """Request path and raise AssertionError if it runs more than limit SQL statements"""
+    flush_activity_log()
+    with count_queries() as statements:
+        response = client.get(path)
+    if response.status_code != 200:
+        raise AssertionError(f'{path} returned {response.status_code}')
+    if len(statements) > limit:
+        raise AssertionError(f'{path} ran {len(statements)} SQL statements, expected at most {limit}')
+    return len(statements)
+
 @test_bp.route('/user-roles')
 @login_required
 def test_user_roles():
@@ -23,12 +67,13 @@ def test_user_roles():
     # Get all tools
     tools = Tool.query.all()
     
-    # Get permissions for each user
+    # Get permissions for each user in one query
+    matrix = permission_resolver.permissions_matrix(users, tools)
     user_permissions = {}
     for user in users:
         user_permissions[user.id] = {
             'role': user.role,
-            'permissions': {tool.id: user.has_permission(tool.id) for tool in tools}
+            'permissions': matrix[user.id]
         }
     
     return render_template('test/user_roles.html', users=users, tools=tools, user_permissions=user_permissions)
@@ -107,6 +152,7 @@ def test_activity_logging():
     # Generate test activity
     current_user.log_activity('test_activity', details='Testing activity logging system')
     db.session.commit()
+    flush_activity_log()
     
     # Get recent activity logs
     logs = ActivityLog.query.order_by(ActivityLog.timestamp.desc()).limit(20).all()
@@ -125,7 +171,8 @@ def run_all_tests():
         'user_roles': test_user_roles_function(),
         'password_policy': test_password_policy_function(),
         'chart_data': test_chart_data_function(),
-        'activity_logging': test_activity_logging_function()
+        'activity_logging': test_activity_logging_function(),
+        'query_counts': test_query_counts_function()
     }
     
     # Calculate overall test status
@@ -240,6 +287,7 @@ def test_activity_logging_function():
         test_user = User.query.first()
         test_user.log_activity('test_activity', details='Automated test of logging system')
         db.session.commit()
+        flush_activity_log()
         
         # Check if the log was created
         log = ActivityLog.query.filter_by(action='test_activity').first()
@@ -258,3 +306,29 @@ def test_activity_logging_function():
             'status': 'error',
             'message': f'Error testing activity logging: {str(e)}'
         }
+
+def test_query_counts_function():
+    """Test that activity log listings run a fixed number of queries"""
+    try:
+        client = current_app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = current_user.get_id()
+            session['_fresh'] = True
+        
+        counts = {path: assert_max_queries(client, path, limit) for path, limit in QUERY_BUDGETS.items()}
+        
+        return {
+            'status': 'passed',
+            'message': 'Activity log listings stay within their query budgets: ' +
+                       ', '.join(f'{path} ran {count}' for path, count in counts.items())
+        }
+    except AssertionError as e:
+        return {
+            'status': 'failed',
+            'message': str(e)
+        }
+    except Exception as e:
+        return {
+            'status': 'error',
+            'message': f'Error testing query counts: {str(e)}'
+        }
@@ -0,0 +1,253 @@
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import deque
+
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryStore:
+    """In-process sliding-window counters and lockouts"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._hits = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key, window):
+        """Record an event for key and return the number of events within window seconds"""
+        now = time.time()
+        with self._lock:
+            if len(self._hits) >= self.max_keys:
+                self._sweep(now, window)
+            events = self._hits.setdefault(key, deque())
+            events.append(now)
+            self._prune(events, now - window)
+            return len(events)
+
+    def count(self, key, window):
+        now = time.time()
+        with self._lock:
+            events = self._hits.get(key)
+            if not events:
+                return 0
+            self._prune(events, now - window)
+            if not events:
+                del self._hits[key]
+            return len(events)
+
+    def retry_after(self, key, window, limit):
+        """Seconds until key has fewer than limit events within window, or None if it already has"""
+        now = time.time()
+        with self._lock:
+            events = self._hits.get(key)
+            if not events:
+                return None
+            self._prune(events, now - window)
+            if len(events) < limit:
+                return None
+            # Once this event ages out, limit - 1 remain
+            return events[len(events) - limit] + window - now
+
+    def reset(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+
+    def lock(self, key, seconds):
+        with self._lock:
+            self._locks[key] = time.time() + seconds
+
+    def locked_until(self, key):
+        with self._lock:
+            until = self._locks.get(key)
+            if until is not None and until <= time.time():
+                del self._locks[key]
+                return None
+            return until
+
+    def _prune(self, events, cutoff):
+        while events and events[0] <= cutoff:
+            events.popleft()
+
+    def _sweep(self, now, window):
+        # Called under the lock once the table is full; drops keys with no recent events and expired locks
+        for key in [key for key, events in self._hits.items() if not events or events[-1] <= now - window]:
+            del self._hits[key]
+        for key in [key for key, until in self._locks.items() if until <= now]:
+            del self._locks[key]
+
+
+class RedisStore:
+    """Sliding-window counters in Redis sorted sets, shared by every process
+
+    Works with any client implementing ZADD, ZREMRANGEBYSCORE, ZCARD, ZRANGE,
+    EXPIRE, SET (with EX), GET and DEL, so a small in-memory fake can stand in
+    for it.
+    """
+
+    def __init__(self, client, prefix='directory_hub:throttle'):
+        self.client = client
+        self.prefix = prefix
+
+    def hit(self, key, window):
+        now = time.time()
+        name = f'{self.prefix}:hits:{key}'
+        self.client.zremrangebyscore(name, 0, now - window)
+        self.client.zadd(name, {f'{now}:{secrets.token_hex(4)}': now})
+        self.client.expire(name, int(window) + 1)
+        return self.client.zcard(name)
+
+    def count(self, key, window):
+        name = f'{self.prefix}:hits:{key}'
+        self.client.zremrangebyscore(name, 0, time.time() - window)
+        return self.client.zcard(name)
+
+    def retry_after(self, key, window, limit):
+        name = f'{self.prefix}:hits:{key}'
+        now = time.time()
+        self.client.zremrangebyscore(name, 0, now - window)
+        count = self.client.zcard(name)
+        if count < limit:
+            return None
+        oldest = self.client.zrange(name, count - limit, count - limit, withscores=True)
+        return oldest[0][1] + window - now if oldest else window
+
+    def reset(self, key):
+        self.client.delete(f'{self.prefix}:hits:{key}')
+
+    def lock(self, key, seconds):
+        self.client.set(f'{self.prefix}:lock:{key}', time.time() + seconds, ex=max(1, int(seconds)))
+
+    def locked_until(self, key):
+        until = self.client.get(f'{self.prefix}:lock:{key}')
+        return float(until) if until is not None else None
+
+
+class LoginThrottle:
+    """Rate limiting and lockout for login attempts
+
+    Failed attempts are counted per username and per client IP in sliding
+    windows. LOGIN_MAX_FAILURES failures for a username within
+    LOGIN_FAILURE_WINDOW seconds lock it for LOGIN_LOCKOUT_SECONDS, and an IP
+    with LOGIN_IP_MAX_FAILURES failures in the window is refused until they
+    age out. check() touches only the store, so rejected attempts cost no
+    database query or password hash. Store errors are logged and let the
+    attempt through rather than locking everybody out.
+
+    Client IPs come from request.remote_addr, so behind a proxy (Vercel, a
+    load balancer) every client would share the proxy's address and one
+    attacker could lock everybody out. TRUSTED_PROXY_COUNT proxies in front
+    of the app are trusted to set X-Forwarded-For; it defaults to 1 when
+    init_app() is told the app is serverless (Vercel) and 0 elsewhere, since trusting a header no proxy overwrites lets
+    clients pick their own address.
+    """
+
+    def __init__(self, app=None):
+        self.store = MemoryStore()
+        self.enabled = True
+        self.max_failures = 5
+        self.ip_max_failures = 20
+        self.window = 900
+        self.lockout_seconds = 900
+        self.stats = {'rejected': 0, 'failures': 0, 'lockouts': 0, 'errors': 0}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, serverless=False):
+        app.config.setdefault('LOGIN_THROTTLE_ENABLED', True)
+        app.config.setdefault('LOGIN_MAX_FAILURES', 5)
+        app.config.setdefault('LOGIN_IP_MAX_FAILURES', 20)
+        app.config.setdefault('LOGIN_FAILURE_WINDOW', 900)
+        app.config.setdefault('LOGIN_LOCKOUT_SECONDS', 900)
+        app.config.setdefault('LOGIN_THROTTLE_REDIS_URL', app.config.get('CACHE_REDIS_URL'))
+        app.config.setdefault('TRUSTED_PROXY_COUNT', int(os.environ.get('TRUSTED_PROXY_COUNT', 1 if serverless else 0)))
+
+        self.enabled = app.config['LOGIN_THROTTLE_ENABLED']
+        self.max_failures = app.config['LOGIN_MAX_FAILURES']
+        self.ip_max_failures = app.config['LOGIN_IP_MAX_FAILURES']
+        self.window = app.config['LOGIN_FAILURE_WINDOW']
+        self.lockout_seconds = app.config['LOGIN_LOCKOUT_SECONDS']
+        self.store = MemoryStore()
+
+        redis_url = app.config['LOGIN_THROTTLE_REDIS_URL']
+        if redis_url:
+            try:
+                import redis
+                self.store = RedisStore(redis.Redis.from_url(redis_url))
+            except ImportError:
+                logger.error("LOGIN_THROTTLE_REDIS_URL is set but the redis package is not installed; using in-process throttle")
+
+        proxies = app.config['TRUSTED_PROXY_COUNT']
+        if proxies and not app.extensions.get('proxy_fix'):
+            app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
+            app.extensions['proxy_fix'] = proxies
+
+        app.extensions['login_throttle'] = self
+
+    def check(self, username, ip_address):
+        """Return the seconds to wait before another attempt is allowed, or None to allow it"""
+        if not self.enabled:
+            return None
+
+        try:
+            now = time.time()
+            until = self.store.locked_until(self._user_key(username))
+            if until is not None and until > now:
+                self.stats['rejected'] += 1
+                return int(until - now) + 1
+
+            if ip_address:
+                wait = self.store.retry_after(self._ip_key(ip_address), self.window, self.ip_max_failures)
+                if wait is not None:
+                    self.stats['rejected'] += 1
+                    return int(wait) + 1
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Login throttle check failed: {e}")
+
+        return None
+
+    def record_failure(self, username, ip_address):
+        """Count a failed attempt and lock the username once it reaches LOGIN_MAX_FAILURES"""
+        if not self.enabled:
+            return
+
+        self.stats['failures'] += 1
+        try:
+            if ip_address:
+                self.store.hit(self._ip_key(ip_address), self.window)
+            failures = self.store.hit(self._user_key(username), self.window)
+            if failures >= self.max_failures:
+                self.store.lock(self._user_key(username), self.lockout_seconds)
+                self.store.reset(self._user_key(username))
+                self.stats['lockouts'] += 1
+                logger.warning(f"Locked login for '{username}' after {failures} failed attempts")
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Login throttle update failed: {e}")
+
+    def record_success(self, username):
+        """Clear the failure count for username after a successful login"""
+        if not self.enabled:
+            return
+
+        try:
+            self.store.reset(self._user_key(username))
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Login throttle reset failed: {e}")
+
+    def _user_key(self, username):
+        return f"user:{(username or '').strip().lower()}"
+
+    def _ip_key(self, ip_address):
+        return f'ip:{ip_address}'
+
+
+login_throttle = LoginThrottle()
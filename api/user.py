@@ -1,9 +1,17 @@
 from datetime import datetime, timedelta
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 
+from ..activity_archive import ActivityArchive
+from ..activity_policy import COALESCE, DROP, RECORD
+from ..conditional import DataVersions
+from ..cache import Cache
+from ..permissions import PermissionResolver
+from ..hashing import password_hasher
+
 db = SQLAlchemy()
+data_versions = DataVersions(db)
 
 class User(db.Model, UserMixin):
     """User model for authentication and profile information"""
@@ -21,16 +29,21 @@ class User(db.Model, UserMixin):
     account_created = db.Column(db.DateTime, default=datetime.utcnow)
     last_login = db.Column(db.DateTime)
     is_active = db.Column(db.Boolean, default=True)
+    # Part of the login session id; bumping it signs the user out everywhere
+    session_version = db.Column(db.Integer, nullable=False, default=0)
     
     # Relationships
     permissions = db.relationship('Permission', backref='user', lazy='dynamic', cascade='all, delete-orphan')
     password_history = db.relationship('PasswordHistory', backref='user', lazy='dynamic', cascade='all, delete-orphan')
-    activity_logs = db.relationship('ActivityLog', backref='user', lazy='dynamic', cascade='all, delete-orphan')
+    # Every log listing shows the username, so the owning user is loaded in the same query
+    activity_logs = db.relationship('ActivityLog', backref=db.backref('user', lazy='joined', innerjoin=True),
+                                    lazy='dynamic', cascade='all, delete-orphan')
     
     def set_password(self, password):
         """Set the user's password with hashing"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
         self.last_password_change = datetime.utcnow()
+        self.session_version = (self.session_version or 0) + 1
         
         # Store password in history
         history = PasswordHistory(user_id=self.id, password_hash=self.password_hash)
@@ -38,7 +51,11 @@ class User(db.Model, UserMixin):
     
     def check_password(self, password):
         """Check if the provided password matches the stored hash"""
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+    
+    def get_id(self):
+        """Return the login session id, which changes whenever the session version is bumped"""
+        return f'{self.id}:{self.session_version or 0}'
     
     def is_password_expired(self):
         """Check if the password has expired (3 months)"""
@@ -48,25 +65,44 @@ class User(db.Model, UserMixin):
     def is_password_in_history(self, password):
         """Check if the password has been used before (last 5 passwords)"""
         recent_passwords = self.password_history.order_by(PasswordHistory.created_at.desc()).limit(5).all()
-        return any(check_password_hash(history.password_hash, password) for history in recent_passwords)
+        return password_hasher.verify_any((history.password_hash for history in recent_passwords), password)
     
     def has_permission(self, tool_id):
         """Check if the user has permission to access a specific tool"""
-        # Admins have access to everything
-        if self.role == 'Admin':
-            return True
-            
-        # Check specific permission
-        permission = self.permissions.filter_by(tool_id=tool_id).first()
-        return permission and permission.can_access
+        return permission_resolver.has_permission(self, tool_id)
     
     def log_activity(self, action, details=None, ip_address=None):
-        """Log user activity"""
+        """Log user activity
+
+        The activity policy decides whether the entry is written, coalesced
+        into a count or dropped. When the background activity log
+        writer is registered on the app it is queued for a batched insert;
+        otherwise it is committed inline. Open activity streams get every
+        entry straight away either way.
+        """
+        broker = current_app.extensions.get('activity_broker')
+        if broker is not None:
+            broker.publish(self, action, details)
+        
+        policy = current_app.extensions.get('activity_policy')
+        mode, event_count = policy.decide(action) if policy is not None else (RECORD, 1)
+        if mode == DROP:
+            return
+        
+        writer = current_app.extensions.get('activity_log_writer')
+        if writer is not None:
+            writer.enqueue(
+                self.id, action, details=details, ip_address=ip_address,
+                event_count=event_count, coalesce=mode == COALESCE
+            )
+            return
+        
         log = ActivityLog(
             user_id=self.id,
             action=action,
             details=details,
-            ip_address=ip_address
+            ip_address=ip_address,
+            event_count=event_count
         )
         db.session.add(log)
         db.session.commit()
@@ -96,6 +132,7 @@ class Tool(db.Model):
     description = db.Column(db.String(200))
     url = db.Column(db.String(200))
     icon = db.Column(db.String(50))
+    staff_default_access = db.Column(db.Boolean, default=True)
     
     # Relationships
     permissions = db.relationship('Permission', backref='tool', lazy='dynamic', cascade='all, delete-orphan')
@@ -113,6 +150,10 @@ class Permission(db.Model):
     tool_id = db.Column(db.Integer, db.ForeignKey('tools.id'), nullable=False)
     can_access = db.Column(db.Boolean, default=True)
     
+    __table_args__ = (
+        db.Index('uq_permissions_user_id_tool_id', 'user_id', 'tool_id', unique=True),
+    )
+    
     def __repr__(self):
         return f'<Permission user_id={self.user_id} tool_id={self.tool_id} can_access={self.can_access}>'
 
@@ -157,6 +198,52 @@ class ActivityLog(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     details = db.Column(db.Text)
     ip_address = db.Column(db.String(50))
+    # Events this row stands for: above 1 for coalesced or sampled entries, see activity_policy.py
+    event_count = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    
+    __table_args__ = (
+        db.Index('ix_activity_logs_timestamp', 'timestamp'),
+        db.Index('ix_activity_logs_user_id_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_activity_logs_action_timestamp', 'action', 'timestamp'),
+    )
     
     def __repr__(self):
         return f'<ActivityLog user_id={self.user_id} action={self.action} timestamp={self.timestamp}>'
+
+
+class ActivityLogPartition(db.Model):
+    """A monthly table that activity older than ACTIVITY_LOG_HOT_DAYS has been moved to"""
+    __tablename__ = 'activity_log_partitions'
+    
+    name = db.Column(db.String(64), primary_key=True)
+    month = db.Column(db.Date, nullable=False, unique=True)
+    # Roll-up progress: the last day counted into activity_log_daily, and when the raw rows were cut down
+    rolled_up_through = db.Column(db.Date)
+    compacted_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<ActivityLogPartition {self.name}>'
+
+
+class ActivityLogDaily(db.Model):
+    """Per-day activity counts for months past ACTIVITY_LOG_RETENTION_DAYS"""
+    __tablename__ = 'activity_log_daily'
+    
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True)
+    action = db.Column(db.String(100), primary_key=True)
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.Index('ix_activity_log_daily_user_id_day', 'user_id', 'day'),
+    )
+    
+    def __repr__(self):
+        return f'<ActivityLogDaily day={self.day} user_id={self.user_id} action={self.action} count={self.event_count}>'
+
+permission_resolver = PermissionResolver(db, Tool, Permission, Cache('permissions'))
+activity_archive = ActivityArchive(db, ActivityLog, ActivityLogPartition, ActivityLogDaily)
+
+# Data sets whose versions feed the ETags of the JSON API routes
+data_versions.track('users', User, Permission)
+data_versions.track('activity_logs', ActivityLog)
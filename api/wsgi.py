@@ -1,2 +1,19 @@
-from app import app
+import threading
 
+_app = None
+_lock = threading.Lock()
+
+
+def get_app():
+    """Import and build the app on the first request so cold starts only pay for what they serve"""
+    global _app
+    if _app is None:
+        with _lock:
+            if _app is None:
+                from app import create_app
+                _app = create_app()
+    return _app
+
+
+def app(environ, start_response):
+    return get_app()(environ, start_response)
@@ -0,0 +1,123 @@
+"""Measure business search latency on a large directory
+
+Seeds an SQLite database (1 million businesses by default) through the bulk
+importer, applies the migrations that build the search index and times
+BusinessSearch over a mix of full-word, prefix, multi-term and filtered
+queries. Reports median and p95 per query and exits non-zero if any median
+exceeds --budget-ms. Names and descriptions draw words from a Zipf
+distribution, so the common-word queries hit around half the directory.
+
+    python benchmarks/business_search.py --rows 1000000 --db /tmp/search_bench.db
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+SYLLABLES = ['ac', 'me', 'sum', 'mit', 'gol', 'den', 'har', 'bor', 'pi', 'o', 'neer', 'lib', 'er', 'ty', 'ma',
+             'ple', 'ce', 'dar', 'riv', 'ea', 'gle', 'pa', 'cif', 'ic', 'cen', 'tral', 'pre', 'mi', 'um', 'her']
+# Name words follow a Zipf distribution, like real business names: a few very common, most rare
+VOCABULARY = sorted({a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES if len(a + b + c) >= 5})
+SUFFIXES = {'car dealer': ['Motors', 'Auto Sales', 'Cars'], 'realtor': ['Realty', 'Properties', 'Homes'],
+            'apartments': ['Apartments', 'Residences', 'Lofts']}
+STATES = ['CA', 'TX', 'FL', 'NY', 'IL', 'PA', 'OH', 'GA', 'NC', 'MI', 'WA', 'AZ', 'MA', 'TN', 'CO']
+
+
+def vocabulary(seed):
+    rng = random.Random(seed)
+    words = list(VOCABULARY)
+    rng.shuffle(words)
+    return words, list(itertools.accumulate(1 / rank ** 1.1 for rank in range(1, len(words) + 1)))
+
+
+def queries(seed):
+    words, _ = vocabulary(seed)
+    common, middling, rare = words[0], words[50], words[5000]
+    return [
+        ('common word', {'query': common}),
+        ('middling word', {'query': middling}),
+        ('rare word', {'query': rare}),
+        ('prefix', {'query': middling[:4]}),
+        ('short prefix', {'query': rare[:2]}),
+        ('two terms', {'query': f'{middling} realty'}),
+        ('name and city', {'query': f'{rare} springfield'}),
+        ('no match', {'query': 'zanzibar'}),
+        ('type filter', {'query': middling, 'business_type': 'Apartment Rental'}),
+        ('type and state', {'query': f'{middling} mot', 'business_type': 'Vehicle Dealership', 'state': 'Texas'}),
+        ('deep page', {'query': common, 'offset': 200}),
+    ]
+
+
+def generate(rows, seed=42):
+    rng = random.Random(seed)
+    words, cum_weights = vocabulary(seed)
+    cities = [f'{rng.choice(words).title()}{rng.choice(["ville", " City", "field", "ton"])}' for _ in range(2000)] + ['Springfield']
+    for i in range(rows):
+        business_type = rng.choice(list(SUFFIXES))
+        first, second = rng.choices(words, cum_weights=cum_weights, k=2)
+        name = f'{first.title()} {second.title()} {rng.choice(SUFFIXES[business_type])} {i}'
+        yield {
+            'name': name,
+            'type': business_type,
+            'state': rng.choice(STATES),
+            'city': rng.choice(cities),
+            'website': f'https://{name.lower().replace(" ", "-")}.example.com',
+            'description': ' '.join(rng.choices(words, cum_weights=cum_weights, k=3)) + ' listing',
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--db', default='/tmp/directory_hub_search_bench.db')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--budget-ms', type=float, default=20.0)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = f'sqlite:///{args.db}'
+    import simplified_app
+    from importer import import_businesses
+
+    app, db, Business = simplified_app.app, simplified_app.db, simplified_app.Business
+    with app.app_context():
+        db.create_all()
+        simplified_app.run_migrations(db.engine)
+
+        existing = Business.query.count()
+        if existing < args.rows:
+            print(f'Seeding {args.rows - existing:,} businesses into {args.db}')
+            stats = import_businesses(db, Business, generate(args.rows - existing), chunk_size=10000)
+            print(f'  {stats.inserted:,} rows in {stats.seconds:.1f}s ({stats.rows_per_second:,.0f} rows/s)')
+
+        search = simplified_app.business_search
+        print(f'Backend: {search.backend}, {Business.query.count():,} businesses')
+        print(f"{'query':<16} {'hits':>8} {'median ms':>10} {'p95 ms':>8}")
+
+        over_budget = []
+        for label, params in queries(42):
+            params = dict(params)
+            offset = params.pop('offset', 0)
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                found = search.search(**params, offset=offset)
+                timings.append((time.perf_counter() - started) * 1000)
+                db.session.remove()
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            hits = f"{found['total']:,}{'+' if found['total_is_estimate'] else ''}"
+            print(f"{label:<16} {hits:>8} {statistics.median(timings):>10.2f} {p95:>8.2f}")
+            if statistics.median(timings) > args.budget_ms:
+                over_budget.append(label)
+
+    if over_budget:
+        sys.exit(f"Median above {args.budget_ms}ms for: {', '.join(over_budget)}")
+
+
+if __name__ == '__main__':
+    main()
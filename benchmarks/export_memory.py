@@ -0,0 +1,165 @@
+"""Measure peak memory of the streaming activity log export
+
+Seeds an SQLite database for the blueprint app (5 million activity log rows
+over the last 200 days by default, older ones moved to the monthly archive
+with 'flask compact-activity-log') and downloads /admin/activity-log/export
+through the test client, with start dates covering growing shares of the
+rows. The view's own query runs, archive union and event_count included.
+Peak traced memory should stay flat as the row count grows; the script
+exits non-zero if it does not.
+
+    python benchmarks/export_memory.py --rows 5000000 --db /tmp/export_bench.db
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+ADMIN_USERNAME = 'export_admin'
+ACTIONS = ['login', 'logout', 'viewed_dashboard', 'viewed_businesses', 'edited_user', 'changed_password']
+
+
+def load_app(db_path, batch_size):
+    sys.path.insert(0, ROOT_DIR)
+    from api.factory import create_app
+    from api.models.user import db, User
+
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'ACTIVITY_LOG_EXPORT_BATCH_SIZE': batch_size,
+        # The export's own log entry is written before the download starts: SQLite refuses
+        # a background insert while the export's read is still open
+        'ACTIVITY_LOG_ASYNC': False,
+    })
+    return app, db, User
+
+
+def seed(app, db, rows, days, chunk=50000):
+    """Create the schema and seed it with rows activity log entries, unless it already holds them"""
+    from sqlalchemy import func, select, text
+
+    runner = app.test_cli_runner()
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(text('CREATE TABLE IF NOT EXISTS benchmark_seed (sizes TEXT NOT NULL)'))
+            seeded = connection.execute(text('SELECT sizes FROM benchmark_seed')).scalar()
+        sizes = {'rows': rows, 'days': days}
+        if seeded is not None:
+            if json.loads(seeded) != sizes:
+                sys.exit(f'{db.engine.url.database} was seeded with {seeded}; pass another --db for {sizes}')
+            return
+
+        result = runner.invoke(args=['init-db'])
+        if result.exit_code:
+            sys.exit(f'init-db failed:\n{result.output}{result.exception!r}')
+
+        users, logs = db.metadata.tables['users'], db.metadata.tables['activity_logs']
+        with db.engine.begin() as connection:
+            connection.execute(users.insert(), [{
+                'username': ADMIN_USERNAME if i == 0 else f'export_user_{i}',
+                'email': f'export_user_{i}@example.com', 'full_name': f'Export User {i}', 'password_hash': 'x',
+                'role': 'Admin' if i == 0 else 'Staff', 'is_active': True, 'created_at': datetime.utcnow()
+            } for i in range(100)])
+            user_ids = [row[0] for row in connection.execute(select(users.c.id))]
+
+        # Evenly spread over the last days, oldest first, so a start date selects a known share
+        end = datetime.utcnow()
+        step = days * 24 * 3600 / rows
+        written = 0
+        while written < rows:
+            batch = [{
+                'user_id': user_ids[i % len(user_ids)],
+                'action': ACTIONS[i % len(ACTIONS)],
+                'details': f'Seeded activity entry {i}',
+                'ip_address': f'10.0.{i % 256}.{i // 256 % 256}',
+                'timestamp': end - timedelta(seconds=(rows - i) * step)
+            } for i in range(written, min(written + chunk, rows))]
+            with db.engine.begin() as connection:
+                connection.execute(logs.insert(), batch)
+            written += len(batch)
+            print(f'  seeded {written:,} rows', end='\r', flush=True)
+        print()
+
+        result = runner.invoke(args=['compact-activity-log'])
+        if result.exit_code:
+            sys.exit(f'compact-activity-log failed:\n{result.output}{result.exception!r}')
+        print(result.output.strip())
+
+        with db.engine.begin() as connection:
+            connection.execute(text('ANALYZE'))
+            connection.execute(text('INSERT INTO benchmark_seed (sizes) VALUES (:sizes)'), {'sizes': json.dumps(sizes)})
+            hot = connection.execute(select(func.count()).select_from(logs)).scalar()
+        print(f'{hot:,} rows left in the hot table')
+
+
+def run_export(client, export_format, start_date):
+    """Download the export from start_date; returns (peak bytes, seconds, rows, bytes out)"""
+    written = 0
+    lines = 0
+    tracemalloc.start()
+    started = time.perf_counter()
+    response = client.get('/admin/activity-log/export', query_string={'format': export_format, 'start_date': start_date})
+    if response.status_code != 200:
+        tracemalloc.stop()
+        sys.exit(f'Export returned HTTP {response.status_code}')
+    for chunk in response.response:
+        written += len(chunk)
+        lines += chunk.count(b'\n') if isinstance(chunk, bytes) else chunk.count('\n')
+    response.close()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # The CSV header is not a row
+    return peak, elapsed, lines - (export_format == 'csv'), written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5_000_000)
+    parser.add_argument('--days', type=int, default=200,
+                        help='Days the rows span; past ACTIVITY_LOG_HOT_DAYS they are read from the archive')
+    parser.add_argument('--db', default='/tmp/directory_hub_export_bench.db')
+    parser.add_argument('--format', choices=['csv', 'ndjson'], default='csv')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--max-growth', type=float, default=2.0,
+                        help='Fail if peak memory for the full export exceeds this multiple of the smallest run')
+    args = parser.parse_args()
+
+    app, db, User = load_app(args.db, args.batch_size)
+    print(f'Seeding {args.rows:,} activity log rows into {args.db}')
+    seed(app, db, args.rows, args.days)
+
+    with app.app_context():
+        session_id = db.session.execute(db.select(User).filter_by(username=ADMIN_USERNAME)).scalar_one().get_id()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = session_id
+        session['_fresh'] = True
+
+    # Start dates whole days back, chosen so each covers at least size rows
+    rows_per_day = args.rows / args.days
+    today = datetime.utcnow().date()
+    sizes = sorted({size for size in (10_000, 100_000, 1_000_000, args.rows) if size <= args.rows})
+    peaks = []
+    print(f"{'rows':>12} {'peak KiB':>10} {'seconds':>9} {'rows/s':>10} {'MiB out':>9}")
+    for size in sizes:
+        days_back = min(math.ceil(size / rows_per_day), args.days + 1)
+        start_date = (today - timedelta(days=days_back)).isoformat()
+        peak, elapsed, rows, written = run_export(client, args.format, start_date)
+        peaks.append(peak)
+        print(f'{rows:>12,} {peak / 1024:>10.1f} {elapsed:>9.2f} {rows / elapsed:>10,.0f} {written / 2**20:>9.1f}')
+
+    growth = peaks[-1] / peaks[0]
+    print(f'Peak memory grew {growth:.2f}x from the smallest to the full export')
+    if growth > args.max_growth:
+        sys.exit(f'Export memory is not constant: {growth:.2f}x > {args.max_growth}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,456 @@
+"""Load-test the app's routes and compare the results against a saved baseline
+
+Seeds an SQLite database (users, tools, permissions, businesses through the
+bulk importer, activity logs) once and reuses it, then measures each route
+twice: in-process through the WSGI test client, counting SQL queries per
+request, and over HTTP from --concurrency threads against a threaded server
+in a child process (or --url, e.g. gunicorn, sharing the SECRET_KEY).
+Reports requests per second, latency percentiles and queries per request.
+
+--save writes the results as a JSON baseline; --baseline compares against
+one and exits non-zero when a route's p95 grew past --tolerance or it runs
+more queries than before. The defaults are the full-size directory; pass
+smaller sizes and another --db for a quick run:
+
+    python benchmarks/routes.py --businesses 100000 --activity-logs 1000000 --db /tmp/routes_small.db
+    python benchmarks/routes.py --save benchmarks/routes_baseline.json
+    python benchmarks/routes.py --baseline benchmarks/routes_baseline.json --mode in-process
+    python benchmarks/routes.py --app factory --route activity
+"""
+import argparse
+import csv
+import gzip
+import http.client
+import importlib
+import json
+import logging
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+API_DIR = os.path.join(ROOT_DIR, 'api')
+
+PASSWORD = 'Benchmark123!'
+ADMIN_USERNAME = 'bench_admin'
+ADMIN_EMAIL = 'bench_admin@example.com'
+
+# name, method, path, form, authenticated; the blueprint app mounts its views under /admin and /data
+ROUTES = {
+    'simplified_app': [
+        ('login page', 'GET', '/login', None, False),
+        ('login', 'POST', '/login', {'email': ADMIN_EMAIL, 'password': PASSWORD}, False),
+        ('dashboard', 'GET', '/dashboard', None, True),
+        ('chart data', 'GET', '/api/chart-data', None, True),
+        ('chart data by type', 'GET', '/api/chart-data?type=Vehicle+Dealership', None, True),
+        ('activity log', 'GET', '/activity-log', None, True),
+        ('business filter', 'GET', '/api/businesses?state=Texas&type=Apartment+Rental', None, True),
+        ('business search', 'GET', '/api/businesses/search?q=motors', None, True),
+        ('nearby businesses', 'GET', '/api/businesses/nearby?city=Chicago&state=Illinois', None, True),
+        ('metro distribution', 'GET', '/api/region-distribution?level=metro', None, True),
+    ],
+    'factory': [
+        ('login page', 'GET', '/login', None, False),
+        ('login', 'POST', '/login', {'username': ADMIN_USERNAME, 'password': PASSWORD}, False),
+        ('state distribution', 'GET', '/data/state-distribution', None, True),
+        ('state distribution by type', 'GET', '/data/state-distribution/Vehicle%20Dealership', None, True),
+        ('business types', 'GET', '/data/business-types', None, True),
+        ('metro distribution', 'GET', '/data/metro-distribution', None, True),
+        ('recent activity', 'GET', '/data/recent-activity', None, True),
+        ('activity log', 'GET', '/admin/activity-log', None, True),
+        ('activity log filter', 'POST', '/admin/activity-log/filter',
+         {'user_id': 'all', 'action': 'login', 'start_date': '', 'end_date': ''}, True),
+        ('activity log api', 'GET', '/admin/api/activity-log', None, True),
+    ],
+}
+
+BUSINESS_TYPES = {
+    'Vehicle Dealership': ['Motors', 'Auto Sales', 'Cars', 'Auto Group'],
+    'Real Estate Professional': ['Realty', 'Properties', 'Homes', 'Real Estate'],
+    'Apartment Rental': ['Apartments', 'Residences', 'Lofts', 'Towers'],
+}
+NAME_WORDS = ['Summit', 'Golden', 'Pioneer', 'Liberty', 'Cedar', 'River', 'Eagle', 'Pacific', 'Central', 'Premium',
+              'Harbor', 'Maple', 'Oak', 'Sunset', 'Lakeside', 'Valley', 'Metro', 'Capital', 'Heritage', 'Prime']
+
+# Action weights roughly as the dashboards log them
+ACTIONS = [
+    ('viewed_dashboard', 30), ('login', 15), ('logout', 10), ('viewed_state_distribution', 12),
+    ('viewed_business_types_distribution', 8), ('viewed_recent_activity', 8), ('viewed_activity_log', 5),
+    ('edited_user', 3), ('exported_activity_log', 2), ('failed_login', 4), ('changed_password', 1),
+    ('created_user', 1), ('deleted_user', 1),
+]
+
+
+def load_app(spec):
+    """Import the app to measure: a flat module in api/ with an 'app', or 'factory' for the blueprint package"""
+    if spec == 'factory':
+        sys.path.insert(0, ROOT_DIR)
+        from api.factory import create_app
+        app = create_app()
+    else:
+        sys.path.insert(0, API_DIR)
+        app = importlib.import_module(spec).app
+    # Routes whose templates are not deployed fail on every request; the status column shows it
+    app.logger.setLevel(logging.CRITICAL)
+    return app
+
+
+def mapped_class(db, table_name):
+    for mapper in db.Model.registry.mappers:
+        if mapper.local_table.name == table_name:
+            return mapper.class_
+    raise LookupError(f'No model is mapped to {table_name}')
+
+
+def insert_chunks(db, table, rows, chunk_size=50000):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            with db.engine.begin() as connection:
+                connection.execute(table.insert(), chunk)
+            chunk = []
+    if chunk:
+        with db.engine.begin() as connection:
+            connection.execute(table.insert(), chunk)
+
+
+def business_rows(count, rng):
+    with open(os.path.join(API_DIR, 'gazetteer.csv'), encoding='utf-8') as f:
+        places = [(row['city'], row['state']) for row in csv.DictReader(f)]
+    states = sorted({state for _, state in places})
+    types = list(BUSINESS_TYPES)
+
+    for i in range(count):
+        business_type = rng.choice(types)
+        # Most businesses are in gazetteer cities, so geocoding, facets and nearby queries have real work
+        if rng.random() < 0.7:
+            city, state = rng.choice(places)
+        else:
+            state = rng.choice(states)
+            city = f'{rng.choice(NAME_WORDS)}{rng.choice(["ville", "field", "ton", " Springs"])}'
+        name = f'{rng.choice(NAME_WORDS)} {rng.choice(NAME_WORDS)} {rng.choice(BUSINESS_TYPES[business_type])} {i}'
+        yield {'name': name, 'type': business_type, 'state': state, 'city': city,
+               'phone': f'555-{rng.randrange(10000):04d}', 'website': f'https://example.com/{i}'}
+
+
+def seed(app, db, sizes, seed_value=42):
+    """Create the schema and seed it to sizes, unless this database already holds exactly that seed"""
+    from sqlalchemy import func, select, text
+    from werkzeug.security import generate_password_hash
+
+    rng = random.Random(seed_value)
+    runner = app.test_cli_runner()
+
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(text('CREATE TABLE IF NOT EXISTS benchmark_seed (sizes TEXT NOT NULL)'))
+            seeded = connection.execute(text('SELECT sizes FROM benchmark_seed')).scalar()
+        if seeded is not None:
+            if json.loads(seeded) != sizes:
+                sys.exit(f'{db.engine.url.database} was seeded with {seeded}; pass another --db for {sizes}')
+            return
+
+        started = time.perf_counter()
+        result = runner.invoke(args=['init-db'])
+        if result.exit_code:
+            sys.exit(f'init-db failed:\n{result.output}{result.exception!r}')
+
+        tables = db.metadata.tables
+        users, tools, permissions, logs = (tables[name] for name in ('users', 'tools', 'permissions', 'activity_logs'))
+        password_hash = generate_password_hash(PASSWORD)
+        now = datetime.utcnow()
+
+        print(f'Seeding {sizes["users"]:,} users and {sizes["tools"]} tools ...', flush=True)
+        user_rows = [{'username': ADMIN_USERNAME, 'email': ADMIN_EMAIL, 'full_name': 'Benchmark Admin', 'role': 'Admin'}]
+        for i in range(sizes['users'] - 1):
+            role = rng.choices(['Admin', 'Manager', 'Staff'], weights=[5, 15, 80])[0]
+            user_rows.append({'username': f'bench_user_{i}', 'email': f'bench_user_{i}@example.com',
+                              'full_name': f'Benchmark User {i}', 'role': role})
+        for row in user_rows:
+            row.update(password_hash=password_hash, is_active=True, created_at=now)
+        insert_chunks(db, users, user_rows)
+
+        with db.engine.connect() as connection:
+            existing_tools = connection.execute(select(func.count()).select_from(tools)).scalar()
+        insert_chunks(db, tools, [
+            {'name': f'Benchmark Tool {i}', 'description': 'Seeded for benchmarks', 'url': f'/tools/{i}', 'icon': 'gear'}
+            for i in range(max(sizes['tools'] - existing_tools, 0))
+        ])
+
+        with db.engine.connect() as connection:
+            user_ids = [row[0] for row in connection.execute(select(users.c.id))]
+            tool_ids = [row[0] for row in connection.execute(select(tools.c.id))]
+        insert_chunks(db, permissions, (
+            {'user_id': user_id, 'tool_id': tool_id, 'has_access': rng.random() < 0.8}
+            for user_id in user_ids if rng.random() < 0.3
+            for tool_id in rng.sample(tool_ids, min(5, len(tool_ids)))
+        ))
+
+        print(f'Importing {sizes["businesses"]:,} businesses ...', flush=True)
+        path = os.path.join(tempfile.gettempdir(), f'directory_hub_routes_{os.getpid()}.ndjson.gz')
+        try:
+            with gzip.open(path, 'wt', encoding='utf-8') as f:
+                for row in business_rows(sizes['businesses'], rng):
+                    f.write(json.dumps(row) + '\n')
+            result = runner.invoke(args=['import-businesses', path])
+            if result.exit_code:
+                sys.exit(f'import-businesses failed:\n{result.output}{result.exception!r}')
+        finally:
+            os.remove(path)
+
+        print(f'Inserting {sizes["activity_logs"]:,} activity logs ...', flush=True)
+        actions, weights = zip(*ACTIONS)
+        # Busy users log far more than the rest
+        user_weights = [1 / rank for rank in range(1, len(user_ids) + 1)]
+        span = 90 * 24 * 3600
+
+        def log_rows():
+            for _ in range(sizes['activity_logs'] // 1000):
+                for user_id, action in zip(rng.choices(user_ids, user_weights, k=1000), rng.choices(actions, weights, k=1000)):
+                    yield {'user_id': user_id, 'action': action, 'details': None, 'ip_address': '127.0.0.1',
+                           'timestamp': now - timedelta(seconds=rng.randrange(span))}
+            for _ in range(sizes['activity_logs'] % 1000):
+                yield {'user_id': rng.choice(user_ids), 'action': rng.choice(actions), 'details': None,
+                       'ip_address': '127.0.0.1', 'timestamp': now - timedelta(seconds=rng.randrange(span))}
+        insert_chunks(db, logs, log_rows())
+
+        with db.engine.begin() as connection:
+            connection.execute(text('ANALYZE'))
+            connection.execute(text('INSERT INTO benchmark_seed (sizes) VALUES (:sizes)'), {'sizes': json.dumps(sizes)})
+        print(f'Seeded in {time.perf_counter() - started:.0f}s', flush=True)
+
+
+def session_user_id(app, db):
+    """The Flask-Login id of the benchmark admin, as the apps store it in the session"""
+    with app.app_context():
+        user_model = mapped_class(db, 'users')
+        return db.session.execute(db.select(user_model).filter_by(username=ADMIN_USERNAME)).scalar_one().get_id()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def summarize(latencies, statuses, elapsed, queries=None):
+    latencies = sorted(seconds * 1000 for seconds in latencies)
+    summary = {
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed if elapsed else 0,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'statuses': {str(status): statuses.count(status) for status in sorted(set(statuses), key=str)},
+    }
+    if queries is not None:
+        summary['queries'] = max(queries) if queries else 0
+    return summary
+
+
+def measure_in_process(app, db, route, user_id, requests, warmup=3):
+    from sqlalchemy import event
+
+    _, method, path, form, authenticated = route
+    client = app.test_client(use_cookies=authenticated)
+    if authenticated:
+        with client.session_transaction() as session:
+            session['_user_id'] = user_id
+            session['_fresh'] = True
+
+    counter = [0]
+
+    def count_query(*args):
+        counter[0] += 1
+
+    with app.app_context():
+        engine = db.engine
+    latencies, statuses, queries = [], [], []
+    event.listen(engine, 'before_cursor_execute', count_query)
+    try:
+        for i in range(warmup + requests):
+            counter[0] = 0
+            started = time.perf_counter()
+            response = client.open(path, method=method, data=form, headers={'Accept-Encoding': 'gzip, br'})
+            response.get_data()
+            seconds = time.perf_counter() - started
+            response.close()
+            if i >= warmup:
+                latencies.append(seconds)
+                statuses.append(response.status_code)
+                queries.append(counter[0])
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_query)
+    return summarize(latencies, statuses, sum(latencies), queries)
+
+
+def measure_http(url, route, cookie, concurrency, duration):
+    _, method, path, form, authenticated = route
+    parts = urlsplit(url)
+    headers = {'Accept-Encoding': 'gzip, br'}
+    body = None
+    if authenticated:
+        headers['Cookie'] = cookie
+    if form is not None:
+        body = urlencode(form)
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+    results = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+        local = []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+                if response.will_close:
+                    connection.close()
+            except (OSError, http.client.HTTPException):
+                status = 'error'
+                connection.close()
+            local.append((time.perf_counter() - started, status))
+        connection.close()
+        with lock:
+            results.extend(local)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return summarize([seconds for seconds, _ in results], [status for _, status in results], elapsed)
+
+
+def start_server(spec):
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', spec], stdout=subprocess.PIPE, text=True)
+    port = process.stdout.readline().strip()
+    if not port.isdigit():
+        process.kill()
+        sys.exit(f'Server for {spec} failed to start')
+    return process, f'http://127.0.0.1:{port}'
+
+
+def serve(spec):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    # Keep-alive, so the load generator measures the app rather than TCP setup
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    WSGIRequestHandler.log_request = lambda *args, **kwargs: None
+    server = make_server('127.0.0.1', 0, load_app(spec), threaded=True)
+    # Exit normally on terminate so the password hashing pool's workers are shut down with us
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    print(server.server_port, flush=True)
+    server.serve_forever()
+
+
+def compare(results, baseline, tolerance):
+    """Print changes against baseline and return the regressions"""
+    regressions = []
+    print(f"\n{'route':<28} {'mode':<11} {'p95 before':>11} {'p95 now':>9} {'change':>8} {'queries':>9}")
+    for name, modes in results['routes'].items():
+        for mode, now in modes.items():
+            before = baseline.get('routes', {}).get(name, {}).get(mode)
+            if not before or before.get('p95_ms') is None or now.get('p95_ms') is None:
+                continue
+            change = now['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0
+            queries = f"{before.get('queries', '-')}->{now.get('queries', '-')}" if 'queries' in now else ''
+            flags = []
+            # Sub-millisecond differences are timer noise, whatever the ratio
+            if change > tolerance and now['p95_ms'] - before['p95_ms'] > 1:
+                flags.append('slower')
+            if now.get('queries', 0) > before.get('queries', now.get('queries', 0)):
+                flags.append('more queries')
+            if flags:
+                regressions.append((name, mode, flags))
+            print(f"{name:<28} {mode:<11} {before['p95_ms']:>11.1f} {now['p95_ms']:>9.1f} {change:>+8.0%} {queries:>9}"
+                  f"  {' '.join(flags)}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--app', default='simplified_app', choices=sorted(ROUTES))
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), 'directory_hub_routes.db'))
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--tools', type=int, default=20)
+    parser.add_argument('--businesses', type=int, default=1000000)
+    parser.add_argument('--activity-logs', type=int, default=10000000)
+    parser.add_argument('--route', action='append', help='Only routes whose name contains this (repeatable).')
+    parser.add_argument('--mode', choices=['both', 'in-process', 'http'], default='both')
+    parser.add_argument('--requests', type=int, default=50, help='Timed in-process requests per route.')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds of HTTP load per route.')
+    parser.add_argument('--url', help='Load-test this running server instead of starting one.')
+    parser.add_argument('--save', help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', help='Compare against results saved with --save.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed p95 growth before a route counts as slower.')
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # The server process inherits DATABASE_URL from this one
+    if args.serve:
+        return serve(args.serve)
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(args.db)}'
+
+    app = load_app(args.app)
+    db = app.extensions['sqlalchemy']
+    sizes = {'users': args.users, 'tools': args.tools, 'businesses': args.businesses, 'activity_logs': args.activity_logs}
+    seed(app, db, sizes)
+
+    routes = [route for route in ROUTES[args.app] if not args.route or any(part in route[0] for part in args.route)]
+    user_id = session_user_id(app, db)
+    with app.test_request_context():
+        session = app.session_interface.get_signing_serializer(app).dumps({'_user_id': user_id, '_fresh': True})
+    cookie = f"{app.config['SESSION_COOKIE_NAME']}={session}"
+
+    server = None
+    if args.mode != 'in-process' and not args.url:
+        server, args.url = start_server(args.app)
+
+    results = {'app': args.app, 'sizes': sizes, 'concurrency': args.concurrency, 'routes': {}}
+    print(f"\n{'route':<28} {'mode':<11} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'queries':>7}  statuses")
+    try:
+        for route in routes:
+            modes = results['routes'][route[0]] = {}
+            if args.mode != 'http':
+                modes['in-process'] = measure_in_process(app, db, route, user_id, args.requests)
+            if args.mode != 'in-process':
+                modes['http'] = measure_http(args.url, route, cookie, args.concurrency, args.duration)
+            for mode, summary in modes.items():
+                print(f"{route[0]:<28} {mode:<11} {summary['requests']:>8} {summary['rps']:>8.1f} "
+                      f"{summary['p50_ms'] or 0:>8.1f} {summary['p95_ms'] or 0:>8.1f} {summary['p99_ms'] or 0:>8.1f} "
+                      f"{summary.get('queries', ''):>7}  {summary['statuses']}", flush=True)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(f'\n{len(regressions)} regression(s) against {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
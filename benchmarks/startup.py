@@ -0,0 +1,80 @@
+"""Measure cold-start cost of the app entry points
+
+Each run starts a fresh Python process, imports the entry module and sends
+one request through its WSGI app, timing the import and the first response
+separately; the median over the runs is reported. This is what a serverless
+cold start pays before the first user sees a page.
+
+    python benchmarks/startup.py --runs 10
+    python benchmarks/startup.py --target wsgi:app:/api/test
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api')
+
+# module:attribute:path served on the first request
+TARGETS = {
+    'wsgi': 'wsgi:app:/api/test',
+    'simplified_app': 'simplified_app:app:/',
+}
+
+CHILD = """
+import importlib, json, sys, time
+started = time.perf_counter()
+module = importlib.import_module(sys.argv[1])
+imported = time.perf_counter()
+from werkzeug.test import Client
+response = Client(getattr(module, sys.argv[2])).get(sys.argv[3])
+response.close()
+responded = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_response_ms': (responded - imported) * 1000,
+    'status': response.status_code,
+    'modules': len(sys.modules),
+}))
+"""
+
+
+def run_once(spec, environ):
+    module, attribute, path = spec.split(':', 2)
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD, module, attribute, path],
+        cwd=API_DIR, env=environ, capture_output=True, text=True
+    )
+    if result.returncode:
+        sys.exit(f'{spec} failed:\n{result.stderr}')
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--target', action='append',
+                        help=f"module:attribute:path to measure (default: {', '.join(TARGETS)})")
+    args = parser.parse_args()
+
+    targets = args.target or list(TARGETS.values())
+    environ = dict(os.environ, PYTHONPATH=API_DIR)
+    environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.gettempdir(), 'directory_hub_startup.db')}")
+
+    print(f"{'target':<32} {'import ms':>10} {'first ms':>10} {'total ms':>10} {'modules':>8} {'status':>7}")
+    for spec in targets:
+        spec = TARGETS.get(spec, spec)
+        # Warm the bytecode cache so the runs measure startup rather than compilation
+        run_once(spec, environ)
+        results = [run_once(spec, environ) for _ in range(args.runs)]
+        import_ms = statistics.median(r['import_ms'] for r in results)
+        first_ms = statistics.median(r['first_response_ms'] for r in results)
+        print(f"{spec:<32} {import_ms:>10.1f} {first_ms:>10.1f} {import_ms + first_ms:>10.1f} "
+              f"{results[-1]['modules']:>8} {results[-1]['status']:>7}")
+
+
+if __name__ == '__main__':
+    main()